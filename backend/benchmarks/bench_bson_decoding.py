@@ -0,0 +1,52 @@
+"""
+Benchmark of decoding stored labs into JSON-compatible documents.
+
+Compares decoding with the default codec options followed by the recursive
+serialize_mongo_doc pass with decoding through JSON_CODEC_OPTIONS, which
+converts ObjectId and datetime values inside the BSON decoder.
+
+Run from the backend directory:
+
+    python benchmarks/bench_bson_decoding.py --sections 50 --modules 40
+"""
+import argparse
+import os
+import sys
+import time
+
+import bson
+from bson.codec_options import DEFAULT_CODEC_OPTIONS
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.mongo_utils import JSON_CODEC_OPTIONS, serialize_mongo_doc
+from bench_lab_serialization import make_lab
+
+def old_path(data: bytes) -> dict:
+    return serialize_mongo_doc(bson.decode(data, codec_options=DEFAULT_CODEC_OPTIONS))
+
+def codec_path(data: bytes) -> dict:
+    return bson.decode(data, codec_options=JSON_CODEC_OPTIONS)
+
+def measure(fn, data: bytes, repeat: int) -> float:
+    fn(data)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn(data)
+    return (time.perf_counter() - started) / repeat * 1000
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark BSON decoding of labs")
+    parser.add_argument("--sections", type=int, default=50)
+    parser.add_argument("--modules", type=int, default=40, help="Modules per section")
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    data = bson.encode(make_lab(args.sections, args.modules))
+    assert old_path(data) == codec_path(data)
+
+    old_ms = measure(old_path, data, args.repeat)
+    codec_ms = measure(codec_path, data, args.repeat)
+    print(f"Lab with {args.sections} sections x {args.modules} modules, {len(data) / 1024:.0f} KiB of BSON")
+    print(f"  decode + serialize_mongo_doc: {old_ms:8.2f} ms/lab")
+    print(f"  decode with codec options:    {codec_ms:8.2f} ms/lab  ({old_ms / codec_ms:.1f}x faster)")
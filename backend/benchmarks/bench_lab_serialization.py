@@ -0,0 +1,126 @@
+"""
+Benchmark of lab read serialization.
+
+Compares the per-lab cost of turning a stored lab document into response
+bytes on the old read path (serialize_mongo_doc, Lab(**doc), response_model
+validation and the stdlib JSON encoder, as FastAPI does for a dict returned
+with response_model=LabResponse) with the fast path used by GET /labs/{id}
+(trusted_payload plus FastJSONResponse).
+
+Run from the backend directory:
+
+    python benchmarks/bench_lab_serialization.py --sections 50 --modules 40
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime
+
+from bson import ObjectId
+from pydantic import TypeAdapter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.lab import Lab, LabResponse
+from utils.mongo_utils import serialize_mongo_doc
+from utils.fast_responses import FastJSONResponse, trusted_payload, orjson
+
+def make_module(section_index: int, module_index: int) -> dict:
+    kind = ("text", "quiz", "image", "simulation")[module_index % 4]
+    module = {
+        "id": str(uuid.uuid4()),
+        "type": kind,
+        "title": f"Module {section_index}.{module_index}",
+        "order": module_index
+    }
+    if kind == "text":
+        module["content"] = "<p>" + "Lorem ipsum dolor sit amet. " * 40 + "</p>"
+    elif kind == "quiz":
+        module["questions"] = [
+            {
+                "text": f"Question {q}?",
+                "type": "multiple-choice",
+                "options": [{"text": f"Option {o}", "isCorrect": o == 0} for o in range(4)],
+                "points": 1,
+                "explanation": "Because."
+            }
+            for q in range(5)
+        ]
+    elif kind == "image":
+        module.update(url="https://example.com/image.png", altText="An image", caption="Caption")
+    else:
+        module.update(
+            description="A simulation",
+            htmlContent=None,
+            jsonStructure=None,
+            htmlContentRef=uuid.uuid4().hex * 2,
+            jsonStructureRef=None
+        )
+    return module
+
+def make_lab(sections: int, modules: int) -> dict:
+    """A synthetic stored lab document, as returned by Motor"""
+    now = datetime.now().isoformat()
+    return {
+        "_id": ObjectId(),
+        "id": str(uuid.uuid4()),
+        "title": "Benchmark lab",
+        "description": "Synthetic lab used to benchmark serialization",
+        "author": {"id": str(uuid.uuid4()), "name": "Bench", "email": "bench@example.com"},
+        "sections": [
+            {
+                "id": str(uuid.uuid4()),
+                "title": f"Section {s}",
+                "order": s,
+                "modules": [make_module(s, m) for m in range(modules)]
+            }
+            for s in range(sections)
+        ],
+        "status": "draft",
+        "isPublished": False,
+        "createdAt": now,
+        "updatedAt": now,
+        "version": 7
+    }
+
+RESPONSE_ADAPTER = TypeAdapter(LabResponse)
+
+def old_path(doc: dict) -> bytes:
+    lab = Lab(**serialize_mongo_doc(doc))
+    # FastAPI dumps the returned models, validates the result against the
+    # response model, serializes it and encodes it with json.dumps
+    content = {"success": True, "data": lab.model_dump(), "error": None}
+    validated = RESPONSE_ADAPTER.validate_python(content)
+    dumped = RESPONSE_ADAPTER.dump_python(validated, mode="json")
+    return json.dumps(dumped, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+def fast_path(doc: dict) -> bytes:
+    return FastJSONResponse({"success": True, "data": trusted_payload(Lab, doc), "error": None}).body
+
+def measure(fn, doc: dict, repeat: int) -> float:
+    fn(doc)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn(doc)
+    return (time.perf_counter() - started) / repeat * 1000
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark lab read serialization")
+    parser.add_argument("--sections", type=int, default=50)
+    parser.add_argument("--modules", type=int, default=40, help="Modules per section")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    doc = make_lab(args.sections, args.modules)
+    assert json.loads(old_path(doc)) == json.loads(fast_path(doc))
+
+    size = len(fast_path(doc))
+    old_ms = measure(old_path, doc, args.repeat)
+    fast_ms = measure(fast_path, doc, args.repeat)
+    print(f"Lab with {args.sections} sections x {args.modules} modules, {size / 1024:.0f} KiB of JSON")
+    print(f"Encoder: {'orjson' if orjson is not None else 'json (orjson not installed)'}")
+    print(f"  old path:  {old_ms:8.2f} ms/lab")
+    print(f"  fast path: {fast_ms:8.2f} ms/lab  ({old_ms / fast_ms:.1f}x faster)")
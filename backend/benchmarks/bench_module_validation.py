@@ -0,0 +1,57 @@
+"""
+Benchmark of lab validation with discriminated module models.
+
+Compares validating a large synthetic lab when Section.modules is the
+"type"-discriminated Module union (pydantic-core dispatches on the tag) with
+a plain union of the same models (pydantic-core tries members in turn).
+
+Run from the backend directory:
+
+    python benchmarks/bench_module_validation.py --sections 50 --modules 40
+"""
+import argparse
+import os
+import sys
+import time
+from typing import List, Union
+
+from pydantic import TypeAdapter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.lab import (
+    Lab, Section, TextModule, QuizModule, ImageModule, VideoModule, SimulationModule
+)
+from bench_lab_serialization import make_lab
+
+class PlainUnionSection(Section):
+    modules: List[Union[TextModule, QuizModule, ImageModule, VideoModule, SimulationModule]] = []
+
+class PlainUnionLab(Lab):
+    sections: List[PlainUnionSection] = []
+
+def measure(adapter: TypeAdapter, doc: dict, repeat: int) -> float:
+    adapter.validate_python(doc)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        adapter.validate_python(doc)
+    return (time.perf_counter() - started) / repeat * 1000
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark lab validation")
+    parser.add_argument("--sections", type=int, default=50)
+    parser.add_argument("--modules", type=int, default=40, help="Modules per section")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    doc = make_lab(args.sections, args.modules)
+    doc.pop("_id")
+    discriminated = TypeAdapter(Lab)
+    plain = TypeAdapter(PlainUnionLab)
+    assert discriminated.validate_python(doc).model_dump() == plain.validate_python(doc).model_dump()
+
+    plain_ms = measure(plain, doc, args.repeat)
+    discriminated_ms = measure(discriminated, doc, args.repeat)
+    print(f"Lab with {args.sections} sections x {args.modules} modules")
+    print(f"  plain union:         {plain_ms:8.2f} ms/lab")
+    print(f"  discriminated union: {discriminated_ms:8.2f} ms/lab  ({plain_ms / discriminated_ms:.1f}x faster)")
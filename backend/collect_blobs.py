@@ -0,0 +1,30 @@
+"""
+Script to garbage-collect unreferenced simulation blobs.
+
+Recounts blob references from the labs (fixing any drift), then deletes blobs
+that have had no references for longer than the grace period.
+"""
+import argparse
+import asyncio
+
+from utils.blob_store import blob_store, BLOB_GC_GRACE_SECONDS
+
+async def run_collection(grace_seconds: int, reconcile: bool):
+    if blob_store is None:
+        print("Blob store is disabled (BLOB_STORE=inline); nothing to collect")
+        return
+    if reconcile:
+        changed = await blob_store.reconcile_refcounts()
+        print(f"Corrected reference counts of {changed} blobs")
+    deleted = await blob_store.collect_garbage(grace_seconds)
+    print(f"Deleted {deleted} unreferenced blobs")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Garbage-collect simulation blobs")
+    parser.add_argument("--grace-seconds", type=int, default=BLOB_GC_GRACE_SECONDS,
+                        help="Only delete blobs unreferenced for at least this long")
+    parser.add_argument("--no-reconcile", action="store_true", help="Skip recounting references")
+    args = parser.parse_args()
+    
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(run_collection(args.grace_seconds, not args.no_reconcile))
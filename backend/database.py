@@ -1,9 +1,13 @@
 from motor.motor_asyncio import AsyncIOMotorClient
 from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime, timedelta
 import os
 import logging
 from dotenv import load_dotenv
 
+from utils.mongo_utils import JSON_CODEC_OPTIONS
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -15,26 +19,55 @@ load_dotenv()
 MONGODB_URL = os.getenv("MONGODB_URL", "mongodb://localhost:27017")
 DATABASE_NAME = os.getenv("DATABASE_NAME", "one_click_labs")
 
+# Migrations entry recording that the lab counters were built
+LAB_COUNTERS_MIGRATION_ID = "lab_counters"
+# A claimed counter build that has not finished by then is claimed again
+LAB_COUNTERS_CLAIM_SECONDS = 600
+
 # Create a client instance
 client = None
 database = None
 labs_collection = None
 users_collection = None
+lab_counters_collection = None
+sections_collection = None
+modules_collection = None
+migrations_collection = None
+lab_builds_collection = None
+build_fragments_collection = None
+deployments_collection = None
+lab_versions_collection = None
+public_snapshots_collection = None
+lab_outlines_collection = None
 
 # Initialize database connection
 def init_db():
-    global client, database, labs_collection, users_collection
+    global client, database, labs_collection, users_collection, lab_counters_collection
+    global sections_collection, modules_collection, migrations_collection
+    global lab_builds_collection, build_fragments_collection, deployments_collection
+    global lab_versions_collection, public_snapshots_collection, lab_outlines_collection
     
     try:
         client = AsyncIOMotorClient(MONGODB_URL)
         # Ping the server to validate connection
         client.admin.command('ping')
         logger.info("Successfully connected to MongoDB")
-        database = client[DATABASE_NAME]
+        # ObjectId and datetime values are converted while decoding
+        database = client.get_database(DATABASE_NAME, codec_options=JSON_CODEC_OPTIONS)
         
         # Initialize collections
         labs_collection = database.get_collection("labs")
         users_collection = database.get_collection("users")
+        lab_counters_collection = database.get_collection("lab_counters")
+        sections_collection = database.get_collection("sections")
+        modules_collection = database.get_collection("modules")
+        migrations_collection = database.get_collection("migrations")
+        lab_builds_collection = database.get_collection("lab_builds")
+        build_fragments_collection = database.get_collection("build_fragments")
+        deployments_collection = database.get_collection("deployments")
+        lab_versions_collection = database.get_collection("lab_versions")
+        public_snapshots_collection = database.get_collection("public_snapshots")
+        lab_outlines_collection = database.get_collection("lab_outlines")
     except Exception as e:
         logger.error(f"Failed to connect to MongoDB: {e}")
         raise
@@ -53,6 +86,57 @@ def get_labs_collection():
 def get_users_collection():
     return users_collection
 
+def get_lab_counters_collection():
+    return lab_counters_collection
+
+def get_sections_collection():
+    return sections_collection
+
+def get_modules_collection():
+    return modules_collection
+
+def get_migrations_collection():
+    return migrations_collection
+
+def get_lab_builds_collection():
+    return lab_builds_collection
+
+def get_build_fragments_collection():
+    return build_fragments_collection
+
+def get_deployments_collection():
+    return deployments_collection
+
+def get_lab_versions_collection():
+    return lab_versions_collection
+
+def get_public_snapshots_collection():
+    return public_snapshots_collection
+
+def get_lab_outlines_collection():
+    return lab_outlines_collection
+
+# Compound indexes backing the keyset-paginated lab listing, sorted by
+# (updatedAt, id) descending with and without a status filter
+LAB_LISTING_INDEX = [("author.id", 1), ("updatedAt", -1), ("id", -1)]
+LAB_STATUS_LISTING_INDEX = [("author.id", 1), ("status", 1), ("updatedAt", -1), ("id", -1)]
+
+# Indexes for normalized lab storage; documents are grouped per lab by
+# content generation and kept in array order by position
+SECTION_STORAGE_INDEX = [("labId", 1), ("generation", 1), ("position", 1)]
+MODULE_STORAGE_INDEX = [("labId", 1), ("generation", 1), ("sectionId", 1), ("position", 1)]
+
+# Deploy job indexes: workers claim the oldest runnable job, and a lab can
+# have at most one queued job at a time
+DEPLOYMENT_QUEUE_INDEX = [("status", 1), ("availableAt", 1), ("createdAt", 1)]
+DEPLOYMENT_QUEUED_LAB_FILTER = {"status": "queued"}
+
+# Lab version history, one document per recorded version
+LAB_VERSION_INDEX = [("labId", 1), ("version", -1)]
+
+# Index used by blob garbage collection to find unreferenced blobs
+BLOB_GC_INDEX = [("state", 1), ("refCount", 1), ("lastReferencedAt", 1)]
+
 # Create indexes synchronously
 def create_indexes_sync():
     """Create MongoDB indexes synchronously using PyMongo (not Motor)"""
@@ -61,14 +145,41 @@ def create_indexes_sync():
         sync_client = MongoClient(MONGODB_URL)
         sync_db = sync_client[DATABASE_NAME]
         
-        # User indexes
+        # User indexes (updatedAt is polled for cache invalidation)
         sync_db.users.create_index("email", unique=True)
+        sync_db.users.create_index("updatedAt")
         
         # Lab indexes
         sync_db.labs.create_index("id", unique=True)
         sync_db.labs.create_index("author.id")
         sync_db.labs.create_index("status")
         sync_db.labs.create_index([("title", "text"), ("description", "text")])
+        sync_db.labs.create_index(LAB_LISTING_INDEX)
+        sync_db.labs.create_index(LAB_STATUS_LISTING_INDEX)
+        sync_db.labs.create_index("updatedAt")
+        
+        # Lab counter indexes
+        sync_db.lab_counters.create_index("authorId", unique=True)
+        
+        # Normalized section/module indexes
+        sync_db.sections.create_index(SECTION_STORAGE_INDEX)
+        sync_db.modules.create_index(MODULE_STORAGE_INDEX)
+        
+        # Blob store garbage collection index
+        sync_db.blobs.create_index(BLOB_GC_INDEX)
+        
+        # Rendered fragment cache, pruned per lab after every build
+        sync_db.build_fragments.create_index("labId")
+        
+        # Deploy job indexes
+        sync_db.deployments.create_index("id", unique=True)
+        sync_db.deployments.create_index(DEPLOYMENT_QUEUE_INDEX)
+        sync_db.deployments.create_index(
+            "labId", unique=True, partialFilterExpression=DEPLOYMENT_QUEUED_LAB_FILTER
+        )
+        
+        # Lab version history
+        sync_db.lab_versions.create_index(LAB_VERSION_INDEX, unique=True)
         
         logger.info("MongoDB indexes created successfully (sync)")
         sync_client.close()
@@ -80,16 +191,109 @@ def create_indexes_sync():
 async def create_indexes():
     """Create MongoDB indexes asynchronously using Motor"""
     try:
-        # User indexes
+        # User indexes (updatedAt is polled for cache invalidation)
         await get_users_collection().create_index("email", unique=True)
+        await get_users_collection().create_index("updatedAt")
         
         # Lab indexes
         await get_labs_collection().create_index("id", unique=True)
         await get_labs_collection().create_index("author.id")
         await get_labs_collection().create_index("status")
         await get_labs_collection().create_index([("title", "text"), ("description", "text")])
+        await get_labs_collection().create_index(LAB_LISTING_INDEX)
+        await get_labs_collection().create_index(LAB_STATUS_LISTING_INDEX)
+        await get_labs_collection().create_index("updatedAt")
+        
+        # Lab counter indexes
+        await get_lab_counters_collection().create_index("authorId", unique=True)
+        
+        # Normalized section/module indexes
+        await get_sections_collection().create_index(SECTION_STORAGE_INDEX)
+        await get_modules_collection().create_index(MODULE_STORAGE_INDEX)
+        
+        # Blob store garbage collection index
+        await get_database().blobs.create_index(BLOB_GC_INDEX)
+        
+        # Rendered fragment cache, pruned per lab after every build
+        await get_build_fragments_collection().create_index("labId")
+        
+        # Deploy job indexes
+        await get_deployments_collection().create_index("id", unique=True)
+        await get_deployments_collection().create_index(DEPLOYMENT_QUEUE_INDEX)
+        await get_deployments_collection().create_index(
+            "labId", unique=True, partialFilterExpression=DEPLOYMENT_QUEUED_LAB_FILTER
+        )
+        
+        # Lab version history
+        await get_lab_versions_collection().create_index(LAB_VERSION_INDEX, unique=True)
         
         logger.info("MongoDB indexes created successfully (async)")
     except Exception as e:
         logger.error(f"Failed to create MongoDB indexes (async): {e}")
         raise
+
+# Rebuild per-author lab counters synchronously
+def rebuild_lab_counters_sync():
+    """
+    Recompute the per-author/per-status lab counters from the labs collection.
+    Counter updates made by the API while it runs can be overwritten, so run
+    it (see rebuild_counters.py) while labs are not being created or deleted.
+    """
+    try:
+        sync_client = MongoClient(MONGODB_URL)
+        sync_db = sync_client[DATABASE_NAME]
+        
+        counters = {}
+        pipeline = [
+            {"$group": {
+                "_id": {"authorId": "$author.id", "status": "$status"},
+                "count": {"$sum": 1}
+            }}
+        ]
+        for row in sync_db.labs.aggregate(pipeline):
+            author_id = row["_id"].get("authorId")
+            status = row["_id"].get("status") or "draft"
+            counter = counters.setdefault(author_id, {"authorId": author_id, "total": 0, "counts": {}})
+            counter["total"] += row["count"]
+            counter["counts"][status] = counter["counts"].get(status, 0) + row["count"]
+        
+        for author_id, counter in counters.items():
+            sync_db.lab_counters.replace_one({"authorId": author_id}, counter, upsert=True)
+        sync_db.lab_counters.delete_many({"authorId": {"$nin": list(counters.keys())}})
+        
+        logger.info(f"Rebuilt lab counters for {len(counters)} authors (sync)")
+        sync_client.close()
+    except Exception as e:
+        logger.error(f"Failed to rebuild lab counters (sync): {e}")
+        raise
+
+# Build the lab counters once per database
+def ensure_lab_counters_sync():
+    """
+    Build the lab counters if they were never built, so they are correct for
+    labs written before they existed. Called at startup by every worker;
+    the first one claims the build in the migrations collection and the
+    others (and all later starts) skip it.
+    """
+    sync_client = MongoClient(MONGODB_URL)
+    try:
+        migrations = sync_client[DATABASE_NAME].migrations
+        now = datetime.now()
+        stale = (now - timedelta(seconds=LAB_COUNTERS_CLAIM_SECONDS)).isoformat()
+        try:
+            # Matches no document when the build is done or claimed by a
+            # running worker; the upsert then fails on the existing _id
+            migrations.update_one(
+                {"_id": LAB_COUNTERS_MIGRATION_ID, "completed": False, "startedAt": {"$lt": stale}},
+                {"$set": {"completed": False, "startedAt": now.isoformat()}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            return
+        rebuild_lab_counters_sync()
+        migrations.update_one(
+            {"_id": LAB_COUNTERS_MIGRATION_ID},
+            {"$set": {"completed": True, "updatedAt": datetime.now().isoformat()}}
+        )
+    finally:
+        sync_client.close()
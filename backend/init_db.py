@@ -17,10 +17,18 @@ DATABASE_NAME = os.getenv("DATABASE_NAME", "one_click_labs")
 COLLECTIONS = [
     "users",
     "labs",
+    "lab_counters",
     "sections",
     "modules",
     "deployments",
-    "refresh_tokens"
+    "refresh_tokens",
+    "migrations",
+    "lab_builds",
+    "build_fragments",
+    "lab_versions",
+    "public_snapshots",
+    "lab_outlines",
+    "blobs"
 ]
 
 async def init_database():
@@ -52,21 +60,51 @@ async def init_database():
         print("Creating indexes for users collection...")
         await db.users.create_index("email", unique=True)
         await db.users.create_index("id", unique=True)
+        await db.users.create_index("updatedAt")
         
         # Create indexes for labs collection
         print("Creating indexes for labs collection...")
         await db.labs.create_index("id", unique=True)
         await db.labs.create_index("author.id")
+        await db.labs.create_index("status")
+        await db.labs.create_index([("title", "text"), ("description", "text")])
+        await db.labs.create_index([("author.id", 1), ("updatedAt", -1), ("id", -1)])
+        await db.labs.create_index([("author.id", 1), ("status", 1), ("updatedAt", -1), ("id", -1)])
+        await db.labs.create_index("updatedAt")
+        
+        # Create indexes for lab_counters collection
+        print("Creating indexes for lab_counters collection...")
+        await db.lab_counters.create_index("authorId", unique=True)
         
         # Create indexes for sections collection
         print("Creating indexes for sections collection...")
-        await db.sections.create_index("id", unique=True)
-        await db.sections.create_index("labId")
+        await db.sections.create_index([("labId", 1), ("generation", 1), ("position", 1)])
         
         # Create indexes for modules collection
         print("Creating indexes for modules collection...")
-        await db.modules.create_index("id", unique=True)
-        await db.modules.create_index("sectionId")
+        await db.modules.create_index([("labId", 1), ("generation", 1), ("sectionId", 1), ("position", 1)])
+        
+        # Create indexes for blobs collection
+        print("Creating indexes for blobs collection...")
+        await db.blobs.create_index([("state", 1), ("refCount", 1), ("lastReferencedAt", 1)])
+        
+        # Create indexes for build_fragments collection
+        print("Creating indexes for build_fragments collection...")
+        await db.build_fragments.create_index("labId")
+        
+        # Create indexes for deployments collection
+        print("Creating indexes for deployments collection...")
+        await db.deployments.create_index("id", unique=True)
+        await db.deployments.create_index([("status", 1), ("availableAt", 1), ("createdAt", 1)])
+        await db.deployments.create_index(
+            "labId", unique=True, partialFilterExpression={"status": "queued"}
+        )
+        
+        # Create indexes for lab_versions collection
+        print("Creating indexes for lab_versions collection...")
+        await db.lab_versions.create_index([("labId", 1), ("version", -1)], unique=True)
+        
+        # lab_outlines and public_snapshots are keyed by lab id (_id)
         
         # Create indexes for refresh_tokens collection
         print("Creating indexes for refresh_tokens collection...")
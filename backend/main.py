@@ -13,9 +13,15 @@ from routes.auth import router as auth_router
 from routes.labs import router as labs_router
 from routes.ai import router as ai_router
 from routes.simulation import router as simulation_router
+from routes.deployments import router as deployments_router
+from routes.public import router as public_router
 
 # Import database
-from database import create_indexes, create_indexes_sync
+from database import create_indexes, create_indexes_sync, ensure_lab_counters_sync
+from utils.deploy_jobs import deploy_workers
+from utils.lab_cache import lab_cache
+from utils.cache_invalidation import invalidation_registry, invalidation_listener
+from utils.autosave import autosave_buffer
 
 # Load environment variables
 load_dotenv()
@@ -59,16 +65,28 @@ app.include_router(auth_router, prefix="/api/v1", tags=["Authentication"])
 app.include_router(labs_router, prefix="/api/v1", tags=["Labs"])
 app.include_router(ai_router, prefix="/api/v1", tags=["AI"])
 app.include_router(simulation_router, prefix="/api/v1", tags=["Simulation"])
+app.include_router(deployments_router, prefix="/api/v1", tags=["Deployments"])
+app.include_router(public_router, prefix="/api/v1", tags=["Public"])
+
+# Drop cached labs changed by any process
+invalidation_registry.subscribe("labs", lab_cache.handle_invalidation)
 
 @app.on_event("startup")
 async def startup_db_client():
     logger.info("Starting up application...")
     # Use synchronous index creation to avoid event loop issues
     create_indexes_sync()
+    ensure_lab_counters_sync()
+    deploy_workers.start()
+    invalidation_listener.start()
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
     logger.info("Shutting down application...")
+    # Acknowledged autosaves must reach the database before exiting
+    await autosave_buffer.flush_all()
+    await deploy_workers.stop()
+    await invalidation_listener.stop()
 
 @app.get("/")
 async def root():
@@ -81,7 +99,10 @@ async def status():
         "status": "online",
         "version": "1.0.0",
         "authBypass": auth_bypass,
-        "environment": os.getenv("ENVIRONMENT", "development")
+        "environment": os.getenv("ENVIRONMENT", "development"),
+        "labCache": lab_cache.stats(),
+        "cacheInvalidation": invalidation_listener.stats(),
+        "autosave": autosave_buffer.stats()
     }
 
 if __name__ == "__main__":
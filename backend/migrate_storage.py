@@ -0,0 +1,25 @@
+"""
+Script to migrate labs from embedded sections to normalized storage.
+
+Run the API with LAB_STORAGE_MODE=normalized first, so labs edited while the
+migration runs are written in the new layout, then run this script. It works
+in batches and checkpoints its progress, so it can be interrupted and resumed.
+"""
+import argparse
+import asyncio
+
+from utils.lab_storage import migrate_labs
+
+async def run_migration(batch_size: int, restart: bool):
+    print(f"Migrating labs to normalized storage (batch size {batch_size})...")
+    migrated = await migrate_labs(batch_size=batch_size, restart=restart)
+    print(f"Migrated {migrated} labs")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate labs to normalized storage")
+    parser.add_argument("--batch-size", type=int, default=100, help="Labs per batch")
+    parser.add_argument("--restart", action="store_true", help="Ignore the saved checkpoint")
+    args = parser.parse_args()
+    
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(run_migration(args.batch_size, args.restart))
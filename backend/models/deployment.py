@@ -0,0 +1,26 @@
+from pydantic import BaseModel
+from typing import Optional
+
+from models.lab import BuildReport
+
+class Deployment(BaseModel):
+    """A deploy job and its progress"""
+    id: str
+    labId: str
+    status: str = "queued"  # "queued", "running", "succeeded", or "failed"
+    stage: Optional[str] = None  # "rendering" or "publishing" while running
+    attempts: int = 0
+    deploymentUrl: Optional[str] = None
+    deployedVersion: Optional[int] = None
+    build: Optional[BuildReport] = None
+    error: Optional[str] = None
+    createdAt: str
+    updatedAt: str
+    startedAt: Optional[str] = None
+    finishedAt: Optional[str] = None
+
+class DeploymentResponse(BaseModel):
+    """Response model for returning a deploy job"""
+    success: bool
+    data: Optional[Deployment] = None
+    error: Optional[str] = None
@@ -1,61 +1,83 @@
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any, Union
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter
+from typing import Annotated, List, Literal, Optional, Dict, Any, Union
 from datetime import datetime
 import uuid
 
 # Option model for quiz questions
 class Option(BaseModel):
+    # Editor-specific fields (e.g. option ids) are kept as sent
+    model_config = ConfigDict(extra="allow")
+
     text: str
-    isCorrect: bool
+    isCorrect: bool = False
 
 # Quiz question model
 class QuizQuestion(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
     text: str
     type: str = "multiple-choice"
-    options: List[Option]
+    options: List[Option] = []
     points: int = 1
     explanation: Optional[str] = None
 
 # Module models
 class ModuleBase(BaseModel):
+    # Editor-specific fields (e.g. format, passingScore) are kept as sent
+    model_config = ConfigDict(extra="allow")
+
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     type: str
     title: str
     order: int
 
 class TextModule(ModuleBase):
-    type: str = "text"
+    type: Literal["text"] = "text"
     content: str
 
 class QuizModule(ModuleBase):
-    type: str = "quiz"
+    type: Literal["quiz"] = "quiz"
     questions: List[QuizQuestion]
 
 class ImageModule(ModuleBase):
-    type: str = "image"
+    type: Literal["image"] = "image"
     url: str
     altText: Optional[str] = None
     caption: Optional[str] = None
 
 class VideoModule(ModuleBase):
-    type: str = "video"
+    type: Literal["video"] = "video"
     url: str
     provider: Optional[str] = None
     caption: Optional[str] = None
 
 class SimulationModule(ModuleBase):
-    type: str = "simulation"
-    htmlContent: str
+    type: Literal["simulation"] = "simulation"
+    htmlContent: Optional[str] = None
     description: Optional[str] = None
-    jsonStructure: Optional[Dict[str, Any]] = None
+    jsonStructure: Optional[Union[Dict[str, Any], str]] = None
+    # Content-addressed blob keys used when the content is kept in the blob store
+    htmlContentRef: Optional[str] = None
+    jsonStructureRef: Optional[str] = None
 
-# Union type for modules
-Module = Union[TextModule, QuizModule, ImageModule, VideoModule, SimulationModule]
+# Union type for modules, discriminated by "type" so validation goes
+# straight to the matching model instead of trying each one in turn
+Module = Annotated[
+    Union[TextModule, QuizModule, ImageModule, VideoModule, SimulationModule],
+    Field(discriminator="type")
+]
 
 # Section model
 class Section(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     title: str
     order: int
-    modules: List[Any] = []  # Can contain any module type
+    modules: List[Module] = []
+
+# Validates and dumps section lists taken from raw request bodies
+sections_adapter = TypeAdapter(List[Section])
+# Validates a single module against the model for its type
+module_adapter = TypeAdapter(Module)
 
 # Author model
 class Author(BaseModel):
@@ -87,6 +109,7 @@ class Lab(LabBase):
     updatedAt: str = Field(default_factory=lambda: datetime.now().isoformat())
     publishedAt: Optional[str] = None
     deploymentUrl: Optional[str] = None
+    version: int = 0  # Incremented on every write, exposed as the ETag
 
     class Config:
         json_schema_extra = {
@@ -116,7 +139,8 @@ class Lab(LabBase):
                 "status": "draft",
                 "isPublished": False,
                 "createdAt": "2023-01-01T00:00:00Z",
-                "updatedAt": "2023-01-01T00:00:00Z"
+                "updatedAt": "2023-01-01T00:00:00Z",
+                "version": 0
             }
         }
 
@@ -130,14 +154,106 @@ class LabResponse(BaseModel):
     data: Lab
     error: Optional[str] = None
 
+class BuildReport(BaseModel):
+    """What a static-site build re-rendered and what it reused from cache"""
+    rebuiltSections: List[str] = []
+    rebuiltModules: List[str] = []
+    reusedSections: int = 0
+    reusedModules: int = 0
+    durationMs: float = 0
+
+class SectionResponse(BaseModel):
+    """Response model for returning a single section"""
+    success: bool
+    data: Optional[Section] = None
+    error: Optional[str] = None
+
+class ModuleResponse(BaseModel):
+    """Response model for returning a single module"""
+    success: bool
+    data: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+
 class PaginationInfo(BaseModel):
     total: int
     page: int
     pages: int
     limit: int
+    nextCursor: Optional[str] = None
+
+class LabSummary(BaseModel):
+    """Lightweight lab representation used by the dashboard listing"""
+    id: str
+    title: str
+    description: str
+    status: str = "draft"
+    isPublished: bool = False
+    sectionCount: int = 0
+    moduleCount: int = 0
+    createdAt: Optional[str] = None
+    updatedAt: str
+
+class LabSummaryResponse(BaseModel):
+    """Response model for returning a single lab summary"""
+    success: bool
+    data: Optional[LabSummary] = None
+    error: Optional[str] = None
+
+class LabVersion(BaseModel):
+    """A recorded version in a lab's history"""
+    version: int
+    kind: str  # "keyframe" or "diff"
+    size: int = 0
+    author: Optional[Dict[str, Any]] = None
+    createdAt: Optional[str] = None
+
+class LabVersionsResponse(BaseModel):
+    success: bool
+    data: Optional[List[LabVersion]] = None
+    error: Optional[str] = None
+
+class LabVersionContent(BaseModel):
+    """A lab's content as it was at a recorded version"""
+    version: int
+    title: Optional[str] = None
+    description: Optional[str] = None
+    sections: List[Dict[str, Any]] = []
+
+class LabVersionContentResponse(BaseModel):
+    success: bool
+    data: Optional[LabVersionContent] = None
+    error: Optional[str] = None
+
+class OutlineModule(BaseModel):
+    id: str
+    title: Optional[str] = None
+    type: Optional[str] = None
+    order: Optional[int] = None
+
+class OutlineSection(BaseModel):
+    id: str
+    title: Optional[str] = None
+    order: Optional[int] = None
+    modules: List[OutlineModule] = []
+
+class LabOutline(BaseModel):
+    """Titles, types and order of a lab's sections and modules"""
+    id: str
+    title: Optional[str] = None
+    version: int = 0
+    sections: List[OutlineSection] = []
+
+class LabOutlineResponse(BaseModel):
+    success: bool
+    data: Optional[LabOutline] = None
+    error: Optional[str] = None
+
+class LabCloneRequest(BaseModel):
+    # Defaults to "Copy of <source title>"
+    title: Optional[str] = None
 
 class LabsData(BaseModel):
-    labs: List[Lab]
+    labs: List[Union[Lab, LabSummary]]
     pagination: PaginationInfo
 
 class LabsResponse(BaseModel):
@@ -145,3 +261,53 @@ class LabsResponse(BaseModel):
     success: bool
     data: LabsData
     error: Optional[str] = None
+
+# Bulk operations
+class BulkCreateOperation(LabBase):
+    op: Literal["create"]
+
+class BulkUpdateOperation(BaseModel):
+    """Update of a lab's metadata; content is changed through update-content"""
+    op: Literal["update"]
+    id: str
+    title: Optional[str] = None
+    description: Optional[str] = None
+    status: Optional[str] = None
+    # Only apply if the lab is still at this version, like If-Match
+    version: Optional[int] = None
+
+class BulkDeleteOperation(BaseModel):
+    op: Literal["delete"]
+    id: str
+    version: Optional[int] = None
+
+BulkLabOperation = Annotated[
+    Union[BulkCreateOperation, BulkUpdateOperation, BulkDeleteOperation],
+    Field(discriminator="op")
+]
+
+# Validates operations one at a time so each gets its own result
+bulk_operation_adapter = TypeAdapter(BulkLabOperation)
+
+class BulkLabRequest(BaseModel):
+    # Items are validated one by one, so a malformed item only fails itself
+    operations: List[Any]
+
+class BulkLabResult(BaseModel):
+    index: int
+    op: Optional[str] = None
+    id: Optional[str] = None
+    success: bool
+    version: Optional[int] = None
+    error: Optional[str] = None
+
+class BulkLabData(BaseModel):
+    results: List[BulkLabResult]
+    succeeded: int
+    failed: int
+
+class BulkLabResponse(BaseModel):
+    """Response model for bulk lab operations, with one result per operation"""
+    success: bool
+    data: Optional[BulkLabData] = None
+    error: Optional[str] = None
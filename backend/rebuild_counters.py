@@ -0,0 +1,15 @@
+"""
+Script to rebuild the per-author lab counters from the labs collection.
+
+The API builds the counters once, the first time it starts against a
+database. Run this to rebuild them afterwards, e.g. after labs were restored
+from a backup or changed directly in the database. Counter updates made by
+the API while it runs can be overwritten, so run it while labs are not being
+created or deleted.
+"""
+from database import rebuild_lab_counters_sync
+
+if __name__ == "__main__":
+    print("Rebuilding lab counters...")
+    rebuild_lab_counters_sync()
+    print("Lab counters rebuilt")
@@ -0,0 +1,48 @@
+from fastapi import APIRouter, Depends, Path
+from typing import Annotated
+import logging
+
+from models.deployment import Deployment, DeploymentResponse
+from models.user import User
+from utils.auth_bypass import get_user_dependency
+from utils.deploy_jobs import get_deployment
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Initialize router
+router = APIRouter(tags=["deployments"])
+
+# Get the appropriate user dependency
+current_user_dependency = get_user_dependency()
+
+@router.get("/deployments/{job_id}", response_model=DeploymentResponse)
+async def get_deployment_status(
+    job_id: str = Path(..., title="The ID of the deploy job"),
+    current_user: Annotated[User, Depends(current_user_dependency)] = None
+):
+    """
+    Get the status and progress of a deploy job
+    """
+    try:
+        job = await get_deployment(job_id)
+        if not job or (job.pop("authorId", None) != current_user.id and current_user.role != "admin"):
+            return {
+                "success": False,
+                "data": None,
+                "error": "Deployment not found"
+            }
+        
+        return {
+            "success": True,
+            "data": Deployment(**job),
+            "error": None
+        }
+    except Exception as e:
+        logger.error(f"Error getting deployment: {e}")
+        return {
+            "success": False,
+            "data": None,
+            "error": str(e)
+        }
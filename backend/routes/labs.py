@@ -1,5 +1,6 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, Path
+from fastapi import APIRouter, Depends, HTTPException, Query, Path, Header, Response
 from typing import Optional, List, Annotated, Dict, Any
+from pydantic import ValidationError
 from datetime import datetime
 import uuid
 import logging
@@ -7,19 +8,42 @@ import logging
 from models.lab import (
     Lab, LabCreate, LabUpdate, LabResponse, LabsResponse,
     Section, TextModule, QuizModule, ImageModule, VideoModule,
-    PaginationInfo, LabsData
+    PaginationInfo, LabSummary, SectionResponse, ModuleResponse, sections_adapter,
+    BulkLabRequest, BulkLabResponse, LabCloneRequest, LabSummaryResponse,
+    LabVersionsResponse, LabVersionContentResponse, LabOutlineResponse
 )
+from models.deployment import Deployment, DeploymentResponse
 from models.user import User
-from database import get_labs_collection, get_users_collection
+from database import get_labs_collection, get_users_collection, get_lab_counters_collection
 from utils.auth_bypass import get_user_dependency
 from routes.auth import get_current_user
-from utils.mongo_utils import serialize_mongo_doc
-from fastapi.responses import FileResponse
-import zipfile
-import io
-import os
-from pathlib import Path
-import shutil
+from utils.pagination import encode_cursor, keyset_filter
+from utils.lab_access import lab_scope, lab_access_filter, probe_lab, describe_access_failure
+from utils.lab_mutations import (
+    mutate_lab, literal_fields, nested_set_fields, version_filter, merge_update, adjust_lab_counters
+)
+from utils.lab_storage import (
+    STORAGE_FIELDS, normalized_storage_enabled, is_normalized, new_lab_document,
+    assemble_lab_documents, replace_sections, delete_lab_content,
+    mutate_normalized_header, add_normalized_section, clone_lab,
+    patch_normalized_section, patch_lab_module
+)
+from utils.blob_store import (
+    externalize_sections, externalize_fields, replaced_refs, collect_refs,
+    release_refs, hydrate_sections, hydrate_module
+)
+from utils.deploy_jobs import enqueue_deployment
+from utils.lab_bulk import BULK_MAX_OPERATIONS, BULK_STATE_PROJECTION, run_bulk_operations
+from utils.fast_responses import FastJSONResponse, trusted_payload, dumps
+from utils.lab_cache import lab_cache
+from utils.etags import lab_etag, outline_etag, listing_etag, etag_matches, parse_if_match
+from utils.static_export import stream_static_site, export_filename
+from utils.site_builds import plan_lab_site, build_report_headers, delete_lab_builds
+from utils.lab_versions import record_lab_version, reconstruct_version, list_lab_versions, delete_lab_versions
+from utils.public_snapshots import delete_public_snapshots
+from utils.autosave import autosave_buffer
+from utils.lab_outline import refresh_lab_outline, get_lab_outline, delete_lab_outlines
+from fastapi.responses import JSONResponse, StreamingResponse
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -31,15 +55,74 @@ router = APIRouter(tags=["labs"])
 # Get the appropriate user dependency
 current_user_dependency = get_user_dependency()
 
+# Projection used by the summary listing: only header fields plus computed
+# section/module counts, so list cost does not grow with lab content size
+LAB_SUMMARY_PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    "title": 1,
+    "description": 1,
+    "status": 1,
+    "isPublished": 1,
+    "createdAt": 1,
+    "updatedAt": 1,
+    # Normalized labs store their counts on the header
+    "sectionCount": {"$ifNull": ["$sectionCount", {"$size": {"$ifNull": ["$sections", []]}}]},
+    "moduleCount": {"$ifNull": ["$moduleCount", {
+        "$sum": {
+            "$map": {
+                "input": {"$ifNull": ["$sections", []]},
+                "as": "section",
+                "in": {"$size": {"$ifNull": ["$$section.modules", []]}}
+            }
+        }
+    }]}
+}
+
 # Helper functions
-async def get_lab_by_id(lab_id: str) -> Optional[Lab]:
-    """Get a lab by ID from MongoDB"""
-    lab = await get_labs_collection().find_one({"id": lab_id})
+async def get_lab_document(lab_id: str, current_user: User, hydrate: bool = True) -> Optional[Dict[str, Any]]:
+    """
+    Get a stored lab document the user may access, with its sections
+    assembled. With hydrate, simulation content kept in the blob store is
+    inlined. Returns None if the lab is missing or not accessible.
+    """
+    lab = await get_labs_collection().find_one(lab_access_filter(lab_id, current_user), {"_id": 0})
     if lab:
-        # Serialize MongoDB document to handle ObjectId
-        lab = serialize_mongo_doc(lab)
-        return Lab(**lab)
-    return None
+        await assemble_lab_documents([lab])
+        if hydrate:
+            lab["sections"] = await hydrate_sections(lab.get("sections"))
+    return lab
+
+async def get_cached_lab_count(author_id: str, status: str) -> Optional[int]:
+    """Look up an author's lab count from the counters, or None if untracked"""
+    counter = await get_lab_counters_collection().find_one({"authorId": author_id})
+    if not counter:
+        return None
+    if status == "all":
+        return counter.get("total", 0)
+    return counter.get("counts", {}).get(status, 0)
+
+async def get_listing_watermark(author_id: str) -> str:
+    """
+    Watermark that changes whenever any of an author's labs is created,
+    modified or deleted: the latest updatedAt plus the lab total.
+    """
+    latest = await get_labs_collection().find_one(
+        {"author.id": author_id},
+        {"_id": 0, "updatedAt": 1},
+        sort=[("updatedAt", -1), ("id", -1)]
+    )
+    total = await get_cached_lab_count(author_id, "all")
+    if total is None:
+        total = await get_labs_collection().count_documents({"author.id": author_id})
+    return f"{latest.get('updatedAt') if latest else ''}:{total}"
+
+def precondition_failed(error: str) -> JSONResponse:
+    """412 response for a failed If-Match precondition"""
+    return JSONResponse(
+        status_code=412,
+        content={"success": False, "data": None, "error": error}
+    )
 
 # API Endpoints
 
@@ -85,40 +168,142 @@ async def create_new_lab(lab_data: LabCreate, current_user: User):
     )
     
     # Insert the lab into the database
-    await get_labs_collection().insert_one(new_lab.model_dump())
+    await get_labs_collection().insert_one(new_lab_document(new_lab.model_dump()))
+    await adjust_lab_counters(current_user.id, None, new_lab.status)
     
     return new_lab
 
+@router.post("/labs/bulk", response_model=BulkLabResponse)
+async def bulk_labs(request: BulkLabRequest, current_user: User = Depends(current_user_dependency)):
+    """
+    Create, update and delete many labs in one request.
+    Each operation is {"op": "create", "title", "description"},
+    {"op": "update", "id", "title"?, "description"?, "status"?, "version"?}
+    or {"op": "delete", "id", "version"?}; with "version", the operation only
+    applies if the lab is still at that version. Operations are independent
+    and each gets its own result, in request order.
+    """
+    if len(request.operations) > BULK_MAX_OPERATIONS:
+        return {
+            "success": False,
+            "data": None,
+            "error": f"At most {BULK_MAX_OPERATIONS} operations can be sent at once"
+        }
+    try:
+        results = await run_bulk_operations(request.operations, current_user)
+        succeeded = sum(1 for result in results if result["success"])
+        return {
+            "success": True,
+            "data": {"results": results, "succeeded": succeeded, "failed": len(results) - succeeded},
+            "error": None
+        }
+    except Exception as e:
+        logger.error(f"Error running bulk lab operations: {e}")
+        return {
+            "success": False,
+            "data": None,
+            "error": str(e)
+        }
+
 @router.get("/labs/{lab_id}", response_model=LabResponse)
-async def get_lab(lab_id: str = Path(..., title="The ID of the lab to get"), current_user: User = Depends(current_user_dependency)):
+async def get_lab(
+    lab_id: str = Path(..., title="The ID of the lab to get"),
+    simulations: str = Query("inline", regex="^(inline|lazy)$"),
+    if_none_match: Optional[str] = Header(None),
+    current_user: User = Depends(current_user_dependency)
+):
     """
-    Get a lab by ID
+    Get a lab by ID.
+    Responds 304 Not Modified when If-None-Match carries the current ETag.
+
+    With ``simulations=lazy``, simulation modules carry only their blob refs
+    and their content is loaded from GET /simulation/{lab_id}/{section_id}/{module_id}.
     """
     try:
-        # Get the lab
-        lab = await get_lab_by_id(lab_id)
-        if not lab:
+        # Autosaved content is written before it is read back
+        await autosave_buffer.flush(lab_id)
+        
+        # The version probe answers conditional requests and cache lookups
+        # without fetching the lab's content
+        current = await probe_lab(lab_id, current_user, ("version",))
+        if not current:
             return {
                 "success": False,
                 "data": None,
-                "error": "Lab not found"
+                "error": await describe_access_failure(lab_id, current_user, "access") or "Lab not found"
             }
         
-        # Check if the user is authorized to access this lab
-        if lab.author.id != current_user.id and current_user.role != "admin":
+        version = current.get("version", 0)
+        if if_none_match and etag_matches(if_none_match, lab_etag(lab_id, version)):
+            return Response(status_code=304, headers={"ETag": lab_etag(lab_id, version)})
+        
+        body = lab_cache.get((lab_id, version, simulations))
+        if body is None:
+            token = lab_cache.token()
+            lab = await get_lab_document(lab_id, current_user, hydrate=simulations == "inline")
+            if not lab:
+                # Deleted since the probe
+                return {
+                    "success": False,
+                    "data": None,
+                    "error": "Lab not found"
+                }
+            # Stored labs were validated on write; encode them directly
+            version = lab.get("version", 0)
+            body = dumps({"success": True, "data": trusted_payload(Lab, lab), "error": None})
+            lab_cache.put((lab_id, version, simulations), body, token)
+        
+        return Response(body, media_type="application/json", headers={"ETag": lab_etag(lab_id, version)})
+    except Exception as e:
+        logger.error(f"Error getting lab: {e}")
+        return {
+            "success": False,
+            "data": None,
+            "error": str(e)
+        }
+
+@router.get("/labs/{lab_id}/outline", response_model=LabOutlineResponse)
+async def get_outline(
+    response: Response,
+    lab_id: str = Path(..., title="The ID of the lab"),
+    if_none_match: Optional[str] = Header(None),
+    current_user: Annotated[User, Depends(current_user_dependency)] = None
+):
+    """
+    Get the titles, types and order of a lab's sections and modules, without
+    their content. Responds 304 Not Modified when If-None-Match carries the
+    current ETag.
+    """
+    try:
+        await autosave_buffer.flush(lab_id)
+        current = await probe_lab(lab_id, current_user, ("version",))
+        if not current:
             return {
                 "success": False,
                 "data": None,
-                "error": "You do not have permission to access this lab"
+                "error": await describe_access_failure(lab_id, current_user, "access") or "Lab not found"
             }
         
+        version = current.get("version", 0)
+        if if_none_match and etag_matches(if_none_match, outline_etag(lab_id, version)):
+            return Response(status_code=304, headers={"ETag": outline_etag(lab_id, version)})
+        
+        outline = await get_lab_outline(lab_id, version)
+        if outline is None:
+            # Deleted since the probe
+            return {
+                "success": False,
+                "data": None,
+                "error": "Lab not found"
+            }
+        response.headers["ETag"] = outline_etag(lab_id, outline["version"])
         return {
             "success": True,
-            "data": lab,
+            "data": outline,
             "error": None
         }
     except Exception as e:
-        logger.error(f"Error getting lab: {e}")
+        logger.error(f"Error getting lab outline: {e}")
         return {
             "success": False,
             "data": None,
@@ -126,25 +311,48 @@ async def get_lab(lab_id: str = Path(..., title="The ID of the lab to get"), cur
         }
 
 @router.put("/labs/{lab_id}", response_model=LabResponse)
-async def update_lab(lab_id: str, lab: LabUpdate, current_user: User = Depends(current_user_dependency)):
+async def update_lab(
+    lab_id: str,
+    lab: LabUpdate,
+    if_match: Optional[str] = Header(None),
+    current_user: User = Depends(current_user_dependency)
+):
     """
-    Update a lab
+    Update a lab.
+    With If-Match, the update only applies if the lab is still at that version.
     """
     try:
-        # Update the lab
-        updated_lab = await update_existing_lab(lab_id, lab, current_user)
+        try:
+            expected_version = parse_if_match(if_match, lab_id)
+        except ValueError as e:
+            return precondition_failed(str(e))
+        
+        # Update the lab; new sections replace autosaved content, other
+        # changes apply on top of it
+        if lab.sections is not None:
+            async with autosave_buffer.superseding(lab_id):
+                updated_lab = await update_existing_lab(lab_id, lab, current_user, expected_version)
+        else:
+            await autosave_buffer.flush(lab_id)
+            updated_lab = await update_existing_lab(lab_id, lab, current_user, expected_version)
         if not updated_lab:
+            if expected_version is not None and not await describe_access_failure(lab_id, current_user, "update"):
+                return precondition_failed("Lab has been modified since it was fetched")
             return {
                 "success": False,
                 "data": None,
                 "error": "Lab not found or you don't have permission to update it"
             }
         
-        return {
-            "success": True,
-            "data": updated_lab,
-            "error": None
-        }
+        if lab.title is not None or lab.description is not None or lab.sections is not None:
+            await record_lab_version(lab_id, current_user)
+            await refresh_lab_outline(lab_id)
+        # The write was validated; shape the response without validating the
+        # stored lab again after it committed
+        return FastJSONResponse(
+            {"success": True, "data": trusted_payload(Lab, updated_lab), "error": None},
+            headers={"ETag": lab_etag(updated_lab["id"], updated_lab["version"])}
+        )
     except Exception as e:
         logger.error(f"Error updating lab: {e}")
         return {
@@ -152,20 +360,24 @@ async def update_lab(lab_id: str, lab: LabUpdate, current_user: User = Depends(c
             "data": None,
             "error": str(e)
         }
+    finally:
+        lab_cache.invalidate(lab_id)
 
-async def update_existing_lab(lab_id: str, lab_data: LabUpdate, current_user: User):
-    """Update an existing lab in the database"""
-    # Get the lab
-    existing_lab = await get_lab_by_id(lab_id)
-    if not existing_lab:
-        return None
-    
-    # Check if the user is authorized to update this lab
-    if existing_lab.author.id != current_user.id and current_user.role != "admin":
-        return None
+async def update_existing_lab(
+    lab_id: str,
+    lab_data: LabUpdate,
+    current_user: User,
+    expected_version: Optional[int] = None
+):
+    """
+    Update an existing lab in the database.
+    When expected_version is given, only a lab at that version is updated.
+    Returns the updated lab document, or None if no lab matched.
+    """
+    now = datetime.now().isoformat()
     
     # Update fields
-    update_data = {"updatedAt": datetime.now().isoformat()}
+    update_data = {"updatedAt": now}
     if lab_data.title is not None:
         update_data["title"] = lab_data.title
     if lab_data.description is not None:
@@ -173,21 +385,70 @@ async def update_existing_lab(lab_id: str, lab_data: LabUpdate, current_user: Us
     if lab_data.status is not None:
         update_data["status"] = lab_data.status
         update_data["isPublished"] = lab_data.status == "published"
-        if lab_data.status == "published" and not existing_lab.isPublished:
-            update_data["publishedAt"] = datetime.now().isoformat()
+    sections = None
+    new_refs = []
     if lab_data.sections is not None:
         # Serialize sections to ensure proper MongoDB format
-        update_data["sections"] = [section.dict() for section in lab_data.sections]
+        sections = [section.model_dump() for section in lab_data.sections]
+        # Simulation content goes to the blob store; the lab keeps refs
+        stored_sections, new_refs = await externalize_sections(sections)
+        if not normalized_storage_enabled():
+            update_data["sections"] = stored_sections
     
-    # Update the lab in the database
-    await get_labs_collection().update_one(
-        {"id": lab_id},
-        {"$set": update_data}
-    )
+    # A pipeline update sets publishedAt only on the first publish without
+    # reading the lab beforehand
+    pipeline = []
+    if lab_data.status == "published":
+        pipeline.append({"$set": {"publishedAt": {
+            "$cond": [{"$eq": ["$isPublished", True]}, "$publishedAt", {"$literal": now}]
+        }}})
+    pipeline.append({"$set": literal_fields(update_data)})
     
-    # Get the updated lab
-    updated_lab = await get_lab_by_id(lab_id)
-    return updated_lab
+    # The previous document is returned so the status counters can be moved;
+    # the updated lab is that document with the same top-level fields applied
+    extra_filter = version_filter(expected_version) if expected_version is not None else None
+    try:
+        if normalized_storage_enabled() and sections is not None:
+            async def commit(generation, counts):
+                content_fields = literal_fields({"contentGeneration": generation, **counts})
+                return await mutate_normalized_header(
+                    lab_id, current_user, pipeline + [{"$set": content_fields}],
+                    extra_filter=extra_filter, return_previous=True
+                )
+            # Replacing the generation also releases the old blob refs
+            previous, _ = await replace_sections(lab_id, stored_sections, commit)
+        else:
+            previous = await mutate_lab(
+                lab_id,
+                current_user,
+                pipeline,
+                extra_filter=extra_filter,
+                return_previous=True
+            )
+            if previous and sections is not None:
+                await release_refs(collect_refs(previous.get("sections")))
+    except Exception:
+        await release_refs(new_refs)
+        raise
+    if not previous:
+        await release_refs(new_refs)
+        return None
+    
+    updated = merge_update(previous, update_data)
+    if sections is not None:
+        # Respond with the content as sent rather than the stored refs
+        updated["sections"] = sections
+    else:
+        await assemble_lab_documents([updated])
+        updated["sections"] = await hydrate_sections(updated.get("sections"))
+    if lab_data.status == "published" and not previous.get("isPublished"):
+        updated["publishedAt"] = now
+    if lab_data.status is not None:
+        await adjust_lab_counters(previous["author"]["id"], previous.get("status"), lab_data.status)
+        if lab_data.status != "published" and previous.get("isPublished"):
+            await delete_public_snapshots([lab_id])
+    
+    return updated
 
 @router.delete("/labs/{lab_id}", response_model=Dict[str, Any])
 async def delete_lab(
@@ -198,29 +459,30 @@ async def delete_lab(
     Delete a lab
     """
     try:
-        # Get the lab
-        lab = await get_lab_by_id(lab_id)
+        # Delete the lab; authorization is part of the delete filter. Only
+        # the fields the cleanup needs come back, not the whole content
+        lab = await get_labs_collection().find_one_and_delete(
+            lab_access_filter(lab_id, current_user),
+            projection=BULK_STATE_PROJECTION
+        )
+        if lab:
+            autosave_buffer.discard(lab_id)
         if not lab:
             return {
                 "success": False,
-                "error": "Lab not found"
+                "error": await describe_access_failure(lab_id, current_user, "delete")
             }
+        await adjust_lab_counters(lab["author"]["id"], lab.get("status"), None)
         
-        # Check if the user is authorized to delete this lab
-        if lab.author.id != current_user.id and current_user.role != "admin":
-            return {
-                "success": False,
-                "error": "You do not have permission to delete this lab"
-            }
-        
-        # Delete the lab
-        result = await get_labs_collection().delete_one({"id": lab_id})
-        
-        if result.deleted_count == 0:
-            return {
-                "success": False,
-                "error": "Failed to delete lab"
-            }
+        # Remove the content and release its simulation blobs
+        if is_normalized(lab):
+            await delete_lab_content(lab_id)
+        else:
+            await release_refs(collect_refs(lab.get("sections")))
+        await delete_lab_builds(lab_id)
+        await delete_lab_versions([lab_id])
+        await delete_public_snapshots([lab_id])
+        await delete_lab_outlines([lab_id])
         
         return {
             "success": True,
@@ -232,6 +494,8 @@ async def delete_lab(
             "success": False,
             "error": str(e)
         }
+    finally:
+        lab_cache.invalidate(lab_id)
 
 @router.get("/labs", response_model=LabsResponse)
 async def get_labs(
@@ -239,12 +503,30 @@ async def get_labs(
     limit: int = Query(10, ge=1, le=100),
     status: str = Query("all", regex="^(all|draft|published)$"),
     search: Optional[str] = Query(None),
+    view: str = Query("summary", regex="^(summary|full)$"),
+    cursor: Optional[str] = Query(None),
+    if_none_match: Optional[str] = Header(None),
     current_user: User = Depends(current_user_dependency)
 ):
     """
-    Get all labs with pagination and filtering
+    Get all labs with pagination and filtering.
+
+    The default ``summary`` view returns only header fields and content counts;
+    pass ``view=full`` to get complete lab documents.
+
+    Pass the ``nextCursor`` from a previous response as ``cursor`` to fetch the
+    following page by keyset; ``page`` is still honoured when no cursor is given.
+
+    The response carries an ETag derived from the author's listing watermark,
+    so polling with If-None-Match gets 304 Not Modified until a lab changes.
     """
     try:
+        # Answer polling requests from the listing watermark
+        watermark = await get_listing_watermark(current_user.id)
+        etag = listing_etag([current_user.id, watermark, page, limit, status, search, view, cursor])
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        
         # Set up query filter
         filter_query = {"author.id": current_user.id}
         
@@ -256,106 +538,315 @@ async def get_labs(
         if search:
             filter_query["$text"] = {"$search": search}
         
-        # Get total count
-        total = await get_labs_collection().count_documents(filter_query)
-        
-        # Calculate pagination
-        total_pages = (total + limit - 1) // limit
+        # Keyset pagination: seek past the cursor instead of skipping
         skip = (page - 1) * limit
+        page_stages = []
+        if cursor:
+            page_stages.append({"$match": keyset_filter(cursor)})
+            skip = 0
+        page_stages += [
+            {"$sort": {"updatedAt": -1, "id": -1}},
+            {"$skip": skip},
+            {"$limit": limit}
+        ]
+        # Full documents are fetched by id afterwards, so only the listed
+        # fields are carried through the pipeline
+        list_projection = LAB_SUMMARY_PROJECTION if view == "summary" else {"_id": 0, "id": 1, "updatedAt": 1}
         
-        # Get labs with pagination
-        cursor = get_labs_collection().find(filter_query).sort("updatedAt", -1).skip(skip).limit(limit)
+        # Unfiltered totals come from the per-author counters; otherwise the
+        # count and the page come back together from one $facet aggregation
+        total = None
+        if not search:
+            total = await get_cached_lab_count(current_user.id, status)
+        if total is None:
+            # Labs are projected before $facet, which holds every matching
+            # lab in memory and must stay under the 16 MB document limit
+            pipeline = [
+                {"$match": filter_query},
+                {"$project": list_projection},
+                {"$facet": {"total": [{"$count": "count"}], "labs": page_stages}}
+            ]
+            result = await get_labs_collection().aggregate(pipeline).to_list(length=1)
+            facet = result[0] if result else {"total": [], "labs": []}
+            total = facet["total"][0]["count"] if facet["total"] else 0
+            lab_docs = facet["labs"]
+        else:
+            pipeline = [{"$match": filter_query}] + page_stages + [{"$project": list_projection}]
+            lab_docs = await get_labs_collection().aggregate(pipeline).to_list(length=limit)
         
+        total_pages = (total + limit - 1) // limit
+        
+        # Stored labs were validated on write, so they are shaped into the
+        # response without validating them again
         labs = []
-        async for lab_doc in cursor:
-            # Serialize MongoDB document to handle ObjectId
-            lab_doc = serialize_mongo_doc(lab_doc)
-            lab = Lab(**lab_doc)
-            labs.append(lab)
+        if view == "summary":
+            labs = [trusted_payload(LabSummary, lab_doc) for lab_doc in lab_docs]
+        elif lab_docs:
+            page_ids = [lab_doc["id"] for lab_doc in lab_docs]
+            labs_by_id = {}
+            page_docs = await get_labs_collection().find({"id": {"$in": page_ids}}, {"_id": 0}).to_list(length=limit)
+            for lab_doc in await assemble_lab_documents(page_docs):
+                lab_doc["sections"] = await hydrate_sections(lab_doc.get("sections"))
+                labs_by_id[lab_doc["id"]] = trusted_payload(Lab, lab_doc)
+            labs = [labs_by_id[lab_id] for lab_id in page_ids if lab_id in labs_by_id]
+        
+        next_cursor = None
+        if len(labs) == limit:
+            next_cursor = encode_cursor(labs[-1]["updatedAt"], labs[-1]["id"])
         
         pagination = PaginationInfo(
             total=total,
             page=page,
             pages=total_pages,
-            limit=limit
+            limit=limit,
+            nextCursor=next_cursor
         )
         
-        labs_data = LabsData(
-            labs=labs,
-            pagination=pagination
+        return FastJSONResponse(
+            {"success": True, "data": {"labs": labs, "pagination": pagination.model_dump()}, "error": None},
+            headers={"ETag": etag}
+        )
+    except Exception as e:
+        logger.error(f"Error getting labs: {e}")
+        return {
+            "success": False,
+            "data": None,
+            "error": str(e)
+        }
+
+@router.post("/labs/{lab_id}/clone", response_model=LabSummaryResponse)
+async def clone_lab_route(
+    lab_id: str = Path(..., title="The ID of the lab to clone"),
+    clone: Optional[LabCloneRequest] = None,
+    current_user: Annotated[User, Depends(current_user_dependency)] = None
+):
+    """
+    Copy a lab the user may access, or any published lab, into a new draft
+    lab owned by the user. The copy is made inside the database.
+    """
+    try:
+        await autosave_buffer.flush(lab_id)
+        source = await get_labs_collection().find_one(
+            {"id": lab_id, "$or": [lab_scope(current_user), {"isPublished": True}]},
+            {"_id": 0, "id": 1, "version": 1, "storage": 1, "contentGeneration": 1}
         )
+        if not source:
+            return {
+                "success": False,
+                "data": None,
+                "error": await describe_access_failure(lab_id, current_user, "clone") or "Lab not found"
+            }
         
+        now = datetime.now().isoformat()
+        title = clone.title if clone and clone.title else None
+        new_id = str(uuid.uuid4())
+        cloned = await clone_lab(source, new_id, {
+            "title": {"$literal": title} if title else {"$concat": ["Copy of ", "$title"]},
+            "author": {"$literal": {"id": current_user.id, "name": current_user.name, "email": current_user.email}},
+            "status": "draft",
+            "isPublished": False,
+            "createdAt": {"$literal": now},
+            "updatedAt": {"$literal": now},
+            "version": 0
+        })
+        if not cloned:
+            return {
+                "success": False,
+                "data": None,
+                "error": "The lab changed while it was being cloned, please retry"
+            }
+        await adjust_lab_counters(current_user.id, None, "draft")
+        
+        summaries = await get_labs_collection().aggregate([
+            {"$match": {"id": new_id}},
+            {"$project": LAB_SUMMARY_PROJECTION}
+        ]).to_list(length=1)
         return {
             "success": True,
-            "data": labs_data,
+            "data": summaries[0],
             "error": None
         }
     except Exception as e:
-        logger.error(f"Error getting labs: {e}")
+        logger.error(f"Error cloning lab: {e}")
         return {
             "success": False,
             "data": None,
             "error": str(e)
         }
 
-@router.post("/labs/{lab_id}/deploy", response_model=LabResponse)
-async def deploy_lab(
-    lab_id: str = Path(..., title="The ID of the lab to deploy"),
+@router.get("/labs/{lab_id}/versions", response_model=LabVersionsResponse)
+async def get_lab_versions(
+    lab_id: str = Path(..., title="The ID of the lab"),
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[int] = Query(None, description="Only list versions older than this one"),
     current_user: Annotated[User, Depends(current_user_dependency)] = None
 ):
     """
-    Deploy a lab
+    List a lab's recorded versions, newest first
     """
     try:
-        # Get the lab
-        lab = await get_lab_by_id(lab_id)
-        if not lab:
+        if not await probe_lab(lab_id, current_user):
             return {
                 "success": False,
                 "data": None,
-                "error": "Lab not found"
+                "error": await describe_access_failure(lab_id, current_user, "access") or "Lab not found"
             }
-        
-        # Check if the user is authorized to deploy this lab
-        if lab.author.id != current_user.id and current_user.role != "admin":
+        return {
+            "success": True,
+            "data": await list_lab_versions(lab_id, limit, before),
+            "error": None
+        }
+    except Exception as e:
+        logger.error(f"Error listing lab versions: {e}")
+        return {
+            "success": False,
+            "data": None,
+            "error": str(e)
+        }
+
+@router.get("/labs/{lab_id}/versions/{version}", response_model=LabVersionContentResponse)
+async def get_lab_version_content(
+    lab_id: str = Path(..., title="The ID of the lab"),
+    version: int = Path(..., title="The version to reconstruct"),
+    current_user: Annotated[User, Depends(current_user_dependency)] = None
+):
+    """
+    Get a lab's content as it was at a recorded version
+    """
+    try:
+        if not await probe_lab(lab_id, current_user):
             return {
                 "success": False,
                 "data": None,
-                "error": "You do not have permission to deploy this lab"
+                "error": await describe_access_failure(lab_id, current_user, "access") or "Lab not found"
             }
+        content = await reconstruct_version(lab_id, version)
+        if content is None:
+            return {
+                "success": False,
+                "data": None,
+                "error": f"Version {version} of this lab was not recorded"
+            }
+        content["sections"] = await hydrate_sections(content.get("sections"))
+        return {
+            "success": True,
+            "data": {"version": version, **content},
+            "error": None
+        }
+    except Exception as e:
+        logger.error(f"Error reconstructing lab version: {e}")
+        return {
+            "success": False,
+            "data": None,
+            "error": str(e)
+        }
+
+@router.post("/labs/{lab_id}/versions/{version}/rollback", response_model=LabResponse)
+async def rollback_lab(
+    lab_id: str = Path(..., title="The ID of the lab"),
+    version: int = Path(..., title="The version to restore"),
+    if_match: Optional[str] = Header(None),
+    current_user: Annotated[User, Depends(current_user_dependency)] = None
+):
+    """
+    Restore a lab's title, description and content to a recorded version.
+    The restore is a new write, so it is recorded as a new version itself.
+    With If-Match, it only applies if the lab is still at that version.
+    """
+    try:
+        try:
+            expected_version = parse_if_match(if_match, lab_id)
+        except ValueError as e:
+            return precondition_failed(str(e))
         
-        # Check if lab has content
-        if not lab.sections or len(lab.sections) == 0:
+        if not await probe_lab(lab_id, current_user):
+            return {
+                "success": False,
+                "data": None,
+                "error": await describe_access_failure(lab_id, current_user, "update") or "Lab not found"
+            }
+        content = await reconstruct_version(lab_id, version)
+        if content is None:
             return {
                 "success": False,
                 "data": None,
-                "error": "Cannot deploy a lab without any content"
+                "error": f"Version {version} of this lab was not recorded"
             }
         
-        # Generate deployment URL
-        deployment_url = f"https://labs.oneclicklabs.io/{lab_id}"
+        # The restored modules point at blobs the history keeps alive; the
+        # write takes the lab's own references to them
+        async with autosave_buffer.superseding(lab_id):
+            updated_lab = await update_existing_lab(
+                lab_id,
+                LabUpdate(
+                    title=content.get("title"),
+                    description=content.get("description"),
+                    sections=content.get("sections") or []
+                ),
+                current_user,
+                expected_version
+            )
+        if not updated_lab:
+            if expected_version is not None and not await describe_access_failure(lab_id, current_user, "update"):
+                return precondition_failed("Lab has been modified since it was fetched")
+            return {
+                "success": False,
+                "data": None,
+                "error": "Lab not found or you don't have permission to update it"
+            }
+        await record_lab_version(lab_id, current_user)
+        await refresh_lab_outline(lab_id)
         
-        # Update lab status to published
-        update_data = {
-            "status": "published",
-            "isPublished": True,
-            "publishedAt": datetime.now().isoformat(),
-            "updatedAt": datetime.now().isoformat(),
-            "deploymentUrl": deployment_url
+        updated_lab["sections"] = await hydrate_sections(updated_lab["sections"])
+        return FastJSONResponse(
+            {"success": True, "data": trusted_payload(Lab, updated_lab), "error": None},
+            headers={"ETag": lab_etag(updated_lab["id"], updated_lab["version"])}
+        )
+    except Exception as e:
+        logger.error(f"Error rolling back lab: {e}")
+        return {
+            "success": False,
+            "data": None,
+            "error": str(e)
         }
+    finally:
+        lab_cache.invalidate(lab_id)
+
+@router.post("/labs/{lab_id}/deploy", response_model=DeploymentResponse)
+async def deploy_lab(
+    response: Response,
+    lab_id: str = Path(..., title="The ID of the lab to deploy"),
+    current_user: Annotated[User, Depends(current_user_dependency)] = None
+):
+    """
+    Queue a deployment of a lab. The site is built and published by a deploy
+    worker; poll GET /deployments/{job_id} for progress.
+    """
+    try:
+        # Deploy the latest autosaved content
+        await autosave_buffer.flush(lab_id)
         
-        # Update the lab in the database
-        await get_labs_collection().update_one(
-            {"id": lab_id},
-            {"$set": update_data}
+        # Only labs with content can be deployed
+        lab = await get_labs_collection().find_one(
+            lab_access_filter(lab_id, current_user, {
+                "$or": [{"sectionCount": {"$gt": 0}}, {"sections.0": {"$exists": True}}]
+            }),
+            {"_id": 0, "id": 1, "author.id": 1}
         )
+        if not lab:
+            error = await describe_access_failure(lab_id, current_user, "deploy")
+            return {
+                "success": False,
+                "data": None,
+                "error": error or "Cannot deploy a lab without any content"
+            }
         
-        # Get the updated lab
-        deployed_lab = await get_lab_by_id(lab_id)
+        job = await enqueue_deployment(lab, current_user)
+        response.status_code = 202
         
         return {
             "success": True,
-            "data": deployed_lab,
+            "data": Deployment(**job),
             "error": None
         }
     except Exception as e:
@@ -376,159 +867,352 @@ async def add_section(
     Add a new section to a lab
     """
     try:
-        # Get the lab
-        lab = await get_lab_by_id(lab_id)
-        if not lab:
+        # The section is added to the latest autosaved content
+        await autosave_buffer.flush(lab_id)
+        
+        # Create section
+        section = Section(
+            title=section_data.get("title", "New Section"),
+            order=section_data.get("order", 0),
+            modules=[]
+        )
+        if normalized_storage_enabled():
+            header = await add_normalized_section(
+                lab_id, current_user, section.model_dump(), "order" not in section_data
+            )
+            if not header:
+                return {
+                    "success": False,
+                    "data": None,
+                    "error": await describe_access_failure(lab_id, current_user, "update")
+                }
+            await assemble_lab_documents([header])
+            await record_lab_version(lab_id, current_user, header)
+            await refresh_lab_outline(lab_id, header)
+            header["sections"] = await hydrate_sections(header.get("sections"))
+            return FastJSONResponse({"success": True, "data": trusted_payload(Lab, header), "error": None})
+        
+        new_section = literal_fields(section.model_dump())
+        if "order" not in section_data:
+            # Default to appending after the existing sections
+            new_section["order"] = {"$size": {"$ifNull": ["$sections", []]}}
+        
+        # Append the section with a pipeline update so the default order is
+        # computed server-side without reading the lab first
+        updated_lab = await mutate_lab(
+            lab_id,
+            current_user,
+            [{"$set": {
+                "sections": {"$concatArrays": [{"$ifNull": ["$sections", []]}, [new_section]]},
+                "updatedAt": {"$literal": datetime.now().isoformat()}
+            }}]
+        )
+        if not updated_lab:
             return {
                 "success": False,
                 "data": None,
-                "error": "Lab not found"
+                "error": await describe_access_failure(lab_id, current_user, "update")
             }
         
-        # Check if the user is authorized to update this lab
-        if lab.author.id != current_user.id and current_user.role != "admin":
+        await record_lab_version(lab_id, current_user, updated_lab)
+        await refresh_lab_outline(lab_id, updated_lab)
+        updated_lab["sections"] = await hydrate_sections(updated_lab.get("sections"))
+        return FastJSONResponse({"success": True, "data": trusted_payload(Lab, updated_lab), "error": None})
+    except Exception as e:
+        logger.error(f"Error adding section: {e}")
+        return {
+            "success": False,
+            "data": None,
+            "error": str(e)
+        }
+    finally:
+        lab_cache.invalidate(lab_id)
+
+@router.patch("/labs/{lab_id}/sections/{section_id}", response_model=SectionResponse)
+async def patch_section(
+    lab_id: str,
+    section_id: str,
+    section_data: Dict[str, Any],
+    current_user: Annotated[User, Depends(current_user_dependency)]
+):
+    """
+    Update individual fields of one section in place.
+    Only the given fields are written; the rest of the lab is untouched.
+    """
+    try:
+        # The section's own fields must keep their types; modules are
+        # changed through their own endpoint
+        try:
+            Section.model_validate({
+                "title": "",
+                "order": 0,
+                **{key: value for key, value in section_data.items() if key in ("title", "order")}
+            })
+        except ValidationError as e:
             return {
                 "success": False,
                 "data": None,
-                "error": "You do not have permission to update this lab"
+                "error": f"Invalid section: {e}"
             }
         
-        # Create section
-        section = Section(
-            title=section_data.get("title", "New Section"),
-            order=section_data.get("order", len(lab.sections)),
-            modules=[]
-        )
+        # Patches apply on top of autosaved content
+        await autosave_buffer.flush(lab_id)
         
-        # Update the lab in the database
-        await get_labs_collection().update_one(
-            {"id": lab_id},
-            {
-                "$push": {"sections": section.model_dump()},
-                "$set": {"updatedAt": datetime.now().isoformat()}
+        if normalized_storage_enabled():
+            update_data = nested_set_fields("", section_data, protected=("id", "modules") + STORAGE_FIELDS)
+            header, section = await patch_normalized_section(lab_id, current_user, section_id, update_data)
+            if not section:
+                error = None if header else await describe_access_failure(lab_id, current_user, "update")
+                return {
+                    "success": False,
+                    "data": None,
+                    "error": error or f"Section with ID {section_id} not found in lab"
+                }
+            await record_lab_version(lab_id, current_user)
+            await refresh_lab_outline(lab_id)
+            return {
+                "success": True,
+                "data": (await hydrate_sections([section]))[0],
+                "error": None
             }
-        )
         
-        # Get the updated lab
-        updated_lab = await get_lab_by_id(lab_id)
+        update_data = nested_set_fields("sections.$[section]", section_data, protected=("id", "modules"))
+        update_data["updatedAt"] = datetime.now().isoformat()
         
+        updated_lab = await mutate_lab(
+            lab_id,
+            current_user,
+            {"$set": update_data},
+            extra_filter={"sections.id": section_id},
+            array_filters=[{"section.id": section_id}],
+            projection={"_id": 0, "sections": {"$elemMatch": {"id": section_id}}}
+        )
+        if not updated_lab:
+            error = await describe_access_failure(lab_id, current_user, "update")
+            return {
+                "success": False,
+                "data": None,
+                "error": error or f"Section with ID {section_id} not found in lab"
+            }
+        
+        await record_lab_version(lab_id, current_user)
+        await refresh_lab_outline(lab_id)
         return {
             "success": True,
-            "data": updated_lab,
+            "data": (await hydrate_sections(updated_lab["sections"]))[0],
             "error": None
         }
     except Exception as e:
-        logger.error(f"Error adding section: {e}")
+        logger.error(f"Error updating section: {e}")
         return {
             "success": False,
             "data": None,
             "error": str(e)
         }
+    finally:
+        lab_cache.invalidate(lab_id)
 
-@router.post("/labs/{lab_id}/update-content", response_model=LabResponse)
-async def update_lab_content(
+@router.patch("/labs/{lab_id}/sections/{section_id}/modules/{module_id}", response_model=ModuleResponse)
+async def patch_module(
     lab_id: str,
-    content_data: Dict[str, Any],
+    section_id: str,
+    module_id: str,
+    module_data: Dict[str, Any],
     current_user: Annotated[User, Depends(current_user_dependency)]
 ):
     """
-    Update the entire lab content (sections and modules)
+    Update individual fields of one module.
+    Keys may be dotted paths into the module, e.g. "questions.0.options.1.text".
+    Simulation content fields go to the blob store and must be sent whole.
+    A module's type cannot be changed, and the patched module must still be
+    valid for its type.
     """
+    new_refs = []
     try:
-        # Get the lab
-        lab = await get_lab_by_id(lab_id)
-        if not lab:
+        # Patches apply on top of autosaved content
+        await autosave_buffer.flush(lab_id)
+        
+        module_data, new_refs = await externalize_fields(module_data)
+        update_data = nested_set_fields("", module_data, protected=("id", "type") + STORAGE_FIELDS)
+        try:
+            header, previous, module = await patch_lab_module(lab_id, current_user, section_id, module_id, update_data)
+        except ValidationError as e:
+            await release_refs(new_refs)
             return {
                 "success": False,
                 "data": None,
-                "error": "Lab not found"
+                "error": f"Invalid module: {e}"
             }
         
-        # Check if the user is authorized to update this lab
-        if lab.author.id != current_user.id and current_user.role != "admin":
+        if not module:
+            await release_refs(new_refs)
+            error = None if header else await describe_access_failure(lab_id, current_user, "update")
             return {
                 "success": False,
                 "data": None,
-                "error": "You do not have permission to update this lab"
-            }
-        
-        # Extract sections from the content data
-        sections = content_data.get("sections", [])
-        
-        # Update the lab in the database
-        await get_labs_collection().update_one(
-            {"id": lab_id},
-            {
-                "$set": {
-                    "sections": sections,
-                    "updatedAt": datetime.now().isoformat()
-                }
+                "error": error or f"Module with ID {module_id} not found in section {section_id}"
             }
-        )
-        
-        # Get the updated lab
-        updated_lab = await get_lab_by_id(lab_id)
         
+        # Refs the patch replaced are no longer used by the module
+        await release_refs(replaced_refs(previous, update_data))
+        await record_lab_version(lab_id, current_user)
+        await refresh_lab_outline(lab_id)
         return {
             "success": True,
-            "data": updated_lab,
+            "data": await hydrate_module(module),
             "error": None
         }
     except Exception as e:
-        logger.error(f"Error updating lab content: {e}")
+        logger.error(f"Error updating module: {e}")
+        await release_refs(new_refs)
         return {
             "success": False,
             "data": None,
             "error": str(e)
         }
+    finally:
+        lab_cache.invalidate(lab_id)
+
+async def write_lab_content(
+    lab_id: str,
+    sections: List[Dict[str, Any]],
+    current_user: User,
+    expected_version: Optional[int] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Replace a lab's content with validated sections. Returns the updated lab
+    (with the stored sections) or None if no lab matched: missing, not
+    accessible, or not at expected_version.
+    """
+    extra_filter = version_filter(expected_version) if expected_version is not None else None
+    
+    # Simulation content goes to the blob store; the lab keeps refs
+    stored_sections, new_refs = await externalize_sections(sections)
+    update_data = {"updatedAt": datetime.now().isoformat()}
+    
+    # Update the lab in the database
+    try:
+        if normalized_storage_enabled():
+            async def commit(generation, counts):
+                update_data.update({"contentGeneration": generation, **counts})
+                return await mutate_normalized_header(
+                    lab_id, current_user, {"$set": update_data},
+                    extra_filter=extra_filter, return_previous=True
+                )
+            # Replacing the generation also releases the old blob refs
+            previous, _ = await replace_sections(lab_id, stored_sections, commit)
+        else:
+            update_data["sections"] = stored_sections
+            previous = await mutate_lab(
+                lab_id,
+                current_user,
+                {"$set": update_data},
+                extra_filter=extra_filter,
+                return_previous=True
+            )
+            if previous:
+                await release_refs(collect_refs(previous.get("sections")))
+    except Exception:
+        await release_refs(new_refs)
+        raise
+    finally:
+        lab_cache.invalidate(lab_id)
+    
+    if not previous:
+        await release_refs(new_refs)
+        return None
+    
+    updated_lab = {**merge_update(previous, update_data), "sections": stored_sections}
+    await record_lab_version(lab_id, current_user, updated_lab)
+    await refresh_lab_outline(lab_id, updated_lab)
+    return updated_lab
 
-async def generate_static_site(lab: Lab) -> str:
-    """
-    Generate a static site from lab content
-    """
-    # Create temp directory
-    temp_dir = Path(f'/tmp/lab_export_{lab.id}')
-    temp_dir.mkdir(parents=True, exist_ok=True)
-
-    # Generate HTML content
-    html_content = f'''
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>{lab.title}</title>
-        <style>
-            body {{ font-family: Arial, sans-serif; }}
-        </style>
-    </head>
-    <body>
-        <h1>{lab.title}</h1>
-        <p>{lab.description}</p>
-        {{% for section in lab.sections %}}
-            <div class="section">
-                <h2>{section.title}</h2>
-                {{% for module in section.modules %}}
-                    {{% if module.type == 'text' %}}
-                        <div class="text-module">
-                            {module.content}
-                        </div>
-                    {{% elif module.type == 'quiz' %}}
-                        <div class="quiz-module">
-                            <h3>Quiz</h3>
-                            {module.questions}
-                        </div>
-                    {{% endif %}}
-                {{% endfor %}}
-            </div>
-        {{% endfor %}}
-    </body>
-    </html>
-    '''
-
-    # Write HTML file
-    with open(temp_dir / 'index.html', 'w') as f:
-        f.write(html_content)
-
-    return str(temp_dir)
+@router.post("/labs/{lab_id}/update-content", response_model=LabResponse)
+async def update_lab_content(
+    lab_id: str,
+    content_data: Dict[str, Any],
+    current_user: Annotated[User, Depends(current_user_dependency)],
+    if_match: Optional[str] = Header(None),
+    autosave: bool = Query(False, description="Coalesce with other autosaves of the lab and write later")
+):
+    """
+    Update the entire lab content (sections and modules).
+    With If-Match, the update only applies if the lab is still at that version.
+
+    With ``autosave=true`` the content is only validated and held: the
+    response is 202 Accepted, and the lab is written once the editor stops
+    saving for a moment (see utils.autosave). If-Match is checked when the
+    save is submitted, and an earlier autosave that could not be written is
+    reported (412) instead of queuing another. Saves without it are written
+    immediately and replace pending autosaved content.
+    """
+    try:
+        try:
+            expected_version = parse_if_match(if_match, lab_id)
+        except ValueError as e:
+            return precondition_failed(str(e))
+        
+        # Validate the sections; each module is checked against the model
+        # for its type
+        try:
+            sections = sections_adapter.dump_python(
+                sections_adapter.validate_python(content_data.get("sections", []))
+            )
+        except ValidationError as e:
+            return {
+                "success": False,
+                "data": None,
+                "error": f"Invalid lab content: {e}"
+            }
+        
+        if autosave and autosave_buffer.enabled:
+            current = await probe_lab(lab_id, current_user, ("version",))
+            if not current:
+                return {
+                    "success": False,
+                    "data": None,
+                    "error": await describe_access_failure(lab_id, current_user, "update") or "Lab not found"
+                }
+            # An acknowledged save that was lost is reported before the editor
+            # queues more changes on top of it
+            failure = autosave_buffer.take_failure(lab_id)
+            if failure:
+                return precondition_failed(failure)
+            if expected_version is not None and current.get("version", 0) != expected_version:
+                return precondition_failed("Lab has been modified since it was fetched")
+            async def write() -> bool:
+                return await write_lab_content(lab_id, sections, current_user, expected_version) is not None
+            return JSONResponse(
+                status_code=202,
+                content={"success": True, "data": autosave_buffer.submit(lab_id, write), "error": None}
+            )
+        
+        async with autosave_buffer.superseding(lab_id):
+            updated_lab = await write_lab_content(lab_id, sections, current_user, expected_version)
+        if not updated_lab:
+            error = await describe_access_failure(lab_id, current_user, "update")
+            if not error:
+                return precondition_failed("Lab has been modified since it was fetched")
+            return {
+                "success": False,
+                "data": None,
+                "error": error
+            }
+        
+        # Respond with the content as sent rather than the stored refs
+        return FastJSONResponse(
+            {"success": True, "data": trusted_payload(Lab, {**updated_lab, "sections": sections}), "error": None},
+            headers={"ETag": lab_etag(updated_lab["id"], updated_lab["version"])}
+        )
+    except Exception as e:
+        logger.error(f"Error updating lab content: {e}")
+        return {
+            "success": False,
+            "data": None,
+            "error": str(e)
+        }
+    finally:
+        lab_cache.invalidate(lab_id)
 
 @router.get("/labs/{lab_id}/export")
 async def export_lab(
@@ -536,40 +1220,33 @@ async def export_lab(
     current_user: User = Depends(current_user_dependency)
 ):
     """
-    Export a lab as a static site
+    Export a lab as a static site, streamed as a zip archive
     """
     try:
-        # Get the lab
-        lab = await get_lab_by_id(lab_id)
+        await autosave_buffer.flush(lab_id)
+        # Simulation content is loaded module by module while streaming
+        lab = await get_lab_document(lab_id, current_user, hydrate=False)
         if not lab:
+            error = await describe_access_failure(lab_id, current_user, "export")
+            if error and error != "Lab not found":
+                raise HTTPException(status_code=403, detail=error)
             raise HTTPException(status_code=404, detail="Lab not found")
 
-        # Check permissions
-        if lab.author.id != current_user.id and current_user.role != "admin":
-            raise HTTPException(status_code=403, detail="Not authorized to export this lab")
-
-        # Generate static site
-        export_dir = await generate_static_site(lab)
-
-        # Create zip file
-        memory_file = io.BytesIO()
-        with zipfile.ZipFile(memory_file, 'w') as zf:
-            for root, dirs, files in os.walk(export_dir):
-                for file in files:
-                    zf.write(
-                        os.path.join(root, file),
-                        os.path.relpath(os.path.join(root, file), export_dir)
-                    )
-        memory_file.seek(0)
-
-        # Clean up
-        shutil.rmtree(export_dir)
-
-        return FileResponse(
-            memory_file,
-            media_type='application/zip',
-            filename=f'{lab.title.replace(" ", "_")}_export.zip'
+        # Only sections and modules changed since the last build are rendered,
+        # one section at a time while the archive streams. The headers are
+        # sent first, so their duration covers planning the build only
+        build = await plan_lab_site(lab)
+
+        return StreamingResponse(
+            stream_static_site(lab, build.sections()),
+            media_type="application/zip",
+            headers={
+                "Content-Disposition": f'attachment; filename="{export_filename(lab["title"])}"',
+                **build_report_headers(build.report)
+            }
         )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error exporting lab: {e}")
         raise HTTPException(status_code=500, detail=str(e))
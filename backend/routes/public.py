@@ -0,0 +1,52 @@
+from fastapi import APIRouter, HTTPException, Header, Path, Query, Response
+from typing import Optional
+import logging
+
+from utils.etags import etag_matches
+from utils.public_snapshots import PUBLIC_LAB_MAX_AGE, read_public_snapshot, snapshot_etag
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Initialize router
+router = APIRouter(tags=["public"])
+
+# Cache-Control of a URL naming the snapshot's version, which never changes
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+@router.get("/public/labs/{lab_id}")
+async def get_public_lab(
+    lab_id: str = Path(..., title="The ID of the published lab"),
+    version: Optional[int] = Query(None, description="Published version; makes the response immutable"),
+    accept_encoding: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None)
+):
+    """
+    Get a published lab without authentication, as rendered when it was
+    deployed. The response is served pre-compressed (brotli or gzip) and
+    carries a strong ETag per encoding.
+
+    Without ``version`` the latest deployment is returned with a short
+    max-age and a Content-Location naming its version; that URL is cached
+    as immutable.
+    """
+    snapshot = await read_public_snapshot(lab_id, accept_encoding)
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail="Lab not found or not published")
+    snapshot, encoding, body = snapshot
+    if version is not None and version != snapshot["version"]:
+        raise HTTPException(status_code=404, detail="This version of the lab is no longer published")
+    
+    etag = snapshot_etag(snapshot["digest"], encoding)
+    headers = {"ETag": etag, "Vary": "Accept-Encoding"}
+    if version is None:
+        headers["Cache-Control"] = f"public, max-age={PUBLIC_LAB_MAX_AGE}"
+        headers["Content-Location"] = f"/api/v1/public/labs/{lab_id}?version={snapshot['version']}"
+    else:
+        headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    if if_none_match and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(body, media_type="application/json", headers=headers)
@@ -1,6 +1,7 @@
 from fastapi import APIRouter, HTTPException, Depends
-from pydantic import BaseModel
-from typing import Optional, Literal, Dict, Any
+from fastapi.responses import HTMLResponse, StreamingResponse
+from pydantic import BaseModel, ValidationError
+from typing import Optional, Literal, Dict, Any, Tuple
 import os
 import json
 import logging
@@ -14,10 +15,17 @@ from langchain_anthropic import ChatAnthropic
 from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
 
 from models.user import User
+from models.lab import module_adapter
 from utils.auth_bypass import get_user_dependency
 from routes.auth import get_current_user
-from database import get_labs_collection
-from utils.mongo_utils import serialize_mongo_doc
+from utils.lab_access import describe_access_failure
+from utils.lab_mutations import mutate_lab
+from utils.lab_storage import normalized_storage_enabled, save_normalized_module, find_lab_module
+from utils.blob_store import externalize_module, collect_refs, release_refs, hydrate_module, stream_html_content
+from utils.lab_cache import lab_cache
+from utils.lab_versions import record_lab_version
+from utils.autosave import autosave_buffer
+from utils.lab_outline import refresh_lab_outline
 
 # Load environment variables from .env file
 load_dotenv()
@@ -238,26 +246,13 @@ async def save_simulation(
     current_user: User = Depends(current_user_dependency)
 ):
     """Save a simulation module to a lab section"""
+    new_refs = []
+    committed = False
     try:
         logger.info(f"Saving simulation for lab: {request.labId}, section: {request.sectionId}")
         
-        # Get the labs collection
-        labs_collection = get_labs_collection()
-        
-        # Find the lab
-        lab = await labs_collection.find_one({"id": request.labId})
-        if not lab:
-            return SaveSimulationResponse(
-                success=False,
-                error=f"Lab with ID {request.labId} not found"
-            )
-        
-        # Check if the user is authorized to modify this lab
-        if lab.get("author", {}).get("id") != current_user.id and current_user.role != "admin":
-            return SaveSimulationResponse(
-                success=False,
-                error="You do not have permission to modify this lab"
-            )
+        # The module is saved on top of autosaved content
+        await autosave_buffer.flush(request.labId)
         
         # Prepare simulation module data
         current_time = datetime.now().isoformat()
@@ -272,70 +267,140 @@ async def save_simulation(
             "createdAt": current_time,
             "updatedAt": current_time
         }
-        
-        # Find the section and update or add the module
-        section_index = None
-        module_index = None
-        
-        for i, section in enumerate(lab.get("sections", [])):
-            if section.get("id") == request.sectionId:
-                section_index = i
-                
-                # If moduleId is provided, find and update the existing module
-                if request.moduleId:
-                    for j, module in enumerate(section.get("modules", [])):
-                        if module.get("id") == request.moduleId:
-                            module_index = j
-                            # Update the order to maintain position
-                            simulation_module["order"] = module.get("order", 0)
-                            break
-                else:
-                    # No moduleId provided, so this is a new module
-                    # Set order to the end of the modules list
-                    simulation_module["order"] = len(section.get("modules", []))
-                
-                break
-        
-        if section_index is None:
+        # The module is checked against the model, like modules saved with
+        # the rest of the lab's content
+        try:
+            simulation_module = module_adapter.dump_python(module_adapter.validate_python(simulation_module))
+        except ValidationError as e:
             return SaveSimulationResponse(
                 success=False,
-                error=f"Section with ID {request.sectionId} not found in lab"
+                error=f"Invalid simulation module: {e}"
             )
         
-        # Update or add the module
-        update_operation = None
-        if module_index is not None:
-            # Update existing module
-            update_path = f"sections.{section_index}.modules.{module_index}"
-            update_operation = {
-                "$set": {
-                    update_path: simulation_module,
-                    "updatedAt": current_time
-                }
-            }
-        else:
-            # Add new module
-            update_path = f"sections.{section_index}.modules"
-            update_operation = {
-                "$push": {
-                    update_path: simulation_module
-                },
-                "$set": {
-                    "updatedAt": current_time
+        # Simulation content goes to the blob store; the lab keeps refs.
+        # The references are released again unless the save commits.
+        simulation_module, new_refs = await externalize_module(simulation_module)
+        
+        if normalized_storage_enabled():
+            header, saved_module = await save_normalized_module(
+                request.labId, current_user, request.sectionId, simulation_module
+            )
+            if not header:
+                return SaveSimulationResponse(
+                    success=False,
+                    error=await describe_access_failure(request.labId, current_user, "modify")
+                )
+            if not saved_module:
+                return SaveSimulationResponse(
+                    success=False,
+                    error=f"Section with ID {request.sectionId} not found in lab"
+                )
+            committed = True
+            await record_lab_version(request.labId, current_user)
+            await refresh_lab_outline(request.labId)
+            return SaveSimulationResponse(
+                success=True,
+                data={
+                    "moduleId": saved_module["id"],
+                    "message": "Simulation module saved successfully"
                 }
-            }
+            )
         
-        # Update the database
-        result = await labs_collection.update_one(
-            {"id": request.labId},
-            update_operation
-        )
+        # Replace the whole module if it exists, keeping its id, order and
+        # creation time, so content left out of this save (e.g. a cleared
+        # jsonStructure) does not survive from the old module. The
+        # pipeline addresses sections and modules by id, so concurrent
+        # edits that move them cannot redirect the write.
+        module_fields = {
+            key: value for key, value in simulation_module.items()
+            if key not in ("id", "order", "createdAt")
+        }
+        previous = None
+        if request.moduleId:
+            kept_fields = {
+                "id": "$$module.id",
+                "order": "$$module.order",
+                "createdAt": {"$ifNull": ["$$module.createdAt", {"$literal": current_time}]}
+            }
+            previous = await mutate_lab(
+                request.labId,
+                current_user,
+                [{"$set": {
+                    "sections": {"$map": {
+                        "input": "$sections",
+                        "as": "section",
+                        "in": {"$cond": [
+                            {"$eq": ["$$section.id", request.sectionId]},
+                            {"$mergeObjects": ["$$section", {"modules": {"$map": {
+                                "input": "$$section.modules",
+                                "as": "module",
+                                "in": {"$cond": [
+                                    {"$eq": ["$$module.id", request.moduleId]},
+                                    {"$mergeObjects": [{"$literal": module_fields}, kept_fields]},
+                                    "$$module"
+                                ]}
+                            }}}]},
+                            "$$section"
+                        ]}
+                    }},
+                    "updatedAt": {"$literal": current_time}
+                }}],
+                extra_filter={"sections": {"$elemMatch": {"id": request.sectionId, "modules.id": request.moduleId}}},
+                return_previous=True,
+                projection={"_id": 0, "sections": {"$elemMatch": {"id": request.sectionId}}}
+            )
         
-        if result.modified_count == 0:
-            return SaveSimulationResponse(
-                success=False,
-                error="Failed to update lab. No changes were made."
+        replaced_module = None
+        if previous:
+            replaced_module = next(
+                module for module in previous["sections"][0].get("modules", [])
+                if module.get("id") == request.moduleId
             )
+        else:
+            # Otherwise append it to the section, ordered after the modules
+            # already there; the filter keeps a concurrent save of the same
+            # module from adding it twice
+            updated_lab = await mutate_lab(
+                request.labId,
+                current_user,
+                [{"$set": {
+                    "sections": {"$map": {
+                        "input": "$sections",
+                        "as": "section",
+                        "in": {"$cond": [
+                            {"$eq": ["$$section.id", request.sectionId]},
+                            {"$mergeObjects": ["$$section", {"modules": {"$concatArrays": [
+                                {"$ifNull": ["$$section.modules", []]},
+                                [{"$mergeObjects": [
+                                    {"$literal": simulation_module},
+                                    {"order": {"$size": {"$ifNull": ["$$section.modules", []]}}}
+                                ]}]
+                            ]}}]},
+                            "$$section"
+                        ]}
+                    }},
+                    "updatedAt": {"$literal": current_time}
+                }}],
+                extra_filter={"sections": {"$elemMatch": {
+                    "id": request.sectionId,
+                    "modules.id": {"$ne": simulation_module["id"]}
+                }}},
+                projection={"_id": 1}
+            )
+            if not updated_lab:
+                error = await describe_access_failure(request.labId, current_user, "modify")
+                return SaveSimulationResponse(
+                    success=False,
+                    error=error or f"Section with ID {request.sectionId} not found in lab"
+                )
+        
+        committed = True
+        if replaced_module:
+            # Every ref of the replaced module is gone from the lab; the new
+            # module's refs were taken by externalize_module
+            await release_refs(collect_refs([{"modules": [replaced_module]}]))
+        await record_lab_version(request.labId, current_user)
+        await refresh_lab_outline(request.labId)
         
         return SaveSimulationResponse(
             success=True,
@@ -352,6 +417,29 @@ async def save_simulation(
             success=False,
             error=f"Error saving simulation: {str(e)}"
         )
+    finally:
+        lab_cache.invalidate(request.labId)
+        if not committed:
+            await release_refs(new_refs)
+
+async def find_simulation_module(
+    lab_id: str,
+    section_id: str,
+    module_id: str,
+    current_user: User
+) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """
+    Fetch one simulation module, without the rest of the lab's content.
+    Returns (module, None), or (None, error) when it cannot be accessed.
+    """
+    header, section_found, module = await find_lab_module(lab_id, current_user, section_id, module_id)
+    if not header:
+        return None, await describe_access_failure(lab_id, current_user, "access")
+    if not section_found:
+        return None, f"Section with ID {section_id} not found in lab"
+    if not module or module.get("type") != "simulation":
+        return None, f"Simulation module with ID {module_id} not found in section"
+    return module, None
 
 @router.get("/simulation/{lab_id}/{section_id}/{module_id}", response_model=SaveSimulationResponse)
 async def get_simulation(
@@ -364,47 +452,13 @@ async def get_simulation(
     try:
         logger.info(f"Getting simulation for lab: {lab_id}, section: {section_id}, module: {module_id}")
         
-        # Get the labs collection
-        labs_collection = get_labs_collection()
-        
-        # Find the lab
-        lab = await labs_collection.find_one({"id": lab_id})
-        if not lab:
-            return SaveSimulationResponse(
-                success=False,
-                error=f"Lab with ID {lab_id} not found"
-            )
-        
-        # Convert MongoDB document to Python dict
-        lab = serialize_mongo_doc(lab)
-        
-        # Check if the user is authorized to access this lab
-        if lab.get("author", {}).get("id") != current_user.id and current_user.role != "admin":
-            return SaveSimulationResponse(
-                success=False,
-                error="You do not have permission to access this lab"
-            )
-        
-        # Find the section and module
-        for section in lab.get("sections", []):
-            if section.get("id") == section_id:
-                for module in section.get("modules", []):
-                    if module.get("id") == module_id and module.get("type") == "simulation":
-                        return SaveSimulationResponse(
-                            success=True,
-                            data=module
-                        )
-                
-                # Module not found in section
-                return SaveSimulationResponse(
-                    success=False,
-                    error=f"Simulation module with ID {module_id} not found in section"
-                )
+        module, error = await find_simulation_module(lab_id, section_id, module_id, current_user)
+        if not module:
+            return SaveSimulationResponse(success=False, error=error)
         
-        # Section not found
         return SaveSimulationResponse(
-            success=False,
-            error=f"Section with ID {section_id} not found in lab"
+            success=True,
+            data=await hydrate_module(module)
         )
         
     except Exception as e:
@@ -413,4 +467,30 @@ async def get_simulation(
         return SaveSimulationResponse(
             success=False,
             error=f"Error getting simulation: {str(e)}"
-        )
\ No newline at end of file
+        )
+
+@router.get("/simulation/{lab_id}/{section_id}/{module_id}/html")
+async def get_simulation_html(
+    lab_id: str,
+    section_id: str,
+    module_id: str,
+    current_user: User = Depends(current_user_dependency)
+):
+    """
+    Get a simulation's HTML as a page. Content kept in the blob store is
+    streamed out as it is decompressed, without a JSON round trip.
+    """
+    module, error = await find_simulation_module(lab_id, section_id, module_id, current_user)
+    if not module:
+        status_code = 403 if error and error.startswith("You do not have permission") else 404
+        raise HTTPException(status_code=status_code, detail=error or "Lab not found")
+    
+    # Lab authors write this HTML; keep it off the API's origin
+    headers = {"Content-Security-Policy": "sandbox allow-scripts"}
+    if module.get("htmlContentRef"):
+        return StreamingResponse(
+            stream_html_content(module),
+            media_type="text/html; charset=utf-8",
+            headers=headers
+        )
+    return HTMLResponse(module.get("htmlContent") or "", headers=headers)
@@ -1,10 +1,19 @@
 """
 Tests for lab-related endpoints.
 """
+import io
+import time
+import zipfile
+
 import pytest
 from fastapi.testclient import TestClient
 from bson import ObjectId
 
+from database import (
+    get_labs_collection, get_sections_collection, get_migrations_collection, get_lab_builds_collection
+)
+from utils import lab_storage
+
 # Test user data
 TEST_USER = {
     "name": "Test User",
@@ -123,6 +132,27 @@ def auth_headers(client: TestClient, clean_db):
     
     return {"Authorization": f"Bearer {token}"}
 
+def create_lab_with_content(client: TestClient, auth_headers, lab=TEST_LAB):
+    """Create a lab and store its sections, which POST /labs does not keep."""
+    create_response = client.post("/api/v1/labs", json=lab, headers=auth_headers)
+    lab_id = create_response.json()["data"]["id"]
+    response = client.post(
+        f"/api/v1/labs/{lab_id}/update-content",
+        json={"sections": lab["sections"]},
+        headers=auth_headers
+    )
+    assert response.json()["success"] is True
+    return lab_id
+
+def wait_for_deployment(client: TestClient, auth_headers, job_id):
+    """Poll a deploy job until it finishes."""
+    for _ in range(50):
+        job = client.get(f"/api/v1/deployments/{job_id}", headers=auth_headers).json()["data"]
+        if job["status"] in ("succeeded", "failed"):
+            break
+        time.sleep(0.2)
+    return job
+
 def test_create_lab(client: TestClient, auth_headers, clean_db):
     """Test creating a lab."""
     response = client.post(
@@ -195,6 +225,73 @@ def test_get_all_labs(client: TestClient, auth_headers, clean_db):
     assert "pagination" in data["data"]
     assert data["data"]["pagination"]["total"] == 2
 
+def test_get_all_labs_summary_view(client: TestClient, auth_headers, clean_db):
+    """Test that the default listing returns lab summaries with content counts."""
+    create_response = client.post("/api/v1/labs", json=TEST_LAB, headers=auth_headers)
+    lab_id = create_response.json()["data"]["id"]
+    client.post(
+        f"/api/v1/labs/{lab_id}/update-content",
+        json=TEST_CONTENT_UPDATE,
+        headers=auth_headers
+    )
+    
+    response = client.get("/api/v1/labs", headers=auth_headers)
+    assert response.status_code == 200
+    lab = response.json()["data"]["labs"][0]
+    assert lab["id"] == lab_id
+    assert lab["sectionCount"] == 1
+    assert lab["moduleCount"] == 1
+    assert "sections" not in lab
+    
+    # The full view still returns complete documents
+    response = client.get("/api/v1/labs?view=full", headers=auth_headers)
+    lab = response.json()["data"]["labs"][0]
+    assert len(lab["sections"]) == 1
+
+def test_get_all_labs_cursor_pagination(client: TestClient, auth_headers, clean_db):
+    """Test walking the lab listing with keyset cursors."""
+    for i in range(3):
+        client.post(
+            "/api/v1/labs",
+            json={"title": f"Lab {i}", "description": "Cursor test"},
+            headers=auth_headers
+        )
+    
+    seen = []
+    cursor = None
+    while True:
+        url = "/api/v1/labs?limit=2" + (f"&cursor={cursor}" if cursor else "")
+        data = client.get(url, headers=auth_headers).json()["data"]
+        seen.extend(lab["id"] for lab in data["labs"])
+        cursor = data["pagination"]["nextCursor"]
+        if not cursor:
+            break
+    
+    assert len(seen) == 3
+    assert len(set(seen)) == 3
+
+def test_get_all_labs_status_totals(client: TestClient, auth_headers, clean_db):
+    """Test that listing totals follow labs across status changes and deletes."""
+    lab_ids = []
+    for i in range(3):
+        create_response = client.post(
+            "/api/v1/labs",
+            json={"title": f"Lab {i}", "description": "Counter test"},
+            headers=auth_headers
+        )
+        lab_ids.append(create_response.json()["data"]["id"])
+    
+    client.put(f"/api/v1/labs/{lab_ids[0]}", json={"status": "published"}, headers=auth_headers)
+    client.delete(f"/api/v1/labs/{lab_ids[1]}", headers=auth_headers)
+    
+    def total(status):
+        response = client.get(f"/api/v1/labs?status={status}", headers=auth_headers)
+        return response.json()["data"]["pagination"]["total"]
+    
+    assert total("all") == 2
+    assert total("published") == 1
+    assert total("draft") == 1
+
 def test_update_lab(client: TestClient, auth_headers, clean_db):
     """Test updating a lab."""
     # Create a lab first
@@ -222,6 +319,158 @@ def test_update_lab(client: TestClient, auth_headers, clean_db):
     assert data["data"]["title"] == updated_data["title"]
     assert data["data"]["description"] == updated_data["description"]
 
+def test_lab_etags(client: TestClient, auth_headers, clean_db):
+    """Test conditional GET and If-Match optimistic concurrency on labs."""
+    create_response = client.post("/api/v1/labs", json=TEST_LAB, headers=auth_headers)
+    lab_id = create_response.json()["data"]["id"]
+    
+    response = client.get(f"/api/v1/labs/{lab_id}", headers=auth_headers)
+    etag = response.headers["ETag"]
+    
+    response = client.get(f"/api/v1/labs/{lab_id}", headers={**auth_headers, "If-None-Match": etag})
+    assert response.status_code == 304
+    
+    # A write with the current ETag succeeds and bumps the version
+    response = client.post(
+        f"/api/v1/labs/{lab_id}/update-content",
+        json=TEST_CONTENT_UPDATE,
+        headers={**auth_headers, "If-Match": etag}
+    )
+    assert response.status_code == 200
+    assert response.json()["success"] is True
+    assert response.headers["ETag"] != etag
+    
+    # A write with the stale ETag is rejected
+    response = client.put(
+        f"/api/v1/labs/{lab_id}",
+        json={"title": "Stale write"},
+        headers={**auth_headers, "If-Match": etag}
+    )
+    assert response.status_code == 412
+    
+    # The listing ETag changes once a lab changes
+    list_etag = client.get("/api/v1/labs", headers=auth_headers).headers["ETag"]
+    response = client.get("/api/v1/labs", headers={**auth_headers, "If-None-Match": list_etag})
+    assert response.status_code == 304
+    client.put(f"/api/v1/labs/{lab_id}", json={"title": "Fresh write"}, headers=auth_headers)
+    response = client.get("/api/v1/labs", headers={**auth_headers, "If-None-Match": list_etag})
+    assert response.status_code == 200
+
+def test_get_lab_cache(client: TestClient, auth_headers, clean_db):
+    """Test that cached lab reads never outlive a write."""
+    create_response = client.post("/api/v1/labs", json=TEST_LAB, headers=auth_headers)
+    lab_id = create_response.json()["data"]["id"]
+    
+    first = client.get(f"/api/v1/labs/{lab_id}", headers=auth_headers)
+    second = client.get(f"/api/v1/labs/{lab_id}", headers=auth_headers)
+    assert second.content == first.content
+    assert second.headers["ETag"] == first.headers["ETag"]
+    
+    client.put(f"/api/v1/labs/{lab_id}", json={"title": "Cached Title"}, headers=auth_headers)
+    response = client.get(f"/api/v1/labs/{lab_id}", headers=auth_headers)
+    assert response.json()["data"]["title"] == "Cached Title"
+    assert response.headers["ETag"] != first.headers["ETag"]
+    
+    stats = client.get("/api/v1/status").json()["labCache"]
+    assert stats["hits"] >= 1
+    assert stats["invalidations"] >= 1
+
+def test_bulk_labs(client: TestClient, auth_headers, clean_db):
+    """Test mixed bulk create, update and delete operations."""
+    first = client.post("/api/v1/labs", json=TEST_LAB, headers=auth_headers).json()["data"]
+    second = client.post("/api/v1/labs", json=TEST_LAB, headers=auth_headers).json()["data"]
+    
+    response = client.post(
+        "/api/v1/labs/bulk",
+        json={"operations": [
+            {"op": "create", "title": "Bulk Lab", "description": "Created in bulk"},
+            {"op": "update", "id": first["id"], "title": "Renamed", "status": "archived"},
+            {"op": "delete", "id": second["id"]},
+            {"op": "update", "id": first["id"], "title": "Twice"},
+            {"op": "delete", "id": "missing-lab"},
+            {"op": "rename", "id": first["id"]},
+            {"op": "update", "id": second["id"], "version": 5},
+            "not an operation"
+        ]},
+        headers=auth_headers
+    )
+    assert response.status_code == 200
+    data = response.json()["data"]
+    results = data["results"]
+    assert [result["success"] for result in results] == [True, True, True, False, False, False, False, False]
+    assert data["succeeded"] == 3
+    assert results[1]["version"] == first["version"] + 1
+    assert results[4]["error"] == "Lab not found"
+    assert results[7]["error"].startswith("Invalid operation")
+    
+    created = client.get(f"/api/v1/labs/{results[0]['id']}", headers=auth_headers).json()["data"]
+    assert created["title"] == "Bulk Lab"
+    updated = client.get(f"/api/v1/labs/{first['id']}", headers=auth_headers).json()["data"]
+    assert updated["title"] == "Renamed"
+    assert updated["status"] == "archived"
+    assert client.get(f"/api/v1/labs/{second['id']}", headers=auth_headers).json()["success"] is False
+    
+    # The renamed lab's history includes the bulk update
+    versions = client.get(f"/api/v1/labs/{first['id']}/versions", headers=auth_headers).json()["data"]
+    assert versions[0]["version"] == results[1]["version"]
+
+def test_clone_lab(client: TestClient, auth_headers, clean_db):
+    """Test copying a lab with its content into a new draft."""
+    create_response = client.post("/api/v1/labs", json=TEST_LAB, headers=auth_headers)
+    lab_id = create_response.json()["data"]["id"]
+    client.post(f"/api/v1/labs/{lab_id}/update-content", json=TEST_CONTENT_UPDATE, headers=auth_headers)
+    
+    response = client.post(f"/api/v1/labs/{lab_id}/clone", headers=auth_headers)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["success"] is True
+    clone_id = data["data"]["id"]
+    assert clone_id != lab_id
+    assert data["data"]["title"] == f"Copy of {TEST_LAB['title']}"
+    assert data["data"]["status"] == "draft"
+    
+    original = client.get(f"/api/v1/labs/{lab_id}", headers=auth_headers).json()["data"]
+    clone = client.get(f"/api/v1/labs/{clone_id}", headers=auth_headers).json()["data"]
+    assert clone["sections"] == original["sections"]
+    assert clone["version"] == 0
+    
+    response = client.post(f"/api/v1/labs/{lab_id}/clone", json={"title": "My Fork"}, headers=auth_headers)
+    assert response.json()["data"]["title"] == "My Fork"
+
+def test_lab_versions(client: TestClient, auth_headers, clean_db):
+    """Test listing, reading and restoring recorded lab versions."""
+    create_response = client.post("/api/v1/labs", json=TEST_LAB, headers=auth_headers)
+    lab_id = create_response.json()["data"]["id"]
+    first = client.post(f"/api/v1/labs/{lab_id}/update-content", json=TEST_CONTENT_UPDATE, headers=auth_headers).json()["data"]
+    client.put(f"/api/v1/labs/{lab_id}", json={"title": "Renamed Lab"}, headers=auth_headers)
+    
+    response = client.get(f"/api/v1/labs/{lab_id}/versions", headers=auth_headers)
+    assert response.status_code == 200
+    versions = response.json()["data"]
+    assert [version["version"] for version in versions] == [first["version"] + 1, first["version"]]
+    assert versions[0]["kind"] == "diff"
+    assert versions[1]["kind"] == "keyframe"
+    
+    response = client.get(f"/api/v1/labs/{lab_id}/versions/{first['version']}", headers=auth_headers)
+    data = response.json()["data"]
+    assert data["title"] == TEST_LAB["title"]
+    assert data["sections"] == first["sections"]
+    
+    response = client.post(f"/api/v1/labs/{lab_id}/versions/{first['version']}/rollback", headers=auth_headers)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["success"] is True
+    assert data["data"]["title"] == TEST_LAB["title"]
+    assert data["data"]["version"] == first["version"] + 2
+    
+    lab = client.get(f"/api/v1/labs/{lab_id}", headers=auth_headers).json()["data"]
+    assert lab["title"] == TEST_LAB["title"]
+    assert lab["sections"] == first["sections"]
+    assert len(client.get(f"/api/v1/labs/{lab_id}/versions", headers=auth_headers).json()["data"]) == 3
+    
+    response = client.get(f"/api/v1/labs/{lab_id}/versions/999", headers=auth_headers)
+    assert response.json()["success"] is False
+
 def test_add_section(client: TestClient, auth_headers, clean_db):
     """Test adding a section to a lab."""
     # Create a lab first
@@ -274,9 +523,92 @@ def test_update_lab_content(client: TestClient, auth_headers, clean_db):
     assert data["data"]["sections"][0]["modules"][0]["title"] == TEST_CONTENT_UPDATE["sections"][0]["modules"][0]["title"]
     assert data["data"]["sections"][0]["modules"][0]["content"] == TEST_CONTENT_UPDATE["sections"][0]["modules"][0]["content"]
 
-def test_deploy_lab(client: TestClient, auth_headers, clean_db):
-    """Test deploying a lab."""
-    # Create a lab first
+def test_update_lab_content_autosave(client: TestClient, auth_headers, clean_db):
+    """Test that rapid autosaves are acknowledged and written once."""
+    create_response = client.post("/api/v1/labs", json=TEST_LAB, headers=auth_headers)
+    lab_id = create_response.json()["data"]["id"]
+    before = client.get("/api/v1/status").json()["autosave"]
+    
+    for index in range(5):
+        content = {"sections": [{**TEST_CONTENT_UPDATE["sections"][0], "title": f"Draft {index}"}]}
+        response = client.post(
+            f"/api/v1/labs/{lab_id}/update-content?autosave=true",
+            json=content,
+            headers=auth_headers
+        )
+        assert response.status_code == 202
+        assert response.json()["data"]["queuedSaves"] == index + 1
+    
+    # Reading the lab writes the pending content first; the last save wins
+    lab = client.get(f"/api/v1/labs/{lab_id}", headers=auth_headers).json()["data"]
+    assert lab["sections"][0]["title"] == "Draft 4"
+    assert lab["version"] == create_response.json()["data"]["version"] + 1
+    
+    after = client.get("/api/v1/status").json()["autosave"]
+    assert after["writes"] - before["writes"] == 1
+    assert after["coalesced"] - before["coalesced"] == 4
+    assert after["pendingLabs"] == 0
+
+async def bump_lab_version(lab_id):
+    await get_labs_collection().update_one({"id": lab_id}, {"$inc": {"version": 1}})
+
+def test_autosave_reports_lost_saves(client: TestClient, auth_headers, clean_db):
+    """Test that autosave preconditions and failed flushes reach the editor."""
+    create_response = client.post("/api/v1/labs", json=TEST_LAB, headers=auth_headers)
+    lab_id = create_response.json()["data"]["id"]
+    etag = client.get(f"/api/v1/labs/{lab_id}", headers=auth_headers).headers["ETag"]
+    url = f"/api/v1/labs/{lab_id}/update-content?autosave=true"
+    
+    # A stale If-Match is rejected when the save is submitted
+    client.put(f"/api/v1/labs/{lab_id}", json={"title": "Renamed Lab"}, headers=auth_headers)
+    response = client.post(url, json=TEST_CONTENT_UPDATE, headers={**auth_headers, "If-Match": etag})
+    assert response.status_code == 412
+    
+    # A flush that no longer applies is reported on the next save
+    etag = client.get(f"/api/v1/labs/{lab_id}", headers=auth_headers).headers["ETag"]
+    response = client.post(url, json=TEST_CONTENT_UPDATE, headers={**auth_headers, "If-Match": etag})
+    assert response.status_code == 202
+    client.portal.call(bump_lab_version, lab_id)
+    client.get(f"/api/v1/labs/{lab_id}", headers=auth_headers)
+    response = client.post(url, json=TEST_CONTENT_UPDATE, headers=auth_headers)
+    assert response.status_code == 412
+    assert "not applied" in response.json()["error"]
+    
+    # It is reported once
+    response = client.post(url, json=TEST_CONTENT_UPDATE, headers=auth_headers)
+    assert response.status_code == 202
+
+def test_lab_outline(client: TestClient, auth_headers, clean_db):
+    """Test the outline of a lab's sections and modules."""
+    create_response = client.post("/api/v1/labs", json=TEST_LAB, headers=auth_headers)
+    lab_id = create_response.json()["data"]["id"]
+    updated = client.post(f"/api/v1/labs/{lab_id}/update-content", json=TEST_CONTENT_UPDATE, headers=auth_headers).json()["data"]
+    
+    response = client.get(f"/api/v1/labs/{lab_id}/outline", headers=auth_headers)
+    assert response.status_code == 200
+    outline = response.json()["data"]
+    assert outline["version"] == updated["version"]
+    assert outline["sections"][0]["title"] == TEST_CONTENT_UPDATE["sections"][0]["title"]
+    module = outline["sections"][0]["modules"][0]
+    assert module == {
+        "id": updated["sections"][0]["modules"][0]["id"],
+        "title": TEST_CONTENT_UPDATE["sections"][0]["modules"][0]["title"],
+        "type": "text",
+        "order": 0
+    }
+    
+    etag = response.headers["ETag"]
+    response = client.get(f"/api/v1/labs/{lab_id}/outline", headers={**auth_headers, "If-None-Match": etag})
+    assert response.status_code == 304
+    
+    # Writes that do not refresh the outline are picked up on the next read
+    client.post("/api/v1/labs/bulk", json={"operations": [{"op": "update", "id": lab_id, "title": "Bulk Title"}]}, headers=auth_headers)
+    outline = client.get(f"/api/v1/labs/{lab_id}/outline", headers=auth_headers).json()["data"]
+    assert outline["title"] == "Bulk Title"
+    assert outline["version"] == updated["version"] + 1
+
+def test_update_lab_content_rejects_invalid_modules(client: TestClient, auth_headers, clean_db):
+    """Test that module payloads are validated against their type's model."""
     create_response = client.post(
         "/api/v1/labs",
         json=TEST_LAB,
@@ -284,16 +616,295 @@ def test_deploy_lab(client: TestClient, auth_headers, clean_db):
     )
     lab_id = create_response.json()["data"]["id"]
     
-    # Deploy the lab
+    # Unknown module type
+    response = client.post(
+        f"/api/v1/labs/{lab_id}/update-content",
+        json={"sections": [{"title": "S", "order": 0, "modules": [{"type": "unknown", "title": "M", "order": 0}]}]},
+        headers=auth_headers
+    )
+    assert response.json()["success"] is False
+    
+    # Text module without content
+    response = client.post(
+        f"/api/v1/labs/{lab_id}/update-content",
+        json={"sections": [{"title": "S", "order": 0, "modules": [{"type": "text", "title": "M", "order": 0}]}]},
+        headers=auth_headers
+    )
+    assert response.json()["success"] is False
+
+def test_patch_section_and_module(client: TestClient, auth_headers, clean_db):
+    """Test updating a single section and module without rewriting the lab."""
+    create_response = client.post("/api/v1/labs", json=TEST_LAB, headers=auth_headers)
+    lab_id = create_response.json()["data"]["id"]
+    content = {
+        "sections": [
+            {
+                "id": "section-1",
+                "title": "Quiz Section",
+                "order": 0,
+                "modules": [{**TEST_QUIZ_MODULE, "id": "module-1"}]
+            }
+        ]
+    }
+    client.post(f"/api/v1/labs/{lab_id}/update-content", json=content, headers=auth_headers)
+    
+    response = client.patch(
+        f"/api/v1/labs/{lab_id}/sections/section-1",
+        json={"title": "Renamed Section"},
+        headers=auth_headers
+    )
+    data = response.json()
+    assert data["success"] is True
+    assert data["data"]["title"] == "Renamed Section"
+    
+    response = client.patch(
+        f"/api/v1/labs/{lab_id}/sections/section-1/modules/module-1",
+        json={"questions.0.options.1.text": "A large snake"},
+        headers=auth_headers
+    )
+    data = response.json()
+    assert data["success"] is True
+    assert data["data"]["questions"][0]["options"][1]["text"] == "A large snake"
+    
+    # Unknown modules and protected fields are rejected
+    response = client.patch(
+        f"/api/v1/labs/{lab_id}/sections/section-1/modules/missing",
+        json={"title": "Nope"},
+        headers=auth_headers
+    )
+    assert response.json()["success"] is False
+    response = client.patch(
+        f"/api/v1/labs/{lab_id}/sections/section-1",
+        json={"id": "other"},
+        headers=auth_headers
+    )
+    assert response.json()["success"] is False
+    response = client.patch(
+        f"/api/v1/labs/{lab_id}/sections/section-1",
+        json={"modules": []},
+        headers=auth_headers
+    )
+    assert response.json()["success"] is False
+
+    # Patches that would leave the module invalid for its type are not written
+    response = client.patch(
+        f"/api/v1/labs/{lab_id}/sections/section-1/modules/module-1",
+        json={"questions": "x"},
+        headers=auth_headers
+    )
+    assert response.json()["success"] is False
+    response = client.patch(
+        f"/api/v1/labs/{lab_id}/sections/section-1",
+        json={"order": "first"},
+        headers=auth_headers
+    )
+    assert response.json()["success"] is False
+    lab = client.get(f"/api/v1/labs/{lab_id}", headers=auth_headers).json()["data"]
+    assert lab["sections"][0]["order"] == 0
+    assert lab["sections"][0]["modules"][0]["questions"][0]["options"][1]["text"] == "A large snake"
+
+async def find_lab_header(lab_id):
+    return await get_labs_collection().find_one({"id": lab_id}, {"_id": 0, "sections": 0})
+
+async def count_section_documents(lab_id):
+    return await get_sections_collection().count_documents({"labId": lab_id})
+
+async def find_migration_state():
+    return await get_migrations_collection().find_one({"_id": lab_storage.MIGRATION_ID})
+
+def test_normalized_storage(client: TestClient, auth_headers, clean_db, monkeypatch):
+    """Test reading and writing labs stored as separate section and module documents."""
+    monkeypatch.setattr(lab_storage, "LAB_STORAGE_MODE", lab_storage.NORMALIZED)
+    create_response = client.post("/api/v1/labs", json=TEST_LAB, headers=auth_headers)
+    lab_id = create_response.json()["data"]["id"]
+    content = {"sections": [{**TEST_LAB["sections"][0], "id": "section-1"}]}
+    content["sections"][0]["modules"] = [{**TEST_QUIZ_MODULE, "id": "module-1"}]
+    response = client.post(f"/api/v1/labs/{lab_id}/update-content", json=content, headers=auth_headers)
+    assert response.json()["success"] is True
+    
+    header = client.portal.call(find_lab_header, lab_id)
+    assert header["storage"] == lab_storage.NORMALIZED
+    assert header["sectionCount"] == 1
+    assert header["moduleCount"] == 1
+    assert client.portal.call(count_section_documents, lab_id) == 1
+    
+    # Section and module writes change only their own documents
+    client.post(f"/api/v1/labs/{lab_id}/sections", json=TEST_SECTION, headers=auth_headers)
+    client.patch(f"/api/v1/labs/{lab_id}/sections/section-1", json={"title": "Renamed Section"}, headers=auth_headers)
+    response = client.patch(
+        f"/api/v1/labs/{lab_id}/sections/section-1/modules/module-1",
+        json={"questions.0.text": "What is Python, really?"},
+        headers=auth_headers
+    )
+    assert response.json()["success"] is True
+    
+    lab = client.get(f"/api/v1/labs/{lab_id}", headers=auth_headers).json()["data"]
+    assert [section["title"] for section in lab["sections"]] == ["Renamed Section", TEST_SECTION["title"]]
+    assert lab["sections"][0]["modules"][0]["questions"][0]["text"] == "What is Python, really?"
+    assert client.portal.call(count_section_documents, lab_id) == 2
+    listed = client.get("/api/v1/labs", headers=auth_headers).json()["data"]["labs"][0]
+    assert listed["sectionCount"] == 2
+    assert listed["moduleCount"] == 1
+    
+    # Replacing the content replaces the section documents
+    client.post(f"/api/v1/labs/{lab_id}/update-content", json=TEST_CONTENT_UPDATE, headers=auth_headers)
+    assert client.portal.call(count_section_documents, lab_id) == 1
+    lab = client.get(f"/api/v1/labs/{lab_id}", headers=auth_headers).json()["data"]
+    assert lab["sections"][0]["title"] == "Updated Section"
+
+def test_migrate_labs_resumes(client: TestClient, auth_headers, clean_db, monkeypatch):
+    """Test that an interrupted storage migration resumes from its checkpoint."""
+    lab_ids = []
+    for i in range(3):
+        create_response = client.post("/api/v1/labs", json={**TEST_LAB, "title": f"Lab {i}"}, headers=auth_headers)
+        lab_id = create_response.json()["data"]["id"]
+        client.post(f"/api/v1/labs/{lab_id}/update-content", json=TEST_CONTENT_UPDATE, headers=auth_headers)
+        lab_ids.append(lab_id)
+    
+    # Interrupt the migration on its second lab
+    migrate_lab = lab_storage.migrate_lab
+    calls = []
+    async def interrupted_migrate_lab(lab_id, *args, **kwargs):
+        calls.append(lab_id)
+        if len(calls) == 2:
+            raise RuntimeError("Interrupted")
+        return await migrate_lab(lab_id, *args, **kwargs)
+    monkeypatch.setattr(lab_storage, "migrate_lab", interrupted_migrate_lab)
+    with pytest.raises(RuntimeError):
+        client.portal.call(lab_storage.migrate_labs, 1, True)
+    state = client.portal.call(find_migration_state)
+    assert state["migrated"] == 1
+    assert state["lastLabId"] == calls[0]
+    assert state["completed"] is False
+    
+    # The next run starts after the checkpoint
+    monkeypatch.setattr(lab_storage, "migrate_lab", migrate_lab)
+    assert client.portal.call(lab_storage.migrate_labs, 1) == 3
+    assert client.portal.call(find_migration_state)["completed"] is True
+    for lab_id in lab_ids:
+        header = client.portal.call(find_lab_header, lab_id)
+        assert header["storage"] == lab_storage.NORMALIZED
+        lab = client.get(f"/api/v1/labs/{lab_id}", headers=auth_headers).json()["data"]
+        assert lab["sections"][0]["title"] == "Updated Section"
+        assert lab["sections"][0]["modules"][0]["content"] == "This is updated content"
+    
+    # A completed migration finds nothing left to do
+    assert client.portal.call(lab_storage.migrate_labs, 1) == 3
+
+def test_simulation_refs_round_trip(client: TestClient, auth_headers, clean_db):
+    """Test saving back content from a lazy read, and rejecting unknown refs."""
+    create_response = client.post("/api/v1/labs", json=TEST_LAB, headers=auth_headers)
+    lab_id = create_response.json()["data"]["id"]
+    simulation = {
+        "id": "sim-1",
+        "type": "simulation",
+        "title": "Simulation",
+        "order": 0,
+        "htmlContent": "<html><body>Simulation</body></html>"
+    }
+    content = {"sections": [{"id": "section-1", "title": "S", "order": 0, "modules": [simulation]}]}
+    client.post(f"/api/v1/labs/{lab_id}/update-content", json=content, headers=auth_headers)
+
+    lazy = client.get(f"/api/v1/labs/{lab_id}?simulations=lazy", headers=auth_headers).json()["data"]
+    module = lazy["sections"][0]["modules"][0]
+    assert module.get("htmlContentRef")
+
+    # Saving the lazy content back keeps the simulation
+    response = client.post(f"/api/v1/labs/{lab_id}/update-content", json={"sections": lazy["sections"]}, headers=auth_headers)
+    assert response.json()["success"] is True
+    response = client.patch(
+        f"/api/v1/labs/{lab_id}/sections/section-1/modules/sim-1",
+        json={"title": "Renamed Simulation"},
+        headers=auth_headers
+    )
+    assert response.json()["success"] is True
+    lab = client.get(f"/api/v1/labs/{lab_id}", headers=auth_headers).json()["data"]
+    assert lab["sections"][0]["modules"][0]["htmlContent"] == simulation["htmlContent"]
+
+    # Refs that do not name a stored blob are rejected
+    forged = {**module, "htmlContentRef": "0" * 64}
+    response = client.post(
+        f"/api/v1/labs/{lab_id}/update-content",
+        json={"sections": [{**lazy["sections"][0], "modules": [forged]}]},
+        headers=auth_headers
+    )
+    assert response.json()["success"] is False
+    response = client.patch(
+        f"/api/v1/labs/{lab_id}/sections/section-1/modules/sim-1",
+        json={"htmlContentRef": "not-a-key"},
+        headers=auth_headers
+    )
+    assert response.json()["success"] is False
+
+def test_save_simulation(client: TestClient, auth_headers, clean_db):
+    """Test appending a simulation module and saving it again in place."""
+    create_response = client.post("/api/v1/labs", json=TEST_LAB, headers=auth_headers)
+    lab_id = create_response.json()["data"]["id"]
+    section_id = "section-1"
+    content = {"sections": [{**TEST_LAB["sections"][0], "id": section_id}]}
+    client.post(f"/api/v1/labs/{lab_id}/update-content", json=content, headers=auth_headers)
+
+    # Without an existing module the simulation is appended to the section
+    response = client.post("/api/v1/simulation/save", json={
+        "labId": lab_id,
+        "sectionId": section_id,
+        "title": "Simulation",
+        "htmlContent": "<html>v1</html>",
+        "jsonStructure": "{\"version\": 1}"
+    }, headers=auth_headers)
+    data = response.json()
+    assert data["success"] is True
+    module_id = data["data"]["moduleId"]
+    module = client.get(f"/api/v1/simulation/{lab_id}/{section_id}/{module_id}", headers=auth_headers).json()["data"]
+    assert module["order"] == 2
+    assert module["jsonStructure"] == "{\"version\": 1}"
+
+    # Saving it again replaces the whole module but keeps its place
+    response = client.post("/api/v1/simulation/save", json={
+        "labId": lab_id,
+        "sectionId": section_id,
+        "moduleId": module_id,
+        "title": "Simulation v2",
+        "htmlContent": "<html>v2</html>"
+    }, headers=auth_headers)
+    assert response.json()["success"] is True
+    saved = client.get(f"/api/v1/simulation/{lab_id}/{section_id}/{module_id}", headers=auth_headers).json()["data"]
+    assert saved["title"] == "Simulation v2"
+    assert saved["htmlContent"] == "<html>v2</html>"
+    assert saved.get("jsonStructure") is None
+    assert saved["order"] == module["order"]
+    assert saved["createdAt"] == module["createdAt"]
+    lab = client.get(f"/api/v1/labs/{lab_id}", headers=auth_headers).json()["data"]
+    assert len(lab["sections"][0]["modules"]) == 3
+
+    # Saving into a missing section fails
+    response = client.post("/api/v1/simulation/save", json={
+        "labId": lab_id,
+        "sectionId": "missing",
+        "title": "Simulation",
+        "htmlContent": "<html></html>"
+    }, headers=auth_headers)
+    assert response.json()["success"] is False
+
+def test_deploy_lab(client: TestClient, auth_headers, clean_db):
+    """Test deploying a lab through a deploy job."""
+    lab_id = create_lab_with_content(client, auth_headers)
+    
+    # Deploy the lab; the job is queued and run by a deploy worker
     response = client.post(
         f"/api/v1/labs/{lab_id}/deploy",
         headers=auth_headers
     )
-    assert response.status_code == 200
+    assert response.status_code == 202
     data = response.json()
     assert data["success"] is True
-    assert "data" in data
+    assert data["data"]["status"] in ("queued", "running", "succeeded")
     assert "deploymentUrl" in data["data"]
+    job_id = data["data"]["id"]
+    
+    job = wait_for_deployment(client, auth_headers, job_id)
+    assert job["status"] == "succeeded"
+    assert job["build"]["reusedSections"] + len(job["build"]["rebuiltSections"]) == 1
     
     # Check that the lab status is now "published"
     get_response = client.get(
@@ -303,6 +914,67 @@ def test_deploy_lab(client: TestClient, auth_headers, clean_db):
     assert get_response.json()["data"]["status"] == "published"
     assert get_response.json()["data"]["isPublished"] is True
 
+def test_get_deployment(client: TestClient, auth_headers, clean_db):
+    """Test reading a deploy job back by id."""
+    lab_id = create_lab_with_content(client, auth_headers)
+    job_id = client.post(f"/api/v1/labs/{lab_id}/deploy", headers=auth_headers).json()["data"]["id"]
+    
+    response = client.get(f"/api/v1/deployments/{job_id}", headers=auth_headers)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["success"] is True
+    assert data["data"]["id"] == job_id
+    assert data["data"]["labId"] == lab_id
+    assert "authorId" not in data["data"]
+    assert "workerId" not in data["data"]
+    
+    response = client.get("/api/v1/deployments/missing", headers=auth_headers)
+    assert response.json()["success"] is False
+
+def test_public_lab(client: TestClient, auth_headers, clean_db):
+    """Test the public snapshot of a deployed lab."""
+    lab_id = create_lab_with_content(client, auth_headers)
+    assert client.get(f"/api/v1/public/labs/{lab_id}").status_code == 404
+    
+    job_id = client.post(f"/api/v1/labs/{lab_id}/deploy", headers=auth_headers).json()["data"]["id"]
+    job = wait_for_deployment(client, auth_headers, job_id)
+    assert job["status"] == "succeeded"
+    
+    # No credentials needed; the stored gzip encoding is sent as is
+    response = client.get(f"/api/v1/public/labs/{lab_id}", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Vary"] == "Accept-Encoding"
+    data = response.json()["data"]
+    assert data["id"] == lab_id
+    assert data["status"] == "published"
+    assert data["version"] == job["deployedVersion"]
+    assert "email" not in data["author"]
+    assert data["sections"][0]["modules"][0]["title"] == "Introduction to Variables"
+    
+    # The precompressed snapshot carries a strong ETag
+    etag = response.headers["ETag"]
+    assert etag.startswith('"') and etag.endswith('"')
+    response = client.get(
+        f"/api/v1/public/labs/{lab_id}",
+        headers={"Accept-Encoding": "gzip", "If-None-Match": etag}
+    )
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert not response.content
+    
+    versioned_url = client.get(f"/api/v1/public/labs/{lab_id}", headers={"Accept-Encoding": "gzip"}).headers["Content-Location"]
+    assert versioned_url.endswith(f"?version={job['deployedVersion']}")
+    response = client.get(versioned_url, headers={"Accept-Encoding": "gzip"})
+    assert "immutable" in response.headers["Cache-Control"]
+    assert response.headers["ETag"] == etag
+    response = client.get(versioned_url, headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert response.status_code == 304
+    
+    # Unpublishing takes the lab off the public path
+    client.put(f"/api/v1/labs/{lab_id}", json={"status": "draft"}, headers=auth_headers)
+    assert client.get(f"/api/v1/public/labs/{lab_id}").status_code == 404
+
 def test_delete_lab(client: TestClient, auth_headers, clean_db):
     """Test deleting a lab."""
     # Create a lab first
@@ -328,3 +1000,79 @@ def test_delete_lab(client: TestClient, auth_headers, clean_db):
         headers=auth_headers
     )
     assert get_response.json()["success"] is False
+
+def test_export_lab(client: TestClient, auth_headers, clean_db):
+    """Test exporting a lab as a streamed static-site zip."""
+    lab_id = create_lab_with_content(client, auth_headers)
+    
+    response = client.get(
+        f"/api/v1/labs/{lab_id}/export",
+        headers=auth_headers
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/zip"
+    
+    archive = zipfile.ZipFile(io.BytesIO(response.content))
+    assert set(archive.namelist()) == {"index.html", "styles.css"}
+    index = archive.read("index.html").decode("utf-8")
+    assert TEST_LAB["title"] in index
+    assert "Variables are containers" in index
+    assert "What is Python?" in index
+
+async def find_build_report(lab_id):
+    build = await get_lab_builds_collection().find_one({"_id": lab_id})
+    return build["report"]
+
+def test_export_lab_reuses_unchanged_fragments(client: TestClient, auth_headers, clean_db):
+    """Test that repeated exports only re-render changed sections."""
+    content = {
+        "sections": [
+            {
+                "id": "section-1",
+                "title": "Variables",
+                "order": 0,
+                "modules": [
+                    {**TEST_TEXT_MODULE, "id": "module-1"},
+                    {**TEST_QUIZ_MODULE, "id": "module-2", "order": 1}
+                ]
+            },
+            {
+                "id": "section-2",
+                "title": "Functions",
+                "order": 1,
+                "modules": [
+                    {**TEST_TEXT_MODULE, "id": "module-3", "content": "<p>Functions group statements.</p>"}
+                ]
+            }
+        ]
+    }
+    lab_id = create_lab_with_content(client, auth_headers, {**TEST_LAB, **content})
+    
+    first = client.get(f"/api/v1/labs/{lab_id}/export", headers=auth_headers)
+    assert first.headers["X-Build-Rebuilt-Sections"] == "2"
+    assert first.headers["X-Build-Rebuilt-Modules"] == "3"
+    
+    second = client.get(f"/api/v1/labs/{lab_id}/export", headers=auth_headers)
+    assert second.headers["X-Build-Rebuilt-Sections"] == "0"
+    assert second.headers["X-Build-Reused-Modules"] == "3"
+    assert zipfile.ZipFile(io.BytesIO(second.content)).read("index.html") == \
+        zipfile.ZipFile(io.BytesIO(first.content)).read("index.html")
+    
+    # Editing one module re-renders only that module and its section
+    response = client.patch(
+        f"/api/v1/labs/{lab_id}/sections/section-2/modules/module-3",
+        json={"content": "<p>Functions group reusable statements.</p>"},
+        headers=auth_headers
+    )
+    assert response.json()["success"] is True
+    third = client.get(f"/api/v1/labs/{lab_id}/export", headers=auth_headers)
+    assert third.headers["X-Build-Rebuilt-Sections"] == "1"
+    assert third.headers["X-Build-Rebuilt-Modules"] == "1"
+    assert third.headers["X-Build-Reused-Sections"] == "1"
+    assert third.headers["X-Build-Reused-Modules"] == "2"
+    report = client.portal.call(find_build_report, lab_id)
+    assert report["rebuiltSections"] == ["section-2"]
+    assert report["rebuiltModules"] == ["module-3"]
+    index = zipfile.ZipFile(io.BytesIO(third.content)).read("index.html").decode("utf-8")
+    assert "Functions group reusable statements." in index
+    assert "Variables are containers" in index
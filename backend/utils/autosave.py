@@ -0,0 +1,214 @@
+"""
+Autosave write coalescing.
+
+The editor saves a lab's whole content on almost every pause in typing.
+Saves sent with ``autosave=true`` are acknowledged right away and held per
+lab: each one replaces the lab's pending content (last write wins), and the
+lab is written once AUTOSAVE_DEBOUNCE_SECONDS after the last save, or at
+most AUTOSAVE_MAX_DELAY_SECONDS after the first one. N saves in a burst
+become one database write.
+
+Everything else that touches the lab goes through the buffer first: reads
+and other writes flush the pending content, explicit saves replace it, and
+deleting the lab drops it. Pending content is flushed on shutdown. A
+save sent with If-Match is checked against the stored version when it is
+submitted, and its write still only applies at that version. A flush that
+fails is recorded for the lab and reported by ``take_failure`` on the
+editor's next save, since the save itself was acknowledged long before. The
+buffer lives in the process that received the saves, so with several
+workers an editor session should be pinned to one of them.
+
+Writes applied, saves coalesced and the lag between the first save of a
+batch and its write are reported by ``stats``.
+"""
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+AUTOSAVE_DEBOUNCE_SECONDS = float(os.getenv("AUTOSAVE_DEBOUNCE_SECONDS", "1.5"))
+AUTOSAVE_MAX_DELAY_SECONDS = float(os.getenv("AUTOSAVE_MAX_DELAY_SECONDS", "10"))
+
+# Applies a lab's pending content; returns False if the write matched nothing
+AutosaveWrite = Callable[[], Awaitable[bool]]
+
+class PendingSave:
+    """The latest unwritten save of a lab and the burst it ends"""
+
+    def __init__(self, write: AutosaveWrite):
+        self.write = write
+        self.first_queued = time.monotonic()
+        self.last_queued = self.first_queued
+        self.saves = 1
+        self.timer: Optional[asyncio.Task] = None
+
+    def due(self, debounce: float, max_delay: float) -> float:
+        return min(self.last_queued + debounce, self.first_queued + max_delay)
+
+class AutosaveBuffer:
+    """Per-lab debounce of content writes"""
+
+    def __init__(self, debounce_seconds: float, max_delay_seconds: float):
+        self.debounce_seconds = debounce_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self._pending: Dict[Hashable, PendingSave] = {}
+        self._locks: Dict[Hashable, asyncio.Lock] = {}
+        # Why the last flush of a lab failed, until its editor is told
+        self._failed: Dict[Hashable, str] = {}
+        self.saves = 0
+        self.writes = 0
+        self.coalesced = 0
+        self.superseded = 0
+        self.failures = 0
+        self.last_flush_lag = 0.0
+        self.max_flush_lag = 0.0
+        self._total_flush_lag = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.debounce_seconds > 0
+
+    def submit(self, lab_id: Hashable, write: AutosaveWrite) -> Dict[str, Any]:
+        """Hold write as the lab's pending content, replacing any earlier one"""
+        self.saves += 1
+        pending = self._pending.get(lab_id)
+        if pending is None:
+            pending = PendingSave(write)
+            self._pending[lab_id] = pending
+            pending.timer = asyncio.create_task(self._flush_when_due(lab_id, pending))
+        else:
+            pending.write = write
+            pending.last_queued = time.monotonic()
+            pending.saves += 1
+        due = pending.due(self.debounce_seconds, self.max_delay_seconds)
+        return {
+            "id": lab_id,
+            "pending": True,
+            "queuedSaves": pending.saves,
+            "flushInMs": max(0, round((due - time.monotonic()) * 1000))
+        }
+
+    async def _flush_when_due(self, lab_id: Hashable, pending: PendingSave):
+        # New saves push the deadline back; sleep until it stops moving
+        while self._pending.get(lab_id) is pending:
+            delay = pending.due(self.debounce_seconds, self.max_delay_seconds) - time.monotonic()
+            if delay <= 0:
+                await self.flush(lab_id)
+                return
+            await asyncio.sleep(delay)
+
+    def _lock(self, lab_id: Hashable) -> asyncio.Lock:
+        lock = self._locks.get(lab_id)
+        if lock is None:
+            lock = self._locks[lab_id] = asyncio.Lock()
+        return lock
+
+    def _release_lock(self, lab_id: Hashable):
+        lock = self._locks.get(lab_id)
+        if lock is not None and not lock.locked() and lab_id not in self._pending:
+            del self._locks[lab_id]
+
+    def _take(self, lab_id: Hashable) -> Optional[PendingSave]:
+        pending = self._pending.pop(lab_id, None)
+        if pending is not None and pending.timer is not None and pending.timer is not asyncio.current_task():
+            pending.timer.cancel()
+        return pending
+
+    async def flush(self, lab_id: Hashable):
+        """
+        Write the lab's pending content now, and wait for a write already in
+        progress. Cheap when nothing is pending. Failures are not raised:
+        they are recorded for take_failure, since the saves were
+        acknowledged long ago.
+        """
+        if lab_id not in self._pending and lab_id not in self._locks:
+            return
+        try:
+            async with self._lock(lab_id):
+                pending = self._take(lab_id)
+                if pending is not None:
+                    await self._write(lab_id, pending)
+        finally:
+            self._release_lock(lab_id)
+
+    async def _write(self, lab_id: Hashable, pending: PendingSave):
+        try:
+            applied = await pending.write()
+        except Exception as e:
+            applied = False
+            error = f"Autosaved changes could not be written: {e}"
+            logger.error(f"Autosave of lab {lab_id} failed: {e}")
+        else:
+            if not applied:
+                error = "Autosaved changes were not applied: the lab was modified, deleted or is no longer accessible"
+                logger.warning(f"Autosave of lab {lab_id} was not applied: the lab was modified, deleted or is no longer accessible")
+        if not applied:
+            self.failures += 1
+            self._failed[lab_id] = error
+            return
+        lag = time.monotonic() - pending.first_queued
+        self.writes += 1
+        self.coalesced += pending.saves - 1
+        self.last_flush_lag = lag
+        self.max_flush_lag = max(self.max_flush_lag, lag)
+        self._total_flush_lag += lag
+
+    @asynccontextmanager
+    async def superseding(self, lab_id: Hashable):
+        """
+        Hold the lab while replacing its whole content: pending content is
+        dropped, since the write made inside is newer, and no flush can land
+        after it.
+        """
+        try:
+            async with self._lock(lab_id):
+                pending = self._take(lab_id)
+                if pending is not None:
+                    self.superseded += pending.saves
+                self._failed.pop(lab_id, None)
+                yield
+        finally:
+            self._release_lock(lab_id)
+
+    def discard(self, lab_id: Hashable):
+        """Drop a deleted lab's pending content"""
+        pending = self._take(lab_id)
+        if pending is not None:
+            self.superseded += pending.saves
+        self._failed.pop(lab_id, None)
+        self._release_lock(lab_id)
+
+    def take_failure(self, lab_id: Hashable) -> Optional[str]:
+        """Return and clear the error of the lab's last failed flush, if any"""
+        return self._failed.pop(lab_id, None)
+
+    async def flush_all(self):
+        """Write every pending lab (on shutdown)"""
+        await asyncio.gather(*(self.flush(lab_id) for lab_id in list(self._pending)))
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "enabled": self.enabled,
+            "debounceSeconds": self.debounce_seconds,
+            "maxDelaySeconds": self.max_delay_seconds,
+            "pendingLabs": len(self._pending),
+            "oldestPendingSeconds": round(max((now - pending.first_queued for pending in self._pending.values()), default=0.0), 3),
+            "saves": self.saves,
+            "writes": self.writes,
+            "coalesced": self.coalesced,
+            "superseded": self.superseded,
+            "failures": self.failures,
+            "unreportedFailures": len(self._failed),
+            "flushLagSeconds": {
+                "last": round(self.last_flush_lag, 3),
+                "max": round(self.max_flush_lag, 3),
+                "avg": round(self._total_flush_lag / self.writes, 3) if self.writes else 0.0
+            }
+        }
+
+autosave_buffer = AutosaveBuffer(AUTOSAVE_DEBOUNCE_SECONDS, AUTOSAVE_MAX_DELAY_SECONDS)
@@ -0,0 +1,478 @@
+"""
+Content-addressed blob store for simulation HTML and JSON specs.
+
+Blobs are keyed by the SHA-256 of their content, so identical simulations
+are stored once however many labs use them. Data is compressed at rest
+(zstd when the ``zstandard`` package is installed, zlib otherwise) and kept
+in GridFS or on the local filesystem. Lab modules hold only the keys, in
+``htmlContentRef`` and ``jsonStructureRef``.
+
+Each blob has a metadata document in the ``blobs`` collection with a
+reference count. Writes take a reference for every blob they store and
+release the references of the content they replaced; blobs left without
+references are deleted by collect_garbage once a grace period has passed.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import zlib
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+from bson.codec_options import DEFAULT_CODEC_OPTIONS
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+from gridfs.errors import NoFile
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from database import get_database, get_labs_collection, get_modules_collection, get_lab_versions_collection
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# "gridfs" or "filesystem"; "inline" keeps simulation content in the lab
+BLOB_STORE = os.getenv("BLOB_STORE", "gridfs").lower()
+BLOB_STORE_PATH = os.getenv("BLOB_STORE_PATH", "blob_store")
+BLOB_GC_GRACE_SECONDS = int(os.getenv("BLOB_GC_GRACE_SECONDS", "3600"))
+# Read size when streaming a blob from the filesystem backend
+BLOB_STREAM_CHUNK_SIZE = 256 * 1024
+
+# Module fields moved to the store, and the fields holding their keys
+BLOB_FIELDS = {
+    "htmlContent": "htmlContentRef",
+    "jsonStructure": "jsonStructureRef"
+}
+
+# Keys are hex SHA-256 digests
+BLOB_KEY_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+# One-byte codec tag prefixed to the stored data
+ZSTD_TAG = b"Z"
+ZLIB_TAG = b"z"
+
+def blob_store_enabled() -> bool:
+    return BLOB_STORE in ("gridfs", "filesystem")
+
+def content_key(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+def compress(data: bytes) -> bytes:
+    if zstandard is not None:
+        return ZSTD_TAG + zstandard.ZstdCompressor(level=10).compress(data)
+    return ZLIB_TAG + zlib.compress(data, 6)
+
+def decompress(stored: bytes) -> bytes:
+    tag, payload = stored[:1], stored[1:]
+    if tag == ZSTD_TAG:
+        if zstandard is None:
+            raise ImportError("zstandard is required to read this blob. Please install it using 'pip install zstandard'.")
+        return zstandard.ZstdDecompressor().decompress(payload)
+    if tag == ZLIB_TAG:
+        return zlib.decompress(payload)
+    raise ValueError(f"Unknown blob codec tag: {tag!r}")
+
+def decompressor(tag: bytes):
+    """Incremental decompressor for stored data starting with tag"""
+    if tag == ZSTD_TAG:
+        if zstandard is None:
+            raise ImportError("zstandard is required to read this blob. Please install it using 'pip install zstandard'.")
+        return zstandard.ZstdDecompressor().decompressobj()
+    if tag == ZLIB_TAG:
+        return zlib.decompressobj()
+    raise ValueError(f"Unknown blob codec tag: {tag!r}")
+
+class GridFSBlobBackend:
+    """Stores compressed blobs in a GridFS bucket, using the key as file id"""
+
+    def __init__(self, bucket_name: str = "blobs"):
+        self.bucket_name = bucket_name
+        self._bucket = None
+
+    @property
+    def bucket(self):
+        if self._bucket is None:
+            # GridFS relies on native BSON types in its file documents
+            database = get_database().with_options(codec_options=DEFAULT_CODEC_OPTIONS)
+            self._bucket = AsyncIOMotorGridFSBucket(database, bucket_name=self.bucket_name)
+        return self._bucket
+
+    async def put(self, key: str, data: bytes):
+        try:
+            await self.bucket.upload_from_stream_with_id(key, key, data)
+        except DuplicateKeyError:
+            # Another writer stored the same content first
+            pass
+
+    async def get(self, key: str) -> bytes:
+        stream = await self.bucket.open_download_stream(key)
+        return await stream.read()
+
+    async def iter_chunks(self, key: str) -> AsyncIterator[bytes]:
+        stream = await self.bucket.open_download_stream(key)
+        while True:
+            chunk = await stream.readchunk()
+            if not chunk:
+                break
+            yield chunk
+
+    async def delete(self, key: str):
+        try:
+            await self.bucket.delete(key)
+        except NoFile:
+            pass
+
+class FileSystemBlobBackend:
+    """Stores compressed blobs as files under root, fanned out by key prefix"""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def _write(self, key: str, data: bytes):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    def _read(self, key: str) -> bytes:
+        with open(self._path(key), "rb") as f:
+            return f.read()
+
+    def _delete(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    async def put(self, key: str, data: bytes):
+        await asyncio.to_thread(self._write, key, data)
+
+    async def get(self, key: str) -> bytes:
+        return await asyncio.to_thread(self._read, key)
+
+    async def iter_chunks(self, key: str) -> AsyncIterator[bytes]:
+        f = await asyncio.to_thread(open, self._path(key), "rb")
+        try:
+            while True:
+                chunk = await asyncio.to_thread(f.read, BLOB_STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            f.close()
+
+    async def delete(self, key: str):
+        await asyncio.to_thread(self._delete, key)
+
+class BlobStore:
+    """Reference-counted, content-addressed store on top of a backend"""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    @property
+    def metadata(self):
+        return get_database().get_collection("blobs")
+
+    async def store(self, data: bytes) -> str:
+        """Store data if it is new and take a reference to it. Returns the key."""
+        key = content_key(data)
+        while True:
+            meta = await self.metadata.find_one({"_id": key}, {"state": 1})
+            if meta and meta.get("state") == "deleting":
+                # Garbage collection is removing this blob; store it afresh
+                # once the old copy is gone
+                await asyncio.sleep(0.05)
+                continue
+            if not meta:
+                # Data is written before its metadata, so existing metadata
+                # always means the data is readable
+                await self.backend.put(key, compress(data))
+            try:
+                await self.metadata.update_one(
+                    {"_id": key, "state": {"$ne": "deleting"}},
+                    {
+                        "$setOnInsert": {"size": len(data), "state": "live", "createdAt": datetime.now().isoformat()},
+                        "$set": {"lastReferencedAt": datetime.now().isoformat()},
+                        "$inc": {"refCount": 1}
+                    },
+                    upsert=True
+                )
+                return key
+            except DuplicateKeyError:
+                # Collection marked the blob for deletion in the meantime
+                continue
+
+    async def load(self, key: str) -> bytes:
+        return decompress(await self.backend.get(key))
+
+    async def stream(self, key: str) -> AsyncIterator[bytes]:
+        """Yield a blob's content as it is read and decompressed"""
+        inflater = None
+        async for chunk in self.backend.iter_chunks(key):
+            if inflater is None:
+                inflater = decompressor(chunk[:1])
+                chunk = chunk[1:]
+            data = inflater.decompress(chunk)
+            if data:
+                yield data
+        if inflater is not None:
+            data = inflater.flush()
+            if data:
+                yield data
+
+    async def retain(self, keys: Iterable[str], live_only: bool = False) -> int:
+        """
+        Take one more reference per key to blobs that are already stored.
+        With live_only, blobs being deleted (or unknown) are skipped.
+        Returns the number of distinct keys that matched.
+        """
+        counts: Dict[str, int] = {}
+        for key in keys:
+            counts[key] = counts.get(key, 0) + 1
+        if not counts:
+            return 0
+        now = datetime.now().isoformat()
+        result = await self.metadata.bulk_write([
+            UpdateOne(
+                {"_id": key, "state": "live"} if live_only else {"_id": key},
+                {"$inc": {"refCount": count}, "$set": {"lastReferencedAt": now}}
+            )
+            for key, count in counts.items()
+        ], ordered=False)
+        return result.matched_count
+
+    async def adopt(self, keys: List[str]):
+        """
+        Take references to blobs named by a client, e.g. refs sent back from
+        a lazy read. Raises ValueError, holding no references, if any key is
+        not a live blob.
+        """
+        for key in keys:
+            if not isinstance(key, str) or not BLOB_KEY_PATTERN.match(key):
+                raise ValueError(f"Invalid blob ref: {key!r}")
+        if await self.retain(keys, live_only=True) == len(set(keys)):
+            return
+        live = {
+            meta["_id"]
+            async for meta in self.metadata.find({"_id": {"$in": list(set(keys))}, "state": "live"}, {"_id": 1})
+        }
+        await self.release([key for key in keys if key in live])
+        missing = next(key for key in keys if key not in live)
+        raise ValueError(f"Unknown blob ref: {missing}")
+
+    async def release(self, keys: Iterable[str]):
+        """Drop one reference per key"""
+        for key in keys:
+            await self.metadata.update_one({"_id": key, "refCount": {"$gt": 0}}, {"$inc": {"refCount": -1}})
+
+    async def collect_garbage(self, grace_seconds: int = BLOB_GC_GRACE_SECONDS) -> int:
+        """Delete blobs that have had no references for the grace period"""
+        cutoff = (datetime.now() - timedelta(seconds=grace_seconds)).isoformat()
+        deleted = 0
+        while True:
+            meta = await self.metadata.find_one_and_update(
+                {"state": "live", "refCount": {"$lte": 0}, "lastReferencedAt": {"$lt": cutoff}},
+                {"$set": {"state": "deleting"}}
+            )
+            if not meta:
+                break
+            await self.backend.delete(meta["_id"])
+            await self.metadata.delete_one({"_id": meta["_id"], "state": "deleting"})
+            deleted += 1
+        return deleted
+
+    async def reconcile_refcounts(self) -> int:
+        """
+        Recount references from the labs and modules collections and the
+        lab version history, and fix any drift (e.g. from content replaced
+        by a write that could not see the previous refs). Returns the number
+        of blobs whose count changed.
+        """
+        ref_fields = [f"${ref_field}" for ref_field in BLOB_FIELDS.values()]
+        counts = {}
+        embedded_pipeline = [
+            {"$unwind": "$sections"},
+            {"$unwind": "$sections.modules"},
+            {"$project": {"_id": 0, "refs": [f"$sections.modules.{ref_field}" for ref_field in BLOB_FIELDS.values()]}},
+            {"$unwind": "$refs"},
+            {"$match": {"refs": {"$type": "string"}}},
+            {"$group": {"_id": "$refs", "count": {"$sum": 1}}}
+        ]
+        normalized_pipeline = [
+            {"$project": {"_id": 0, "refs": ref_fields}},
+            {"$unwind": "$refs"},
+            {"$match": {"refs": {"$type": "string"}}},
+            {"$group": {"_id": "$refs", "count": {"$sum": 1}}}
+        ]
+        # Each recorded version holds one reference per blob it introduced
+        history_pipeline = [
+            {"$project": {"_id": 0, "refs": 1}},
+            {"$unwind": "$refs"},
+            {"$match": {"refs": {"$type": "string"}}},
+            {"$group": {"_id": "$refs", "count": {"$sum": 1}}}
+        ]
+        for collection, pipeline in (
+            (get_labs_collection(), embedded_pipeline),
+            (get_modules_collection(), normalized_pipeline),
+            (get_lab_versions_collection(), history_pipeline)
+        ):
+            async for row in collection.aggregate(pipeline):
+                counts[row["_id"]] = counts.get(row["_id"], 0) + row["count"]
+
+        changed = 0
+        async for meta in self.metadata.find({"state": "live"}, {"refCount": 1}):
+            actual = counts.get(meta["_id"], 0)
+            if meta.get("refCount") != actual:
+                await self.metadata.update_one({"_id": meta["_id"]}, {"$set": {"refCount": actual}})
+                changed += 1
+        return changed
+
+def _create_blob_store() -> Optional[BlobStore]:
+    if BLOB_STORE == "gridfs":
+        return BlobStore(GridFSBlobBackend())
+    if BLOB_STORE == "filesystem":
+        return BlobStore(FileSystemBlobBackend(BLOB_STORE_PATH))
+    return None
+
+blob_store = _create_blob_store()
+
+def _encode(field: str, value: Any) -> bytes:
+    if field == "htmlContent":
+        return value.encode("utf-8")
+    return json.dumps(value).encode("utf-8")
+
+def _decode(field: str, data: bytes) -> Any:
+    if field == "htmlContent":
+        return data.decode("utf-8")
+    return json.loads(data)
+
+async def externalize_module(module: Any) -> Tuple[Any, List[str]]:
+    """
+    Move a module's inline blob fields to the store, replacing them with refs.
+    Refs sent without their inline field (content saved back from a lazy
+    read) must name live blobs, and the module takes its own references to
+    them. Returns the new module and the keys it took references to.
+    """
+    if not blob_store_enabled() or not isinstance(module, dict):
+        return module, []
+    module = dict(module)
+    keys = []
+    adopted = []
+    try:
+        for field, ref_field in BLOB_FIELDS.items():
+            if module.get(field) is not None:
+                key = await blob_store.store(_encode(field, module.pop(field)))
+                module[ref_field] = key
+                keys.append(key)
+            elif module.get(ref_field) is not None:
+                adopted.append(module[ref_field])
+        await blob_store.adopt(adopted)
+    except Exception:
+        await blob_store.release(keys)
+        raise
+    return module, keys + adopted
+
+async def externalize_sections(sections: List[Any]) -> Tuple[List[Any], List[str]]:
+    """Externalize the blob fields of every module in a list of sections"""
+    if not blob_store_enabled():
+        return sections, []
+    result = []
+    keys = []
+    try:
+        for section in sections or []:
+            section = dict(section)
+            modules = []
+            for module in section.get("modules") or []:
+                module, module_keys = await externalize_module(module)
+                modules.append(module)
+                keys.extend(module_keys)
+            section["modules"] = modules
+            result.append(section)
+    except Exception:
+        await blob_store.release(keys)
+        raise
+    return result, keys
+
+def collect_refs(sections: Optional[List[Any]]) -> List[str]:
+    """Blob keys referenced by the modules of a list of sections"""
+    keys = []
+    for section in sections or []:
+        for module in section.get("modules") or []:
+            if isinstance(module, dict):
+                keys.extend(module[ref_field] for ref_field in BLOB_FIELDS.values() if module.get(ref_field))
+    return keys
+
+async def retain_refs(keys: Iterable[str]):
+    if blob_store_enabled():
+        await blob_store.retain(keys)
+
+async def release_refs(keys: Iterable[str]):
+    if blob_store_enabled():
+        await blob_store.release(keys)
+
+def stream_html_content(module: Dict[str, Any]) -> AsyncIterator[bytes]:
+    """Stream a module's stored HTML straight from the blob store as UTF-8"""
+    return blob_store.stream(module["htmlContentRef"])
+
+async def hydrate_module(module: Any) -> Any:
+    """Replace a module's blob refs with the inline content they point to"""
+    if not blob_store_enabled() or not isinstance(module, dict):
+        return module
+    if not any(module.get(ref_field) for ref_field in BLOB_FIELDS.values()):
+        return module
+    module = dict(module)
+    for field, ref_field in BLOB_FIELDS.items():
+        key = module.pop(ref_field, None)
+        if key:
+            module[field] = _decode(field, await blob_store.load(key))
+    return module
+
+async def hydrate_sections(sections: Optional[List[Any]]) -> List[Any]:
+    """Inline the blob content of every module, fetching blobs in parallel"""
+    sections = [dict(section) for section in sections or []]
+    for section in sections:
+        section["modules"] = list(await asyncio.gather(
+            *(hydrate_module(module) for module in section.get("modules") or [])
+        ))
+    return sections
+
+async def externalize_fields(fields: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    Externalize blob fields in a partial module update. Blob fields and
+    their refs can only be replaced as a whole, not through dotted paths
+    into them. Clearing a blob field clears its ref too.
+    """
+    for key in fields:
+        if any(key.startswith(f"{field}.") for item in BLOB_FIELDS.items() for field in item):
+            raise ValueError(f"{key.split('.')[0]} can only be replaced as a whole")
+    blob_values = {
+        field: fields[field]
+        for item in BLOB_FIELDS.items() for field in item if field in fields
+    }
+    if not blob_values or not blob_store_enabled():
+        return fields, []
+    stored, keys = await externalize_module(blob_values)
+    for field, ref_field in BLOB_FIELDS.items():
+        if field in blob_values:
+            stored.setdefault(ref_field, None)
+    rest = {key: value for key, value in fields.items() if key not in blob_values}
+    return {**rest, **stored}, keys
+
+def replaced_refs(previous: Dict[str, Any], update: Dict[str, Any]) -> List[str]:
+    """Blob keys of a module that an update from externalize_fields replaces"""
+    return [
+        previous[ref_field] for ref_field in BLOB_FIELDS.values()
+        if ref_field in update and previous.get(ref_field)
+    ]
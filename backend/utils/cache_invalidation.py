@@ -0,0 +1,182 @@
+"""
+Cross-process cache invalidation.
+
+In-process caches subscribe to a topic ("labs" or "users") on
+``invalidation_registry`` and are called with the id of every document that
+changed, in this process or any other. ``invalidation_listener`` feeds the
+registry from a MongoDB change stream on the ``labs``, ``users``, ``sections``
+and ``modules`` collections; writes to a normalized lab's sections and modules
+are published as changes of the lab. A handler called with None must treat
+every entry of its topic as stale (after a drop, a lab or user delete, or
+events missed while the stream was down).
+
+Change streams need a replica set. On a standalone mongod the listener polls
+instead for documents whose ``updatedAt`` falls in the last
+CACHE_INVALIDATION_POLL_WINDOW_SECONDS. Every poll republishes documents in
+that window, which covers clock skew between hosts and writes that change a
+lab's content shortly after its header. Polling does not see deletes; caches
+must not serve a document without checking it still exists.
+
+CACHE_INVALIDATION_MODE is ``auto`` (change stream, falling back to polling),
+``changestream``, ``poll`` or ``off``.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from database import get_database, get_labs_collection, get_users_collection
+
+logger = logging.getLogger(__name__)
+
+CACHE_INVALIDATION_MODE = os.getenv("CACHE_INVALIDATION_MODE", "auto")
+CACHE_INVALIDATION_POLL_SECONDS = float(os.getenv("CACHE_INVALIDATION_POLL_SECONDS", "2"))
+CACHE_INVALIDATION_POLL_WINDOW_SECONDS = float(os.getenv("CACHE_INVALIDATION_POLL_WINDOW_SECONDS", "10"))
+# Delay before reopening a change stream that failed
+CACHE_INVALIDATION_RETRY_SECONDS = 5
+
+# Watched collection -> (topic, field of the changed document holding the topic key)
+WATCHED_COLLECTIONS = {
+    "labs": ("labs", "id"),
+    "sections": ("labs", "labId"),
+    "modules": ("labs", "labId"),
+    "users": ("users", "id")
+}
+# Collections whose deletes are published. Sections and modules are only
+# deleted once the lab no longer uses them.
+DELETE_PUBLISHED = ("labs", "users")
+# Server error codes meaning change streams are unavailable on this deployment
+CHANGE_STREAMS_UNSUPPORTED = (
+    40573,  # The $changeStream stage is only supported on replica sets
+    40324   # Unrecognized pipeline stage name
+)
+CHANGE_STREAM_HISTORY_LOST = 286
+
+InvalidationHandler = Callable[[Optional[str]], None]
+
+class InvalidationRegistry:
+    """Fans invalidations out to the handlers subscribed to a topic"""
+
+    def __init__(self):
+        self._handlers: Dict[str, List[InvalidationHandler]] = {}
+        self.published = 0
+
+    def subscribe(self, topic: str, handler: InvalidationHandler):
+        self._handlers.setdefault(topic, []).append(handler)
+
+    def publish(self, topic: str, key: Optional[str]):
+        """Invalidate key in every cache of topic; None invalidates everything"""
+        self.published += 1
+        for handler in self._handlers.get(topic, ()):
+            try:
+                handler(key)
+            except Exception as e:
+                logger.error(f"Cache invalidation handler for {topic} failed: {e}")
+
+    def publish_all(self):
+        for topic in self._handlers:
+            self.publish(topic, None)
+
+class InvalidationListener:
+    """Background task publishing database changes to a registry"""
+
+    def __init__(self, registry: InvalidationRegistry, mode: str):
+        self.registry = registry
+        self.requested_mode = mode
+        self.mode = "off"
+        self._task: Optional[asyncio.Task] = None
+        self._resume_token: Optional[Dict[str, Any]] = None
+
+    def start(self):
+        if self.requested_mode == "off":
+            logger.info("Cache invalidation listener disabled")
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        self.mode = "off"
+
+    async def _run(self):
+        if self.requested_mode in ("auto", "changestream"):
+            while True:
+                try:
+                    await self._watch()
+                except OperationFailure as e:
+                    if e.code in CHANGE_STREAMS_UNSUPPORTED and self.requested_mode == "auto":
+                        logger.info("Change streams are not available; polling updatedAt for cache invalidation")
+                        break
+                    if e.code == CHANGE_STREAM_HISTORY_LOST:
+                        self._resume_token = None
+                    logger.error(f"Cache invalidation change stream failed: {e}")
+                except PyMongoError as e:
+                    logger.error(f"Cache invalidation change stream failed: {e}")
+                # Changes made while the stream was down were missed
+                self.registry.publish_all()
+                await asyncio.sleep(CACHE_INVALIDATION_RETRY_SECONDS)
+        await self._poll()
+
+    async def _watch(self):
+        pipeline = [
+            {"$match": {"ns.coll": {"$in": list(WATCHED_COLLECTIONS)}}},
+            {"$project": {
+                "operationType": 1,
+                "ns": 1,
+                **{f"fullDocument.{field}": 1 for _, field in WATCHED_COLLECTIONS.values()}
+            }}
+        ]
+        async with get_database().watch(
+            pipeline,
+            full_document="updateLookup",
+            resume_after=self._resume_token
+        ) as stream:
+            if self.mode != "changestream":
+                self.mode = "changestream"
+                logger.info("Watching labs and users for cache invalidation")
+            async for change in stream:
+                self._resume_token = stream.resume_token
+                self._handle_change(change)
+
+    def _handle_change(self, change: Dict[str, Any]):
+        operation = change["operationType"]
+        if operation in ("drop", "rename", "dropDatabase", "invalidate"):
+            self.registry.publish_all()
+            return
+        collection = change.get("ns", {}).get("coll")
+        if collection not in WATCHED_COLLECTIONS:
+            return
+        topic, field = WATCHED_COLLECTIONS[collection]
+        if operation == "delete":
+            # Only the _id of a deleted document is known
+            if collection in DELETE_PUBLISHED:
+                self.registry.publish(topic, None)
+            return
+        key = (change.get("fullDocument") or {}).get(field)
+        if key is not None:
+            self.registry.publish(topic, key)
+
+    async def _poll(self):
+        self.mode = "poll"
+        sources = [("labs", get_labs_collection), ("users", get_users_collection)]
+        while True:
+            since = (datetime.now() - timedelta(seconds=CACHE_INVALIDATION_POLL_WINDOW_SECONDS)).isoformat()
+            for topic, get_collection in sources:
+                try:
+                    async for doc in get_collection().find({"updatedAt": {"$gt": since}}, {"_id": 0, "id": 1}):
+                        self.registry.publish(topic, doc.get("id"))
+                except PyMongoError as e:
+                    logger.error(f"Cache invalidation poll of {topic} failed: {e}")
+            await asyncio.sleep(CACHE_INVALIDATION_POLL_SECONDS)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"mode": self.mode, "published": self.registry.published}
+
+invalidation_registry = InvalidationRegistry()
+invalidation_listener = InvalidationListener(invalidation_registry, CACHE_INVALIDATION_MODE)
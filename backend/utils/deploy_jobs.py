@@ -0,0 +1,296 @@
+"""
+Durable deploy jobs.
+
+POST /labs/{id}/deploy only enqueues a job in the ``deployments`` collection;
+a pool of workers started with the application claims queued jobs, builds
+the lab's static site, publishes it and stores the lab's public snapshot
+(see utils.public_snapshots). Publishing is conditional on the lab version
+that was built, and the lab is rebuilt if it changed meanwhile, so the
+snapshot always matches the published version. Jobs hold a lease while running, so a
+job whose worker died (or whose process was stopped) is picked up again by
+another worker once the lease expires. Failed attempts are retried with a
+backoff up to DEPLOY_MAX_ATTEMPTS.
+"""
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from database import get_deployments_collection, get_labs_collection
+from models.user import User
+from utils.lab_access import describe_access_failure
+from utils.lab_cache import lab_cache
+from utils.lab_mutations import mutate_lab, adjust_lab_counters, version_filter
+from utils.lab_storage import normalized_storage_enabled, mutate_normalized_header, assemble_lab_documents
+from utils.public_snapshots import store_public_snapshot
+from utils.site_builds import build_lab_site
+
+logger = logging.getLogger(__name__)
+
+DEPLOY_WORKERS = int(os.getenv("DEPLOY_WORKERS", "2"))
+DEPLOY_LEASE_SECONDS = int(os.getenv("DEPLOY_LEASE_SECONDS", "300"))
+DEPLOY_MAX_ATTEMPTS = int(os.getenv("DEPLOY_MAX_ATTEMPTS", "3"))
+DEPLOY_RETRY_SECONDS = int(os.getenv("DEPLOY_RETRY_SECONDS", "10"))
+# Rebuilds within one attempt when the lab changes while it is built
+DEPLOY_PUBLISH_ATTEMPTS = int(os.getenv("DEPLOY_PUBLISH_ATTEMPTS", "3"))
+# How often idle workers look for jobs enqueued by other processes
+DEPLOY_POLL_SECONDS = float(os.getenv("DEPLOY_POLL_SECONDS", "2"))
+DEPLOYMENT_BASE_URL = os.getenv("DEPLOYMENT_BASE_URL", "https://labs.oneclicklabs.io")
+
+# Job fields returned to clients
+DEPLOYMENT_PROJECTION = {"_id": 0, "requestedBy": 0, "authorId": 0, "workerId": 0, "leaseUntil": 0, "availableAt": 0}
+
+class DeploymentFailed(Exception):
+    """A deployment that cannot succeed, so it is not retried"""
+
+def deployment_url(lab_id: str) -> str:
+    return f"{DEPLOYMENT_BASE_URL}/{lab_id}"
+
+def _timestamp(offset_seconds: float = 0) -> str:
+    return (datetime.now() + timedelta(seconds=offset_seconds)).isoformat()
+
+async def enqueue_deployment(lab: Dict[str, Any], current_user: User) -> Dict[str, Any]:
+    """
+    Queue a deploy job for a lab the user may deploy. A lab has at most one
+    queued job, so repeated requests before a worker picks it up return the
+    job that is already waiting.
+    """
+    now = _timestamp()
+    job = {
+        "id": str(uuid.uuid4()),
+        "labId": lab["id"],
+        "authorId": lab["author"]["id"],
+        "requestedBy": current_user.model_dump(include={"id", "name", "email", "role"}),
+        "status": "queued",
+        "stage": None,
+        "attempts": 0,
+        "deploymentUrl": deployment_url(lab["id"]),
+        "createdAt": now,
+        "updatedAt": now,
+        "availableAt": now
+    }
+    try:
+        await get_deployments_collection().insert_one(job)
+    except DuplicateKeyError:
+        existing = await get_deployments_collection().find_one(
+            {"labId": lab["id"], "status": "queued"},
+            DEPLOYMENT_PROJECTION
+        )
+        if existing:
+            return existing
+        # The queued job was claimed in the meantime; queue a new one
+        job.pop("_id", None)
+        await get_deployments_collection().insert_one(job)
+    deploy_workers.notify()
+    return {key: value for key, value in job.items() if key not in DEPLOYMENT_PROJECTION}
+
+async def get_deployment(job_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Fetch a job, including the author id used for permission checks.
+    Callers remove authorId before returning the job to clients.
+    """
+    # Projections cannot mix exclusions with inclusions, so authorId is
+    # kept by leaving it out of the exclusion list
+    return await get_deployments_collection().find_one(
+        {"id": job_id},
+        {key: value for key, value in DEPLOYMENT_PROJECTION.items() if key != "authorId"}
+    )
+
+async def claim_next_job(worker_id: str) -> Optional[Dict[str, Any]]:
+    """Lease the oldest runnable job: queued and due, or running with an expired lease"""
+    now = _timestamp()
+    return await get_deployments_collection().find_one_and_update(
+        {"$or": [
+            {"status": "queued", "availableAt": {"$lte": now}},
+            {"status": "running", "leaseUntil": {"$lt": now}}
+        ]},
+        {
+            "$set": {
+                "status": "running",
+                "stage": "starting",
+                "workerId": worker_id,
+                "leaseUntil": _timestamp(DEPLOY_LEASE_SECONDS),
+                "startedAt": now,
+                "updatedAt": now
+            },
+            "$inc": {"attempts": 1}
+        },
+        sort=[("createdAt", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+async def update_job(job: Dict[str, Any], fields: Dict[str, Any]) -> bool:
+    """Update a job this worker still holds the lease on"""
+    result = await get_deployments_collection().update_one(
+        {"id": job["id"], "status": "running", "workerId": job["workerId"]},
+        {"$set": {**fields, "updatedAt": _timestamp()}}
+    )
+    return result.modified_count == 1
+
+async def publish_lab(
+    lab_id: str,
+    current_user: User,
+    version: int
+) -> Optional[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    """
+    Mark a lab as published if it is still at the version that was built.
+    Returns the lab as it was before the update and the fields the update
+    set, or None if the lab has changed since.
+    """
+    update_data = {
+        "status": "published",
+        "isPublished": True,
+        "publishedAt": _timestamp(),
+        "updatedAt": _timestamp(),
+        "deploymentUrl": deployment_url(lab_id)
+    }
+    # Only labs with content can be deployed; the previous document is
+    # returned so the status counters can be moved
+    if normalized_storage_enabled():
+        previous = await mutate_normalized_header(
+            lab_id,
+            current_user,
+            {"$set": update_data},
+            extra_filter={"sectionCount": {"$gt": 0}, **version_filter(version)},
+            return_previous=True
+        )
+    else:
+        previous = await mutate_lab(
+            lab_id,
+            current_user,
+            {"$set": update_data},
+            extra_filter={"sections.0": {"$exists": True}, **version_filter(version)},
+            return_previous=True
+        )
+    lab_cache.invalidate(lab_id)
+    if not previous:
+        error = await describe_access_failure(lab_id, current_user, "deploy")
+        if error:
+            raise DeploymentFailed(error)
+        current = await get_labs_collection().find_one({"id": lab_id}, {"_id": 0, "version": 1})
+        if current and current.get("version", 0) != version:
+            return None
+        raise DeploymentFailed("Cannot deploy a lab without any content")
+    await adjust_lab_counters(previous["author"]["id"], previous.get("status"), "published")
+    return previous, update_data
+
+async def run_deployment(job: Dict[str, Any]):
+    """Build and publish the lab of a claimed job, recording the outcome"""
+    try:
+        if job["attempts"] > DEPLOY_MAX_ATTEMPTS:
+            # Its previous attempt was interrupted without recording a result
+            raise DeploymentFailed(f"Deployment did not finish after {DEPLOY_MAX_ATTEMPTS} attempts")
+        for _ in range(DEPLOY_PUBLISH_ATTEMPTS):
+            await update_job(job, {"stage": "rendering"})
+            lab = await get_labs_collection().find_one({"id": job["labId"]}, {"_id": 0})
+            if not lab:
+                raise DeploymentFailed("Lab not found")
+            await assemble_lab_documents([lab])
+            build = await build_lab_site(lab)
+
+            if not await update_job(job, {"stage": "publishing", "build": build}):
+                logger.warning(f"Deploy job {job['id']} lost its lease; leaving it to the new owner")
+                return
+            published = await publish_lab(job["labId"], User(**job["requestedBy"]), lab.get("version", 0))
+            if published:
+                break
+            logger.info(f"Lab {job['labId']} changed while deploy job {job['id']} built it; rebuilding")
+        else:
+            # Retried later with a backoff
+            raise RuntimeError("The lab kept changing while it was being deployed")
+        previous, published_fields = published
+        deployed_version = previous.get("version", 0) + 1
+        # Public readers get the content that was built, at the published version
+        await store_public_snapshot({**lab, **published_fields, "version": deployed_version})
+
+        await update_job(job, {
+            "status": "succeeded",
+            "stage": None,
+            "deployedVersion": deployed_version,
+            "error": None,
+            "finishedAt": _timestamp()
+        })
+        logger.info(f"Deploy job {job['id']} published lab {job['labId']}")
+    except Exception as e:
+        logger.error(f"Deploy job {job['id']} failed (attempt {job['attempts']}): {e}")
+        error = str(e)
+        if not isinstance(e, DeploymentFailed) and job["attempts"] < DEPLOY_MAX_ATTEMPTS:
+            try:
+                await update_job(job, {
+                    "status": "queued",
+                    "stage": None,
+                    "error": error,
+                    "availableAt": _timestamp(DEPLOY_RETRY_SECONDS * job["attempts"])
+                })
+                return
+            except DuplicateKeyError:
+                # A newer deployment of the lab is already queued
+                error = f"{error} (superseded by a newer deployment)"
+        await update_job(job, {
+            "status": "failed",
+            "stage": None,
+            "error": error,
+            "finishedAt": _timestamp()
+        })
+
+class DeployWorkerPool:
+    """asyncio workers that claim and run deploy jobs"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+
+    def start(self):
+        self._stopping = False
+        worker_prefix = f"{socket.gethostname()}:{os.getpid()}"
+        self._tasks = [
+            asyncio.create_task(self._work(f"{worker_prefix}:{index}"))
+            for index in range(self.size)
+        ]
+        logger.info(f"Started {self.size} deploy workers")
+
+    async def stop(self):
+        """
+        Stop the workers. Jobs interrupted mid-run keep their lease and are
+        resumed by another worker once it expires.
+        """
+        self._stopping = True
+        self._wakeup.set()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        """Wake idle workers after a job was enqueued in this process"""
+        self._wakeup.set()
+
+    async def _work(self, worker_id: str):
+        while not self._stopping:
+            try:
+                job = await claim_next_job(worker_id)
+            except Exception as e:
+                logger.error(f"Deploy worker {worker_id} could not claim a job: {e}")
+                job = None
+            if job:
+                try:
+                    await run_deployment(job)
+                except Exception as e:
+                    # The job keeps its lease and is retried once it expires
+                    logger.error(f"Deploy worker {worker_id} could not record job {job['id']}: {e}")
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), DEPLOY_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+deploy_workers = DeployWorkerPool(DEPLOY_WORKERS)
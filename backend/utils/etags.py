@@ -0,0 +1,51 @@
+"""
+Helpers for ETag-based conditional requests on labs.
+"""
+import hashlib
+from typing import Iterable, Optional
+
+def lab_etag(lab_id: str, version: int) -> str:
+    """Strong ETag for a lab at a given version"""
+    return f'"{lab_id}:{version}"'
+
+def outline_etag(lab_id: str, version: int) -> str:
+    """Strong ETag for a lab's outline at a given version"""
+    return f'"{lab_id}:{version}:outline"'
+
+def listing_etag(parts: Iterable[object]) -> str:
+    """Strong ETag for a lab listing derived from its watermark and query"""
+    digest = hashlib.sha1("|".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+    return f'"{digest}"'
+
+def _split_etags(header: str):
+    return [tag.strip() for tag in header.split(",") if tag.strip()]
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Check an If-None-Match header against an ETag (weak comparison, as
+    required for If-None-Match).
+    """
+    if not if_none_match:
+        return False
+    for tag in _split_etags(if_none_match):
+        if tag == "*" or tag.removeprefix("W/") == etag:
+            return True
+    return False
+
+def parse_if_match(if_match: Optional[str], lab_id: str) -> Optional[int]:
+    """
+    Extract the expected lab version from an If-Match header.
+    Returns None when there is no precondition ("*" or no header) and
+    raises ValueError when the header does not name a version of this lab.
+    """
+    if not if_match or if_match.strip() == "*":
+        return None
+    for tag in _split_etags(if_match):
+        if tag.startswith("W/"):
+            # Weak tags never satisfy If-Match
+            continue
+        value = tag.strip('"')
+        tag_lab_id, _, version = value.rpartition(":")
+        if tag_lab_id == lab_id and version.isdigit():
+            return int(version)
+    raise ValueError("If-Match does not reference a version of this lab")
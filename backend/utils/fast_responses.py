@@ -0,0 +1,55 @@
+"""
+Fast read path for lab responses.
+
+Labs are validated when they are written, so read endpoints do not need to
+validate them again. Stored documents are shaped into the response models
+with ``model_construct`` (defaults filled in, nothing validated, nested
+content left as stored), and the response body is encoded once with orjson,
+skipping FastAPI's response_model validation and jsonable_encoder pass.
+orjson is optional; without it the standard library encoder is used.
+"""
+import json
+from typing import Any, Dict, Type
+
+from pydantic import BaseModel
+from fastapi.responses import Response
+
+from utils.mongo_utils import MongoJSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def _encode_default(obj: Any) -> Any:
+    # orjson handles datetime itself; ObjectId and models need help
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(mode="json")
+    return MongoJSONEncoder().default(obj)
+
+def dumps(content: Any) -> bytes:
+    """Encode content as compact UTF-8 JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(content, default=_encode_default)
+    return json.dumps(
+        content,
+        cls=MongoJSONEncoder,
+        ensure_ascii=False,
+        separators=(",", ":")
+    ).encode("utf-8")
+
+class FastJSONResponse(Response):
+    """JSON response encoded with orjson when available"""
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+def trusted_payload(model: Type[BaseModel], doc: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Shape a stored, already validated document as model without validating
+    it: missing fields get their defaults and fields the model does not
+    declare (such as ``_id``) are dropped. Nested values are not copied.
+    """
+    constructed = model.model_construct(**doc)
+    return {name: getattr(constructed, name) for name in model.model_fields}
@@ -0,0 +1,48 @@
+"""
+Lab access scope.
+
+Who may read or change a lab is decided in the query itself: handlers fetch
+or update labs through ``lab_access_filter``, so a lab the user may not
+access is never transferred. Only when such a query matches nothing is the
+reason looked up, with a projection-only probe.
+"""
+from typing import Any, Dict, Optional
+
+from database import get_labs_collection
+from models.user import User
+
+def lab_scope(current_user: User) -> Dict[str, Any]:
+    """
+    Filter matching the labs the user is allowed to access.
+    Admins may access any lab; everyone else only their own.
+    """
+    if current_user.role == "admin":
+        return {}
+    return {"author.id": current_user.id}
+
+def lab_access_filter(lab_id: str, current_user: User, extra_filter: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Build the filter matching a lab the user is allowed to access"""
+    query = {"id": lab_id, **lab_scope(current_user)}
+    if extra_filter:
+        query.update(extra_filter)
+    return query
+
+async def probe_lab(lab_id: str, current_user: User, fields: tuple = ()) -> Optional[Dict[str, Any]]:
+    """Fetch only the given fields of a lab the user may access, or None"""
+    return await get_labs_collection().find_one(
+        lab_access_filter(lab_id, current_user),
+        {"_id": 0, "id": 1, **{field: 1 for field in fields}}
+    )
+
+async def describe_access_failure(lab_id: str, current_user: User, action: str) -> Optional[str]:
+    """
+    Explain why a query scoped by lab_access_filter matched nothing, using a
+    projection-only probe. Returns None when the lab exists and the user may
+    access it, meaning another filter condition was not met.
+    """
+    lab = await get_labs_collection().find_one({"id": lab_id}, {"_id": 0, "author.id": 1})
+    if not lab:
+        return "Lab not found"
+    if lab.get("author", {}).get("id") != current_user.id and current_user.role != "admin":
+        return f"You do not have permission to {action} this lab"
+    return None
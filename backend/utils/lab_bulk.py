@@ -0,0 +1,235 @@
+"""
+Bulk lab operations.
+
+POST /labs/bulk takes a list of create, update and delete operations. They
+are validated one by one, checked against the labs' current state in a
+single query, and written with one unordered bulk_write; each operation gets
+its own result. Updates and deletes only apply to the version that was read,
+so the status counters, blob references and build caches can be adjusted
+from that state afterwards without reading the labs again. Updates that
+change a title or description are recorded in the labs' version history.
+"""
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from pydantic import ValidationError
+from pymongo import DeleteOne, InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from database import get_labs_collection
+from models.lab import Lab, BulkCreateOperation, BulkUpdateOperation, bulk_operation_adapter
+from models.user import User
+from utils.blob_store import BLOB_FIELDS, collect_refs, release_refs
+from utils.autosave import autosave_buffer
+from utils.lab_access import lab_scope
+from utils.lab_cache import lab_cache
+from utils.lab_outline import delete_lab_outlines
+from utils.lab_mutations import literal_fields, version_filter, with_version_bump, adjust_lab_counters_many
+from utils.lab_storage import is_normalized, new_lab_document, delete_labs_content
+from utils.lab_versions import delete_lab_versions, record_lab_version
+from utils.public_snapshots import delete_public_snapshots
+from utils.site_builds import delete_labs_builds
+
+logger = logging.getLogger(__name__)
+
+BULK_MAX_OPERATIONS = 1000
+
+# What the side effects of an update or delete need to know about a lab
+BULK_STATE_PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    "author.id": 1,
+    "status": 1,
+    "version": 1,
+    "storage": 1,
+    **{f"sections.modules.{ref_field}": 1 for ref_field in BLOB_FIELDS.values()}
+}
+
+def _result(index: int, op: Optional[str], lab_id: Optional[str], error: Optional[str] = None, version: Optional[int] = None) -> Dict[str, Any]:
+    return {
+        "index": index,
+        "op": op,
+        "id": lab_id,
+        "success": error is None,
+        "version": version,
+        "error": error
+    }
+
+def _update_pipeline(operation: BulkUpdateOperation, now: str) -> List[Dict[str, Any]]:
+    update_data = {"updatedAt": now}
+    if operation.title is not None:
+        update_data["title"] = operation.title
+    if operation.description is not None:
+        update_data["description"] = operation.description
+    pipeline = []
+    if operation.status is not None:
+        update_data["status"] = operation.status
+        update_data["isPublished"] = operation.status == "published"
+        if operation.status == "published":
+            # publishedAt is only set on the first publish
+            pipeline.append({"$set": {"publishedAt": {
+                "$cond": [{"$eq": ["$isPublished", True]}, "$publishedAt", {"$literal": now}]
+            }}})
+    pipeline.append({"$set": literal_fields(update_data)})
+    return with_version_bump(pipeline)
+
+async def run_bulk_operations(operations: List[Any], current_user: User) -> List[Dict[str, Any]]:
+    """Validate and apply a batch of lab operations, returning one result per operation"""
+    results: List[Optional[Dict[str, Any]]] = [None] * len(operations)
+
+    # Validate everything first; invalid operations fail on their own
+    parsed = []
+    targeted = set()
+    for index, raw in enumerate(operations):
+        op = raw.get("op") if isinstance(raw, dict) else None
+        try:
+            operation = bulk_operation_adapter.validate_python(raw)
+        except ValidationError as e:
+            error = e.errors()[0]
+            location = ".".join(str(part) for part in error["loc"])
+            results[index] = _result(index, op, None, f"Invalid operation: {location + ': ' if location else ''}{error['msg']}")
+            continue
+        if isinstance(operation, BulkCreateOperation):
+            parsed.append((index, operation))
+        elif operation.id in targeted:
+            results[index] = _result(index, op, operation.id, "Lab appears in more than one operation")
+        else:
+            targeted.add(operation.id)
+            parsed.append((index, operation))
+
+    # One query fetches the state of every lab to update or delete
+    states = {}
+    if targeted:
+        async for lab in get_labs_collection().find(
+            {"id": {"$in": list(targeted)}, **lab_scope(current_user)},
+            BULK_STATE_PROJECTION
+        ):
+            states[lab["id"]] = lab
+    inaccessible = set()
+    missing = targeted - set(states)
+    if missing:
+        async for lab in get_labs_collection().find({"id": {"$in": list(missing)}}, {"_id": 0, "id": 1}):
+            inaccessible.add(lab["id"])
+
+    now = datetime.now().isoformat()
+    requests = []
+    planned = []
+    for index, operation in parsed:
+        if isinstance(operation, BulkCreateOperation):
+            lab = Lab(
+                title=operation.title,
+                description=operation.description,
+                author={"id": current_user.id, "name": current_user.name, "email": current_user.email},
+                sections=[],
+                createdAt=now,
+                updatedAt=now
+            )
+            requests.append(InsertOne(new_lab_document(lab.model_dump())))
+            planned.append((index, operation, lab.model_dump(include={"id", "author", "status", "version"})))
+            continue
+
+        state = states.get(operation.id)
+        if state is None:
+            error = (
+                f"You do not have permission to {operation.op} this lab"
+                if operation.id in inaccessible else "Lab not found"
+            )
+            results[index] = _result(index, operation.op, operation.id, error)
+            continue
+        version = state.get("version", 0)
+        if operation.version is not None and operation.version != version:
+            results[index] = _result(index, operation.op, operation.id, "Lab has been modified since it was fetched")
+            continue
+        query = {"id": operation.id, **lab_scope(current_user), **version_filter(version)}
+        if isinstance(operation, BulkUpdateOperation):
+            requests.append(UpdateOne(query, _update_pipeline(operation, now)))
+        else:
+            requests.append(DeleteOne(query))
+        planned.append((index, operation, state))
+
+    if not requests:
+        return results
+
+    write_errors = {}
+    try:
+        result = await get_labs_collection().bulk_write(requests, ordered=False)
+        matched, removed = result.matched_count, result.deleted_count
+    except BulkWriteError as e:
+        for write_error in e.details.get("writeErrors", []):
+            write_errors[write_error["index"]] = write_error.get("errmsg", "Write failed")
+        matched, removed = e.details.get("nMatched", 0), e.details.get("nRemoved", 0)
+    finally:
+        for lab_id in targeted:
+            lab_cache.invalidate(lab_id)
+
+    # Bulk results only carry totals. If some updates or deletes matched
+    # nothing (the lab changed after it was read), find out which by
+    # looking for the version and timestamp each update wrote.
+    updates = [position for position, (_, operation, _) in enumerate(planned) if isinstance(operation, BulkUpdateOperation)]
+    deletes = [position for position, (_, operation, _) in enumerate(planned) if operation.op == "delete"]
+    written = None
+    if (
+        matched < len([position for position in updates if position not in write_errors])
+        or removed < len([position for position in deletes if position not in write_errors])
+    ):
+        written = {}
+        async for lab in get_labs_collection().find(
+            {"id": {"$in": [planned[position][1].id for position in updates + deletes]}},
+            {"_id": 0, "id": 1, "version": 1, "updatedAt": 1}
+        ):
+            written[lab["id"]] = lab
+
+    counter_changes = []
+    deleted = []
+    unpublished = []
+    versioned = []
+    for position, (index, operation, state) in enumerate(planned):
+        if position in write_errors:
+            results[index] = _result(index, operation.op, getattr(operation, "id", None), write_errors[position])
+            continue
+        if isinstance(operation, BulkCreateOperation):
+            counter_changes.append((state["author"]["id"], None, state["status"]))
+            results[index] = _result(index, operation.op, state["id"], version=state["version"])
+            continue
+        expected_version = state.get("version", 0) + 1
+        if isinstance(operation, BulkUpdateOperation):
+            if written is not None:
+                current = written.get(operation.id) or {}
+                if current.get("version") != expected_version or current.get("updatedAt") != now:
+                    results[index] = _result(index, operation.op, operation.id, "Lab has been modified since it was fetched")
+                    continue
+            if operation.status is not None:
+                counter_changes.append((state["author"]["id"], state.get("status"), operation.status))
+                if operation.status != "published" and state.get("status") == "published":
+                    unpublished.append(operation.id)
+            if operation.title is not None or operation.description is not None:
+                versioned.append(operation.id)
+            results[index] = _result(index, operation.op, operation.id, version=expected_version)
+        else:
+            if written is not None and operation.id in written:
+                results[index] = _result(index, operation.op, operation.id, "Lab has been modified since it was fetched")
+                continue
+            counter_changes.append((state["author"]["id"], state.get("status"), None))
+            deleted.append(state)
+            autosave_buffer.discard(operation.id)
+            results[index] = _result(index, operation.op, operation.id)
+
+    await adjust_lab_counters_many(counter_changes)
+    await asyncio.gather(*(record_lab_version(lab_id, current_user) for lab_id in versioned))
+    if deleted:
+        normalized_ids = [lab["id"] for lab in deleted if is_normalized(lab)]
+        if normalized_ids:
+            await delete_labs_content(normalized_ids)
+        await release_refs(collect_refs([
+            section for lab in deleted if not is_normalized(lab) for section in lab.get("sections") or []
+        ]))
+        await delete_labs_builds([lab["id"] for lab in deleted])
+        await delete_lab_versions([lab["id"] for lab in deleted])
+        await delete_lab_outlines([lab["id"] for lab in deleted])
+    if deleted or unpublished:
+        await delete_public_snapshots(unpublished + [lab["id"] for lab in deleted])
+
+    logger.info(f"Bulk lab operations: {sum(1 for result in results if result['success'])} of {len(results)} applied")
+    return results
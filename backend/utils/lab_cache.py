@@ -0,0 +1,141 @@
+"""
+In-process cache of lab read responses.
+
+GET /labs/{id} caches the encoded lab it sends, keyed by lab id, version and
+response variant. Reads first fetch the lab's current version with a
+projection-only probe, so a hit skips the full document fetch, section
+assembly, blob hydration and encoding, and a write (which bumps the
+version) can never be served stale. Write paths also invalidate the lab so
+superseded versions free their memory right away, and writes made by other
+processes are invalidated through utils.cache_invalidation.
+
+Entries are evicted least recently used first once the cache holds more
+than LAB_CACHE_MAX_BYTES of encoded labs, and expire after
+LAB_CACHE_TTL_SECONDS. Set LAB_CACHE_MAX_BYTES=0 to disable the cache.
+"""
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Set, Tuple
+
+LAB_CACHE_MAX_BYTES = int(os.getenv("LAB_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+LAB_CACHE_TTL_SECONDS = float(os.getenv("LAB_CACHE_TTL_SECONDS", "300"))
+# Number of recent invalidations remembered to reject fills that raced them
+LAB_CACHE_INVALIDATION_HISTORY = 10000
+
+class LabCache:
+    """
+    Byte-capped LRU cache with per-entry TTL. Keys are tuples whose first
+    element is the lab id, so all versions of a lab can be invalidated.
+
+    A fill must present the token taken before the lab was read; it is
+    dropped if the lab was invalidated since, so a read that raced a write
+    cannot cache content the write has already replaced.
+    """
+
+    def __init__(self, max_bytes: int, ttl_seconds: float):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Tuple, Tuple[float, bytes]]" = OrderedDict()
+        self._keys_by_lab: Dict[Hashable, Set[Tuple]] = {}
+        self._bytes = 0
+        self._epoch = 0
+        self._invalidated: "OrderedDict[Hashable, int]" = OrderedDict()
+        self._history_floor = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.rejected_fills = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def token(self) -> int:
+        """Token to take before reading a lab that may be put in the cache"""
+        return self._epoch
+
+    def get(self, key: Tuple) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Tuple, value: bytes, token: int):
+        if not self.enabled or len(value) > self.max_bytes:
+            return
+        lab_id = key[0]
+        if token < self._history_floor or self._invalidated.get(lab_id, 0) > token:
+            self.rejected_fills += 1
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._keys_by_lab.setdefault(lab_id, set()).add(key)
+        self._bytes += len(value)
+        while self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def invalidate(self, lab_id: Hashable):
+        """Drop every cached version of a lab and reject fills already in flight"""
+        self._epoch += 1
+        self._invalidated[lab_id] = self._epoch
+        self._invalidated.move_to_end(lab_id)
+        if len(self._invalidated) > LAB_CACHE_INVALIDATION_HISTORY:
+            _, self._history_floor = self._invalidated.popitem(last=False)
+        for key in list(self._keys_by_lab.get(lab_id, ())):
+            self._remove(key)
+        self.invalidations += 1
+
+    def clear(self):
+        """Drop every entry and reject every fill already in flight"""
+        self._epoch += 1
+        self._history_floor = self._epoch
+        for key in list(self._entries):
+            self._remove(key)
+        self.invalidations += 1
+
+    def handle_invalidation(self, lab_id: Optional[Hashable]):
+        """Registry handler (see utils.cache_invalidation); None means any lab may have changed"""
+        if lab_id is None:
+            self.clear()
+        else:
+            self.invalidate(lab_id)
+
+    def _remove(self, key: Tuple):
+        _, value = self._entries.pop(key)
+        self._bytes -= len(value)
+        keys = self._keys_by_lab.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_lab[key[0]]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "maxBytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "rejectedFills": self.rejected_fills
+        }
+
+lab_cache = LabCache(LAB_CACHE_MAX_BYTES, LAB_CACHE_TTL_SECONDS)
@@ -0,0 +1,146 @@
+"""
+Shared atomic write path for lab mutations.
+"""
+import copy
+from typing import Any, Dict, Iterable, Optional, Tuple
+from pymongo import ReturnDocument, UpdateOne
+
+from database import get_labs_collection, get_lab_counters_collection
+from models.user import User
+from utils.lab_access import lab_access_filter
+
+def literal_fields(fields: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Wrap values in $literal so they can be used in an aggregation pipeline
+    update without strings like "$x" being read as field paths.
+    """
+    return {key: {"$literal": value} for key, value in fields.items()}
+
+def nested_set_fields(prefix: str, fields: Dict[str, Any], protected: tuple = ("id",)) -> Dict[str, Any]:
+    """
+    Turn a partial update into $set paths under prefix. Keys may be dotted
+    paths into the target (e.g. "questions.0.options.1.text").
+    Raises ValueError for empty, operator or protected keys.
+    """
+    update = {}
+    for key, value in fields.items():
+        parts = key.split(".")
+        if not key or "$" in key or any(part == "" for part in parts):
+            raise ValueError(f"Invalid field path: {key!r}")
+        if parts[0] in protected:
+            raise ValueError(f"Field {parts[0]!r} cannot be changed")
+        update[f"{prefix}.{key}" if prefix else key] = value
+    return update
+
+def apply_set_fields(doc: Dict[str, Any], update: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Apply $set paths made by nested_set_fields (without a prefix) to a copy
+    of doc, so the result can be validated before it is written.
+    Raises ValueError for paths that do not fit the document.
+    """
+    result = copy.deepcopy(doc)
+    for key, value in update.items():
+        target = result
+        parts = key.split(".")
+        for i, part in enumerate(parts):
+            last = i == len(parts) - 1
+            if isinstance(target, dict):
+                if last:
+                    target[part] = value
+                else:
+                    target = target.setdefault(part, {})
+            elif isinstance(target, list):
+                if not part.isdigit() or int(part) > len(target):
+                    raise ValueError(f"Invalid field path: {key!r}")
+                index = int(part)
+                if index == len(target):
+                    target.append(value if last else {})
+                elif last:
+                    target[index] = value
+                target = target[index]
+            else:
+                raise ValueError(f"Invalid field path: {key!r}")
+    return result
+
+def version_filter(version: int) -> Dict[str, Any]:
+    """Filter matching a lab at the given version (labs without one are version 0)"""
+    if version == 0:
+        return {"version": {"$in": [0, None]}}
+    return {"version": version}
+
+def with_version_bump(update: Any) -> Any:
+    """Add an increment of the lab version to an update document or pipeline"""
+    if isinstance(update, list):
+        return update + [{"$set": {"version": {"$add": [{"$ifNull": ["$version", 0]}, 1]}}}]
+    increments = {**update.get("$inc", {}), "version": 1}
+    return {**update, "$inc": increments}
+
+def merge_update(previous: Dict[str, Any], fields: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Rebuild the updated document from the one returned before a top-level
+    $set, including the version bump applied by mutate_lab.
+    """
+    return {**previous, **fields, "version": previous.get("version", 0) + 1}
+
+async def mutate_lab(
+    lab_id: str,
+    current_user: User,
+    update: Any,
+    extra_filter: Optional[Dict[str, Any]] = None,
+    return_previous: bool = False,
+    **kwargs
+) -> Optional[Dict[str, Any]]:
+    """
+    Apply an update to a lab the user may modify in a single
+    find_one_and_update round trip. Every write increments the lab version.
+
+    Returns the document after the update, or before it when
+    return_previous is set. Returns None if no lab matched the filter.
+    """
+    return await get_labs_collection().find_one_and_update(
+        lab_access_filter(lab_id, current_user, extra_filter),
+        with_version_bump(update),
+        return_document=ReturnDocument.BEFORE if return_previous else ReturnDocument.AFTER,
+        **kwargs
+    )
+
+def _counter_increments(old_status: Optional[str], new_status: Optional[str]) -> Dict[str, int]:
+    increments = {}
+    if old_status is not None:
+        increments[f"counts.{old_status}"] = -1
+    if new_status is not None:
+        increments[f"counts.{new_status}"] = 1
+    if old_status is None:
+        increments["total"] = 1
+    elif new_status is None:
+        increments["total"] = -1
+    return increments
+
+async def adjust_lab_counters(author_id: str, old_status: Optional[str], new_status: Optional[str]):
+    """
+    Move one lab between the per-author status counters.
+    Pass old_status=None for a created lab and new_status=None for a deleted one.
+    """
+    if old_status == new_status:
+        return
+    await get_lab_counters_collection().update_one(
+        {"authorId": author_id},
+        {"$inc": _counter_increments(old_status, new_status)},
+        upsert=True
+    )
+
+async def adjust_lab_counters_many(changes: Iterable[Tuple[str, Optional[str], Optional[str]]]):
+    """Apply many (author_id, old_status, new_status) moves, one write per author"""
+    totals: Dict[str, Dict[str, int]] = {}
+    for author_id, old_status, new_status in changes:
+        if old_status == new_status:
+            continue
+        author_totals = totals.setdefault(author_id, {})
+        for field, delta in _counter_increments(old_status, new_status).items():
+            author_totals[field] = author_totals.get(field, 0) + delta
+    requests = [
+        UpdateOne({"authorId": author_id}, {"$inc": increments}, upsert=True)
+        for author_id, increments in totals.items()
+    ]
+    if requests:
+        await get_lab_counters_collection().bulk_write(requests, ordered=False)
@@ -0,0 +1,136 @@
+"""
+Lab outlines.
+
+Sidebars and the lab viewer only need the lab's title and the ids, titles,
+types and order of its sections and modules. Every content write stores
+that outline, tagged with the lab version it describes, in ``lab_outlines``,
+so GET /labs/{id}/outline answers with a few hundred bytes instead of the
+whole lab.
+
+A stored outline is only served while its version is the lab's current
+version. A write path that did not refresh it (bulk updates, for one) just
+makes the next read rebuild it, from a projection that never reads module
+content.
+"""
+import logging
+from typing import Any, Dict, List, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+from database import get_labs_collection, get_sections_collection, get_modules_collection, get_lab_outlines_collection
+from utils.lab_storage import is_normalized
+
+logger = logging.getLogger(__name__)
+
+OUTLINE_SECTION_FIELDS = ("id", "title", "order")
+OUTLINE_MODULE_FIELDS = ("id", "title", "type", "order")
+
+# Embedded labs are reduced to their outline by the server
+OUTLINE_PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    "title": 1,
+    "version": 1,
+    "storage": 1,
+    "contentGeneration": 1,
+    "sections": {"$map": {
+        "input": {"$ifNull": ["$sections", []]},
+        "as": "section",
+        "in": {
+            **{field: f"$$section.{field}" for field in OUTLINE_SECTION_FIELDS},
+            "modules": {"$map": {
+                "input": {"$ifNull": ["$$section.modules", []]},
+                "as": "module",
+                "in": {field: f"$$module.{field}" for field in OUTLINE_MODULE_FIELDS}
+            }}
+        }
+    }}
+}
+
+def build_outline(lab: Dict[str, Any]) -> Dict[str, Any]:
+    """Outline of a lab document with its sections (stored or hydrated)"""
+    return {
+        "id": lab["id"],
+        "title": lab.get("title"),
+        "version": lab.get("version", 0),
+        "sections": [
+            {
+                **{field: section.get(field) for field in OUTLINE_SECTION_FIELDS},
+                "modules": [
+                    {field: module.get(field) for field in OUTLINE_MODULE_FIELDS}
+                    for module in section.get("modules") or []
+                ]
+            }
+            for section in lab.get("sections") or []
+        ]
+    }
+
+async def _normalized_sections(header: Dict[str, Any]) -> List[Dict[str, Any]]:
+    query = {"labId": header["id"], "generation": header.get("contentGeneration")}
+    sections = await get_sections_collection().find(
+        query, {"_id": 0, "position": 1, **{field: 1 for field in OUTLINE_SECTION_FIELDS}}
+    ).sort("position", 1).to_list(length=None)
+    modules = await get_modules_collection().find(
+        query, {"_id": 0, "sectionId": 1, "position": 1, **{field: 1 for field in OUTLINE_MODULE_FIELDS}}
+    ).sort("position", 1).to_list(length=None)
+    modules_by_section: Dict[str, List[Dict[str, Any]]] = {}
+    for module in modules:
+        modules_by_section.setdefault(module["sectionId"], []).append(module)
+    return [{**section, "modules": modules_by_section.get(section["id"], [])} for section in sections]
+
+async def load_outline(lab_id: str) -> Optional[Dict[str, Any]]:
+    """Build a lab's outline from the database without reading module content"""
+    docs = await get_labs_collection().aggregate([
+        {"$match": {"id": lab_id}},
+        {"$project": OUTLINE_PROJECTION}
+    ]).to_list(length=1)
+    if not docs:
+        return None
+    lab = docs[0]
+    if is_normalized(lab):
+        lab["sections"] = await _normalized_sections(lab)
+    return build_outline(lab)
+
+async def store_outline(outline: Dict[str, Any], replace_same_version: bool = False):
+    """
+    Store an outline unless a newer one is stored. Writers replace an
+    outline of the same version, since a normalized lab's version is bumped
+    before its section or module documents change and a concurrent read may
+    have stored the outline in between.
+    """
+    try:
+        await get_lab_outlines_collection().replace_one(
+            {"_id": outline["id"], "version": {"$lte" if replace_same_version else "$lt": outline["version"]}},
+            outline,
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # A newer outline is already stored
+        pass
+
+async def refresh_lab_outline(lab_id: str, lab: Optional[Dict[str, Any]] = None):
+    """
+    Store a lab's outline after a write. lab may be passed when the caller
+    already has the lab with its sections at its new version; otherwise the
+    outline is loaded. Failures are logged, never raised: reads rebuild
+    stale outlines.
+    """
+    try:
+        outline = build_outline(lab) if lab is not None else await load_outline(lab_id)
+        if outline is not None:
+            await store_outline(outline, replace_same_version=True)
+    except Exception as e:
+        logger.error(f"Could not refresh outline of lab {lab_id}: {e}")
+
+async def get_lab_outline(lab_id: str, version: int) -> Optional[Dict[str, Any]]:
+    """The lab's outline at version, rebuilt and stored if it is missing or stale"""
+    outline = await get_lab_outlines_collection().find_one({"_id": lab_id, "version": version}, {"_id": 0})
+    if outline is None:
+        outline = await load_outline(lab_id)
+        if outline is not None:
+            await store_outline(outline)
+    return outline
+
+async def delete_lab_outlines(lab_ids: List[str]):
+    """Remove the outlines of deleted labs"""
+    await get_lab_outlines_collection().delete_many({"_id": {"$in": lab_ids}})
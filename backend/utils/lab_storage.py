@@ -0,0 +1,619 @@
+"""
+Normalized lab storage.
+
+In normalized mode the lab document only holds the header; sections and
+modules live in the ``sections`` and ``modules`` collections and are
+assembled on read. Each full content write inserts a new generation of
+section/module documents and then switches the header's
+``contentGeneration`` to it, so readers never observe a half-written lab.
+"""
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from pymongo import ReturnDocument
+
+from database import (
+    get_labs_collection, get_sections_collection, get_modules_collection,
+    get_migrations_collection
+)
+from models.lab import module_adapter
+from models.user import User
+from utils.lab_access import lab_access_filter
+from utils.lab_mutations import mutate_lab, version_filter, apply_set_fields
+from utils.blob_store import BLOB_FIELDS, collect_refs, retain_refs, release_refs
+
+logger = logging.getLogger(__name__)
+
+# "embedded" keeps sections inside the lab document, "normalized" writes
+# them to their own collections. Reads understand both layouts.
+LAB_STORAGE_MODE = os.getenv("LAB_STORAGE_MODE", "embedded").lower()
+NORMALIZED = "normalized"
+
+MIGRATION_ID = "labs_normalized_storage"
+
+# Bookkeeping fields on section/module documents that are not part of the lab
+STORAGE_FIELDS = ("_id", "labId", "sectionId", "generation", "position")
+
+def normalized_storage_enabled() -> bool:
+    return LAB_STORAGE_MODE == NORMALIZED
+
+def is_normalized(doc: Optional[Dict[str, Any]]) -> bool:
+    return bool(doc) and doc.get("storage") == NORMALIZED
+
+def new_generation() -> str:
+    return str(uuid.uuid4())
+
+def new_lab_document(lab_doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Lay out a new, empty lab for the configured storage mode"""
+    if normalized_storage_enabled():
+        # Sections live in their own collections; the header starts empty
+        lab_doc.pop("sections", None)
+        lab_doc.update({
+            "storage": NORMALIZED,
+            "contentGeneration": new_generation(),
+            "sectionCount": 0,
+            "moduleCount": 0
+        })
+    return lab_doc
+
+def _strip(doc: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: value for key, value in doc.items() if key not in STORAGE_FIELDS}
+
+def split_sections(lab_id: str, generation: str, sections: List[Any]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Split embedded sections into section and module documents"""
+    section_docs = []
+    module_docs = []
+    for position, section in enumerate(sections or []):
+        section = dict(section)
+        modules = section.pop("modules", None) or []
+        section_id = section.get("id") or str(uuid.uuid4())
+        section_docs.append({
+            **section,
+            "id": section_id,
+            "labId": lab_id,
+            "generation": generation,
+            "position": position
+        })
+        for module_position, module in enumerate(modules):
+            module = dict(module)
+            module_docs.append({
+                **module,
+                "id": module.get("id") or str(uuid.uuid4()),
+                "labId": lab_id,
+                "sectionId": section_id,
+                "generation": generation,
+                "position": module_position
+            })
+    return section_docs, module_docs
+
+def content_counts(section_docs: List[Any], module_docs: List[Any]) -> Dict[str, int]:
+    return {"sectionCount": len(section_docs), "moduleCount": len(module_docs)}
+
+def assemble_sections(section_docs: List[Dict[str, Any]], module_docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Rebuild embedded sections from section and module documents"""
+    modules_by_section = {}
+    for module in sorted(module_docs, key=lambda module: module.get("position", 0)):
+        modules_by_section.setdefault(module["sectionId"], []).append(_strip(module))
+    return [
+        {**_strip(section), "modules": modules_by_section.get(section["id"], [])}
+        for section in sorted(section_docs, key=lambda section: section.get("position", 0))
+    ]
+
+async def load_sections(headers: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    """Fetch the current sections of normalized labs in parallel, keyed by lab id"""
+    query = {"$or": [
+        {"labId": header["id"], "generation": header.get("contentGeneration")}
+        for header in headers
+    ]}
+    section_docs, module_docs = await asyncio.gather(
+        get_sections_collection().find(query).to_list(length=None),
+        get_modules_collection().find(query).to_list(length=None)
+    )
+
+    sections_by_lab = {header["id"]: [] for header in headers}
+    modules_by_lab = {header["id"]: [] for header in headers}
+    for section in section_docs:
+        sections_by_lab[section["labId"]].append(section)
+    for module in module_docs:
+        modules_by_lab[module["labId"]].append(module)
+    return {
+        lab_id: assemble_sections(sections_by_lab[lab_id], modules_by_lab[lab_id])
+        for lab_id in sections_by_lab
+    }
+
+async def assemble_lab_documents(docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Fill in sections for normalized lab headers; embedded documents pass through"""
+    headers = [doc for doc in docs if is_normalized(doc)]
+    if headers:
+        sections_by_lab = await load_sections(headers)
+        for doc in headers:
+            doc["sections"] = sections_by_lab.get(doc["id"], [])
+    return docs
+
+async def insert_generation(section_docs: List[Dict[str, Any]], module_docs: List[Dict[str, Any]]):
+    if section_docs:
+        await get_sections_collection().insert_many(section_docs, ordered=False)
+    if module_docs:
+        await get_modules_collection().insert_many(module_docs, ordered=False)
+
+async def _module_refs(query: Dict[str, Any]) -> List[str]:
+    projection = {"_id": 0, **{ref_field: 1 for ref_field in BLOB_FIELDS.values()}}
+    modules = await get_modules_collection().find(query, projection).to_list(length=None)
+    return collect_refs([{"modules": modules}])
+
+async def delete_generation(lab_id: str, generation: Optional[str], release: bool = False):
+    """Delete one content generation, optionally releasing its blob references"""
+    query = {"labId": lab_id, "generation": generation}
+    refs = await _module_refs(query) if release else []
+    await asyncio.gather(
+        get_sections_collection().delete_many(query),
+        get_modules_collection().delete_many(query)
+    )
+    await release_refs(refs)
+
+async def delete_lab_content(lab_id: str):
+    """Remove every section and module document of a lab"""
+    await delete_labs_content([lab_id])
+
+async def delete_labs_content(lab_ids: List[str]):
+    """Remove every section and module document of several labs"""
+    query = {"labId": {"$in": lab_ids}}
+    refs = await _module_refs(query)
+    await asyncio.gather(
+        get_sections_collection().delete_many(query),
+        get_modules_collection().delete_many(query)
+    )
+    await release_refs(refs)
+
+async def replace_sections(
+    lab_id: str,
+    sections: List[Any],
+    commit: Callable[[str, Dict[str, int]], Awaitable[Optional[Dict[str, Any]]]]
+) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Write sections as a new content generation and switch the lab to it.
+
+    commit(generation, counts) must update the lab header (setting
+    contentGeneration and the counts) and return the header as it was
+    before the update, or None if the lab could not be written. Returns
+    that previous header and the assembled sections.
+    """
+    generation = new_generation()
+    section_docs, module_docs = split_sections(lab_id, generation, sections)
+    await insert_generation(section_docs, module_docs)
+    try:
+        previous = await commit(generation, content_counts(section_docs, module_docs))
+    except Exception:
+        await delete_generation(lab_id, generation)
+        raise
+    if not previous:
+        await delete_generation(lab_id, generation)
+        return None, []
+
+    if is_normalized(previous):
+        await delete_generation(lab_id, previous.get("contentGeneration"), release=True)
+    return previous, assemble_sections(section_docs, module_docs)
+
+async def migrate_lab(lab_id: str, max_attempts: int = 3) -> bool:
+    """
+    Move one embedded lab to normalized storage. Safe to run while the lab
+    is being edited: the header switch is conditional on the version that
+    was copied, and the copy is retried if the lab changed meanwhile.
+    Returns True if the lab was migrated by this call.
+    """
+    for _ in range(max_attempts):
+        doc = await get_labs_collection().find_one({"id": lab_id})
+        if not doc or is_normalized(doc):
+            return False
+
+        generation = new_generation()
+        section_docs, module_docs = split_sections(lab_id, generation, doc.get("sections"))
+        await insert_generation(section_docs, module_docs)
+
+        result = await get_labs_collection().update_one(
+            {"id": lab_id, "storage": {"$ne": NORMALIZED}, **version_filter(doc.get("version", 0))},
+            {
+                "$set": {
+                    "storage": NORMALIZED,
+                    "contentGeneration": generation,
+                    **content_counts(section_docs, module_docs)
+                },
+                "$unset": {"sections": ""}
+            }
+        )
+        if result.modified_count:
+            return True
+        await delete_generation(lab_id, generation)
+
+    logger.warning(f"Could not migrate lab {lab_id} to normalized storage: it kept changing")
+    return False
+
+async def mutate_normalized_header(
+    lab_id: str,
+    current_user: User,
+    update: Any,
+    extra_filter: Optional[Dict[str, Any]] = None,
+    **kwargs
+) -> Optional[Dict[str, Any]]:
+    """
+    mutate_lab restricted to normalized headers. A lab still in the embedded
+    layout is migrated first, so normalized writes work on any lab.
+    """
+    normalized_filter = {"storage": NORMALIZED, **(extra_filter or {})}
+    header = await mutate_lab(lab_id, current_user, update, extra_filter=normalized_filter, **kwargs)
+    if header is None and await migrate_lab(lab_id):
+        header = await mutate_lab(lab_id, current_user, update, extra_filter=normalized_filter, **kwargs)
+    return header
+
+async def migrate_labs(batch_size: int = 100, restart: bool = False) -> int:
+    """
+    Migrate all embedded labs to normalized storage in batches ordered by
+    lab id. Progress is checkpointed after every batch, so an interrupted
+    run resumes where it stopped. Returns the number of labs migrated.
+    """
+    migrations = get_migrations_collection()
+    state = {} if restart else (await migrations.find_one({"_id": MIGRATION_ID}) or {})
+    last_lab_id = state.get("lastLabId", "")
+    migrated = state.get("migrated", 0)
+
+    while True:
+        batch = await get_labs_collection().find(
+            {"id": {"$gt": last_lab_id}, "storage": {"$ne": NORMALIZED}},
+            {"_id": 0, "id": 1}
+        ).sort("id", 1).limit(batch_size).to_list(length=batch_size)
+        if not batch:
+            break
+
+        for doc in batch:
+            if await migrate_lab(doc["id"]):
+                migrated += 1
+        last_lab_id = batch[-1]["id"]
+
+        await migrations.update_one(
+            {"_id": MIGRATION_ID},
+            {"$set": {
+                "lastLabId": last_lab_id,
+                "migrated": migrated,
+                "completed": False,
+                "updatedAt": datetime.now().isoformat()
+            }},
+            upsert=True
+        )
+        logger.info(f"Migrated {migrated} labs to normalized storage (up to {last_lab_id})")
+
+    await migrations.update_one(
+        {"_id": MIGRATION_ID},
+        {"$set": {"completed": True, "migrated": migrated, "updatedAt": datetime.now().isoformat()}},
+        upsert=True
+    )
+    return migrated
+
+async def add_normalized_section(
+    lab_id: str,
+    current_user: User,
+    section: Dict[str, Any],
+    default_order: bool,
+    max_attempts: int = 3
+) -> Optional[Dict[str, Any]]:
+    """
+    Append a section to a normalized lab. The header's sectionCount is
+    incremented atomically and gives the new section its position. The
+    section is inserted into the generation that was read, and kept only if
+    the header still points at it afterwards; a full content write in
+    between discards it and the append is retried.
+    Returns the updated header, or None if the lab could not be written.
+    """
+    for _ in range(max_attempts):
+        header = await mutate_normalized_header(
+            lab_id,
+            current_user,
+            {"$set": {"updatedAt": datetime.now().isoformat()}, "$inc": {"sectionCount": 1}}
+        )
+        if not header:
+            return None
+
+        generation = header.get("contentGeneration")
+        position = header["sectionCount"] - 1
+        section_doc = {key: value for key, value in section.items() if key != "modules"}
+        if default_order:
+            section_doc["order"] = position
+        result = await get_sections_collection().insert_one({
+            **section_doc,
+            "labId": lab_id,
+            "generation": generation,
+            "position": position
+        })
+
+        settled = await _settle_normalized_header(lab_id, current_user, {"contentGeneration": generation})
+        if settled:
+            return settled
+        await get_sections_collection().delete_one({"_id": result.inserted_id})
+
+    raise ValueError("The lab kept changing while the section was added; try again")
+
+async def _touch_normalized_header(
+    lab_id: str,
+    current_user: User,
+    extra_filter: Optional[Dict[str, Any]] = None
+) -> Optional[Dict[str, Any]]:
+    # Authorizes the write and bumps the lab version before a section or
+    # module document is changed
+    return await mutate_normalized_header(
+        lab_id,
+        current_user,
+        {"$set": {"updatedAt": datetime.now().isoformat()}},
+        extra_filter=extra_filter,
+        projection={"_id": 0, "id": 1, "contentGeneration": 1}
+    )
+
+# Header fields returned once a section or module write has settled
+SETTLED_PROJECTION = {"_id": 0, "id": 1, "version": 1, "contentGeneration": 1}
+
+async def _settle_normalized_header(
+    lab_id: str,
+    current_user: User,
+    extra_filter: Optional[Dict[str, Any]] = None,
+    increments: Optional[Dict[str, int]] = None,
+    **kwargs
+) -> Optional[Dict[str, Any]]:
+    # Bumps the version again once a section or module document is written:
+    # a reader that fetched the lab between _touch_normalized_header and the
+    # write may have cached the old content under the touched version
+    update = {"$set": {"updatedAt": datetime.now().isoformat()}}
+    if increments:
+        update["$inc"] = increments
+    return await mutate_lab(
+        lab_id,
+        current_user,
+        update,
+        extra_filter={"storage": NORMALIZED, **(extra_filter or {})},
+        **kwargs
+    )
+
+async def patch_normalized_section(
+    lab_id: str,
+    current_user: User,
+    section_id: str,
+    update: Dict[str, Any]
+) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """
+    Apply a $set to one section document of a normalized lab.
+    Returns (header, assembled section); either is None when not found.
+    """
+    header = await _touch_normalized_header(lab_id, current_user)
+    if not header:
+        return None, None
+
+    query = {"labId": lab_id, "generation": header.get("contentGeneration")}
+    section = await get_sections_collection().find_one_and_update(
+        {**query, "id": section_id},
+        {"$set": update},
+        return_document=ReturnDocument.AFTER
+    )
+    if not section:
+        return header, None
+    header = await _settle_normalized_header(lab_id, current_user, projection=SETTLED_PROJECTION) or header
+    modules = await get_modules_collection().find({**query, "sectionId": section_id}).to_list(length=None)
+    return header, assemble_sections([section], modules)[0]
+
+async def save_normalized_module(
+    lab_id: str,
+    current_user: User,
+    section_id: str,
+    module: Dict[str, Any]
+) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """
+    Replace a module of a normalized lab by id, keeping its position and
+    order, or append it to the section if no such module exists.
+    Returns (header, module); module is None when the section is missing.
+    """
+    header = await _touch_normalized_header(lab_id, current_user)
+    if not header:
+        return None, None
+
+    query = {"labId": lab_id, "generation": header.get("contentGeneration")}
+    if not await get_sections_collection().find_one({**query, "id": section_id}, {"_id": 1}):
+        return header, None
+
+    # The whole document is replaced, keeping its id, order, creation time
+    # and bookkeeping fields
+    fields = {key: value for key, value in module.items() if key not in ("id", "order", "createdAt")}
+    kept_fields = {
+        key: f"${key}" for key in ("id", "order") + STORAGE_FIELDS
+    }
+    kept_fields["createdAt"] = {"$ifNull": ["$createdAt", {"$literal": module.get("createdAt")}]}
+    previous = await get_modules_collection().find_one_and_update(
+        {**query, "sectionId": section_id, "id": module["id"]},
+        [{"$replaceWith": {"$mergeObjects": [{"$literal": fields}, kept_fields]}}],
+        return_document=ReturnDocument.BEFORE
+    )
+    if previous:
+        header = await _settle_normalized_header(lab_id, current_user, projection=SETTLED_PROJECTION) or header
+        # Every ref of the replaced module is gone; the new module's refs
+        # were taken by the caller
+        await release_refs(collect_refs([{"modules": [previous]}]))
+        return header, {
+            **fields,
+            "id": previous["id"],
+            "order": previous.get("order"),
+            "createdAt": previous.get("createdAt", module.get("createdAt"))
+        }
+
+    position = await get_modules_collection().count_documents({**query, "sectionId": section_id})
+    module_doc = {**module, "order": position}
+    await get_modules_collection().insert_one({
+        **module_doc,
+        **query,
+        "sectionId": section_id,
+        "position": position
+    })
+    header = await _settle_normalized_header(
+        lab_id, current_user, increments={"moduleCount": 1}, projection=SETTLED_PROJECTION
+    ) or header
+    return header, module_doc
+
+async def find_lab_module(
+    lab_id: str,
+    current_user: User,
+    section_id: str,
+    module_id: str
+) -> Tuple[Optional[Dict[str, Any]], bool, Optional[Dict[str, Any]]]:
+    """
+    Fetch one module of a lab the user may access without loading the rest
+    of the lab's content. Embedded labs are narrowed to the module on the
+    server with $filter; normalized labs read the module document directly.
+    Returns (header, section found, module); header is None when the lab
+    is missing or not accessible.
+    """
+    docs = await get_labs_collection().aggregate([
+        {"$match": lab_access_filter(lab_id, current_user)},
+        {"$project": {
+            "_id": 0,
+            "id": 1,
+            "version": 1,
+            "storage": 1,
+            "contentGeneration": 1,
+            "sections": {"$map": {
+                "input": {"$filter": {
+                    "input": {"$ifNull": ["$sections", []]},
+                    "as": "section",
+                    "cond": {"$eq": ["$$section.id", section_id]}
+                }},
+                "as": "section",
+                "in": {"$filter": {
+                    "input": {"$ifNull": ["$$section.modules", []]},
+                    "as": "module",
+                    "cond": {"$eq": ["$$module.id", module_id]}
+                }}
+            }}
+        }}
+    ]).to_list(length=1)
+    if not docs:
+        return None, False, None
+    header = docs[0]
+    matches = header.pop("sections")
+    if not is_normalized(header):
+        module = matches[0][0] if matches and matches[0] else None
+        return header, bool(matches), module
+
+    query = {"labId": lab_id, "generation": header.get("contentGeneration")}
+    module = await get_modules_collection().find_one({**query, "sectionId": section_id, "id": module_id})
+    if module:
+        return header, True, _strip(module)
+    section = await get_sections_collection().find_one({**query, "id": section_id}, {"_id": 1})
+    return header, bool(section), None
+
+async def patch_lab_module(
+    lab_id: str,
+    current_user: User,
+    section_id: str,
+    module_id: str,
+    update: Dict[str, Any],
+    max_attempts: int = 3
+) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """
+    Apply $set paths (from nested_set_fields) to one module of a lab in
+    either layout. The patched module is validated against the model for
+    its type before anything is written, and the write is conditional on
+    the lab version that was read; it is retried if the lab changed.
+    Returns (header, previous module, stored module); header is None when
+    the lab is not accessible and the modules are None when it is missing.
+    Raises ValidationError for a patch that makes the module invalid.
+    """
+    for _ in range(max_attempts):
+        header, _, previous = await find_lab_module(lab_id, current_user, section_id, module_id)
+        if not previous:
+            return header, None, None
+        module = module_adapter.dump_python(module_adapter.validate_python(apply_set_fields(previous, update)))
+        expected = version_filter(header.get("version", 0))
+
+        if normalized_storage_enabled() or is_normalized(header):
+            touched = await _touch_normalized_header(lab_id, current_user, extra_filter=expected)
+            if not touched:
+                continue
+            replaced = await get_modules_collection().find_one_and_update(
+                {
+                    "labId": lab_id,
+                    "generation": touched.get("contentGeneration"),
+                    "sectionId": section_id,
+                    "id": module_id
+                },
+                {"$set": {key: value for key, value in module.items() if key != "id"}},
+                return_document=ReturnDocument.BEFORE
+            )
+            if not replaced:
+                return touched, None, None
+            touched = await _settle_normalized_header(lab_id, current_user, projection=SETTLED_PROJECTION) or touched
+            return touched, _strip(replaced), module
+
+        written = await mutate_lab(
+            lab_id,
+            current_user,
+            {"$set": {
+                "sections.$[section].modules.$[module]": module,
+                "updatedAt": datetime.now().isoformat()
+            }},
+            extra_filter={**expected, "sections": {"$elemMatch": {"id": section_id, "modules.id": module_id}}},
+            array_filters=[{"section.id": section_id}, {"module.id": module_id}],
+            projection={"_id": 0, "id": 1}
+        )
+        if written:
+            return header, previous, module
+
+    raise ValueError("The lab kept changing while the module was updated; try again")
+
+async def _merge_copy(collection, match: Dict[str, Any], fields: Dict[str, Any], unset: Tuple[str, ...] = ()):
+    # Copies matching documents into their own collection with new _ids
+    await collection.aggregate([
+        {"$match": match},
+        {"$unset": ["_id", *unset]},
+        {"$set": fields},
+        {"$merge": {"into": collection.name, "on": "_id", "whenMatched": "fail", "whenNotMatched": "insert"}}
+    ]).to_list(length=None)
+
+async def clone_lab(source: Dict[str, Any], lab_id: str, header_fields: Dict[str, Any]) -> bool:
+    """
+    Copy a lab to lab_id inside the database with aggregation $merge
+    stages, so its content never passes through the application. source is
+    the source lab's header (id, version, storage and contentGeneration);
+    header_fields are aggregation expressions for the copy's author, title
+    and so on. The copy takes its own references to the simulation blobs it shares
+    with the source. Returns False if the source changed while it was being
+    copied, in which case nothing is left behind.
+    """
+    match = {"id": source["id"], **version_filter(source.get("version", 0))}
+    if is_normalized(source):
+        # Content is copied before the header so the copy is never
+        # visible without it
+        content = {"labId": source["id"], "generation": source.get("contentGeneration")}
+        await asyncio.gather(
+            _merge_copy(get_sections_collection(), content, {"labId": lab_id}),
+            _merge_copy(get_modules_collection(), content, {"labId": lab_id})
+        )
+        match["contentGeneration"] = source.get("contentGeneration")
+
+    await _merge_copy(
+        get_labs_collection(),
+        match,
+        {**header_fields, "id": {"$literal": lab_id}},
+        unset=("publishedAt", "deploymentUrl")
+    )
+    copy = await get_labs_collection().find_one(
+        {"id": lab_id},
+        {"_id": 0, **{f"sections.modules.{ref_field}": 1 for ref_field in BLOB_FIELDS.values()}}
+    )
+    if not copy:
+        if is_normalized(source):
+            # The copied content holds no blob references yet
+            await delete_generation(lab_id, source.get("contentGeneration"))
+        return False
+
+    if is_normalized(source):
+        refs = await _module_refs({"labId": lab_id})
+    else:
+        refs = collect_refs(copy.get("sections"))
+    await retain_refs(refs)
+    return True
@@ -0,0 +1,211 @@
+"""
+Lab version history.
+
+Every content write records the lab's new version in ``lab_versions``. Most
+records are JSON diffs against the previously recorded version; every
+LAB_VERSION_KEYFRAME_INTERVAL versions (or whenever a diff would not be
+smaller than the content) a full keyframe is stored instead. Reconstructing
+a version reads its keyframe and the diffs after it, so its cost is bounded
+by the keyframe interval, and storage grows with the size of the edits.
+
+Recorded content is the lab as stored: simulation modules hold blob refs.
+Each record takes a blob reference for every ref its content introduces,
+so old versions stay restorable; the references are released when the
+lab's history is deleted.
+"""
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+from database import get_labs_collection, get_lab_versions_collection
+from models.user import User
+from utils.blob_store import collect_refs, retain_refs, release_refs
+from utils.lab_storage import assemble_lab_documents
+
+logger = logging.getLogger(__name__)
+
+LAB_VERSION_KEYFRAME_INTERVAL = int(os.getenv("LAB_VERSION_KEYFRAME_INTERVAL", "20"))
+
+# Lab fields kept in the history
+SNAPSHOT_FIELDS = ("title", "description", "sections")
+
+# Version fields returned to clients
+LAB_VERSION_PROJECTION = {"_id": 0, "version": 1, "kind": 1, "size": 1, "author": 1, "createdAt": 1}
+
+def _is_keyed_list(value: Any) -> bool:
+    if not isinstance(value, list) or not all(isinstance(item, dict) and "id" in item for item in value):
+        return False
+    return len({item["id"] for item in value}) == len(value)
+
+def diff_json(old: Any, new: Any) -> Optional[Dict[str, Any]]:
+    """
+    Patch turning old into new, or None if they are equal. Objects are
+    diffed field by field and lists of objects with ids (sections, modules)
+    item by item, so an edit to one module only records that edit.
+    """
+    if old == new:
+        return None
+    if isinstance(old, dict) and isinstance(new, dict):
+        fields = {}
+        for key, value in new.items():
+            if key not in old:
+                fields[key] = {"set": value}
+            else:
+                patch = diff_json(old[key], value)
+                if patch is not None:
+                    fields[key] = patch
+        patch = {}
+        if fields:
+            patch["fields"] = fields
+        removed = [key for key in old if key not in new]
+        if removed:
+            patch["unset"] = removed
+        return patch
+    if _is_keyed_list(old) and _is_keyed_list(new):
+        old_items = {item["id"]: item for item in old}
+        changed = []
+        added = []
+        for item in new:
+            if item["id"] in old_items:
+                patch = diff_json(old_items[item["id"]], item)
+                if patch is not None:
+                    changed.append([item["id"], patch])
+            else:
+                added.append(item)
+        return {"order": [item["id"] for item in new], "changed": changed, "added": added}
+    return {"set": new}
+
+def apply_diff(value: Any, patch: Dict[str, Any]) -> Any:
+    """Apply a patch made by diff_json"""
+    if "set" in patch:
+        return patch["set"]
+    if "order" in patch:
+        items = {item["id"]: item for item in value or []}
+        for item in patch["added"]:
+            items[item["id"]] = item
+        changed = {item_id: item_patch for item_id, item_patch in patch["changed"]}
+        return [
+            apply_diff(items[item_id], changed[item_id]) if item_id in changed else items[item_id]
+            for item_id in patch["order"]
+        ]
+    removed = set(patch.get("unset", ()))
+    result = {key: item for key, item in (value or {}).items() if key not in removed}
+    for key, field_patch in patch.get("fields", {}).items():
+        result[key] = apply_diff(result.get(key), field_patch)
+    return result
+
+def _size(value: Any) -> int:
+    return len(json.dumps(value, separators=(",", ":"), default=str))
+
+def _snapshot_refs(snapshot: Optional[Dict[str, Any]]) -> set:
+    return set(collect_refs((snapshot or {}).get("sections")))
+
+async def reconstruct_version(lab_id: str, version: int) -> Optional[Dict[str, Any]]:
+    """Rebuild a recorded version's content from its keyframe and the diffs after it"""
+    versions = get_lab_versions_collection()
+    target = await versions.find_one({"labId": lab_id, "version": version}, {"_id": 0, "keyframe": 1})
+    if not target:
+        return None
+    records = {
+        record["version"]: record
+        async for record in versions.find(
+            {"labId": lab_id, "version": {"$gte": target["keyframe"], "$lte": version}},
+            {"_id": 0, "version": 1, "kind": 1, "base": 1, "content": 1, "patch": 1}
+        )
+    }
+    # Follow the diff chain back to the keyframe, then apply it forwards
+    chain = []
+    record = records[version]
+    while record["kind"] != "keyframe":
+        chain.append(record)
+        record = records[record["base"]]
+    content = record["content"]
+    for record in reversed(chain):
+        content = apply_diff(content, record["patch"])
+    return content
+
+async def record_lab_version(lab_id: str, current_user: User, lab: Optional[Dict[str, Any]] = None):
+    """
+    Record a lab's current version in its history. lab may be passed when
+    the caller already has the stored lab at its new version; otherwise it
+    is read. Failures are logged, never raised: history must not fail writes.
+    """
+    try:
+        if lab is None:
+            lab = await get_labs_collection().find_one(
+                {"id": lab_id},
+                {"_id": 0, "id": 1, "version": 1, "storage": 1, "contentGeneration": 1,
+                 **{field: 1 for field in SNAPSHOT_FIELDS}}
+            )
+            if not lab:
+                return
+            await assemble_lab_documents([lab])
+        version = lab.get("version", 0)
+        snapshot = {field: lab.get(field) for field in SNAPSHOT_FIELDS}
+
+        versions = get_lab_versions_collection()
+        latest = await versions.find_one(
+            {"labId": lab_id},
+            {"_id": 0, "version": 1, "keyframe": 1, "depth": 1},
+            sort=[("version", -1)]
+        )
+        if latest and latest["version"] >= version:
+            return
+        base = await reconstruct_version(lab_id, latest["version"]) if latest else None
+        patch = diff_json(base, snapshot) if base is not None else None
+        if base is not None and patch is None:
+            # Only fields outside the history changed
+            return
+
+        record = {
+            "labId": lab_id,
+            "version": version,
+            "author": {"id": current_user.id, "name": current_user.name},
+            "createdAt": datetime.now().isoformat(),
+            "refs": sorted(_snapshot_refs(snapshot) - _snapshot_refs(base))
+        }
+        if (
+            latest is None
+            or latest["depth"] + 1 >= LAB_VERSION_KEYFRAME_INTERVAL
+            or _size(patch) >= _size(snapshot)
+        ):
+            record.update({"kind": "keyframe", "keyframe": version, "depth": 0, "content": snapshot, "size": _size(snapshot)})
+        else:
+            record.update({
+                "kind": "diff",
+                "base": latest["version"],
+                "keyframe": latest["keyframe"],
+                "depth": latest["depth"] + 1,
+                "patch": patch,
+                "size": _size(patch)
+            })
+
+        await retain_refs(record["refs"])
+        try:
+            await versions.insert_one(record)
+        except DuplicateKeyError:
+            # A concurrent write recorded this version first
+            await release_refs(record["refs"])
+    except Exception as e:
+        logger.error(f"Could not record version of lab {lab_id}: {e}")
+
+async def list_lab_versions(lab_id: str, limit: int = 50, before: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Recorded versions of a lab, newest first"""
+    query = {"labId": lab_id}
+    if before is not None:
+        query["version"] = {"$lt": before}
+    cursor = get_lab_versions_collection().find(query, LAB_VERSION_PROJECTION).sort("version", -1).limit(limit)
+    return await cursor.to_list(length=limit)
+
+async def delete_lab_versions(lab_ids: List[str]):
+    """Delete the history of labs and release the blob references it held"""
+    versions = get_lab_versions_collection()
+    refs = []
+    async for record in versions.find({"labId": {"$in": lab_ids}}, {"_id": 0, "refs": 1}):
+        refs.extend(record.get("refs") or [])
+    await versions.delete_many({"labId": {"$in": lab_ids}})
+    await release_refs(refs)
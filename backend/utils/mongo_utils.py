@@ -2,9 +2,28 @@
 Utility functions for MongoDB document serialization.
 """
 from bson import ObjectId
+from bson.codec_options import CodecOptions, TypeDecoder, TypeRegistry
 import json
 from datetime import datetime
 
+class ObjectIdDecoder(TypeDecoder):
+    """Decode ObjectId values to their hex string"""
+    bson_type = ObjectId
+
+    def transform_bson(self, value):
+        return str(value)
+
+class DatetimeDecoder(TypeDecoder):
+    """Decode BSON dates to ISO 8601 strings, like the timestamps the API stores"""
+    bson_type = datetime
+
+    def transform_bson(self, value):
+        return value.isoformat()
+
+# Codec options for the application database: documents come out of the BSON
+# decoder already JSON-compatible, with no recursive pass over them afterwards
+JSON_CODEC_OPTIONS = CodecOptions(type_registry=TypeRegistry([ObjectIdDecoder(), DatetimeDecoder()]))
+
 class MongoJSONEncoder(json.JSONEncoder):
     """
     JSONEncoder subclass that knows how to encode MongoDB-specific types.
@@ -20,6 +39,10 @@ def serialize_mongo_doc(doc):
     """
     Serialize a MongoDB document to a JSON-compatible dictionary.
     Converts ObjectId to string and handles other MongoDB-specific types.
+
+    Documents read through the application database are already decoded
+    this way (see JSON_CODEC_OPTIONS); this is only needed for documents
+    from other clients.
     """
     if doc is None:
         return None
@@ -0,0 +1,39 @@
+"""
+Helpers for opaque keyset (cursor) pagination.
+"""
+import base64
+import json
+from typing import Any, Dict, Optional, Tuple
+
+def encode_cursor(updated_at: str, lab_id: str) -> str:
+    """
+    Encode the sort key of the last item on a page into an opaque cursor.
+    """
+    payload = json.dumps({"u": updated_at, "i": lab_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    """
+    Decode a cursor produced by encode_cursor into its (updatedAt, id) pair.
+    Raises ValueError if the cursor is malformed.
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return payload["u"], payload["i"]
+    except Exception:
+        raise ValueError("Invalid pagination cursor")
+
+def keyset_filter(cursor: Optional[str]) -> Dict[str, Any]:
+    """
+    Build the filter selecting items strictly after the cursor position in
+    (updatedAt desc, id desc) order. Returns an empty filter without a cursor.
+    """
+    if not cursor:
+        return {}
+    updated_at, lab_id = decode_cursor(cursor)
+    return {
+        "$or": [
+            {"updatedAt": {"$lt": updated_at}},
+            {"updatedAt": updated_at, "id": {"$lt": lab_id}}
+        ]
+    }
@@ -0,0 +1,150 @@
+"""
+Public snapshots of published labs.
+
+Deploying a lab renders the published lab once, with its simulations
+inlined, and stores the encoded response pre-compressed with gzip and (when
+the ``brotli`` package is installed) brotli in ``public_snapshots``.
+GET /public/labs/{id} then only picks the encoding the client accepts and
+copies the stored bytes; nothing is assembled, hydrated, encoded or
+compressed per request. The uncompressed body is only produced for the rare
+client that accepts neither encoding.
+
+A lab has one snapshot, that of its latest deployment. It is removed when
+the lab is unpublished or deleted.
+"""
+import asyncio
+import gzip
+import hashlib
+import logging
+import os
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from pymongo.errors import DuplicateKeyError
+
+from database import get_public_snapshots_collection
+from models.lab import Lab
+from utils.blob_store import hydrate_sections
+from utils.fast_responses import trusted_payload, dumps
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# How long shared caches may serve GET /public/labs/{id} without revalidating
+PUBLIC_LAB_MAX_AGE = int(os.getenv("PUBLIC_LAB_MAX_AGE", "60"))
+# Stored encodings must fit in one MongoDB document
+PUBLIC_SNAPSHOT_MAX_BYTES = 15 * 1024 * 1024
+
+# Content-Encoding -> snapshot field, in order of preference
+SNAPSHOT_ENCODINGS = {"br": "br", "gzip": "gzip"}
+
+def encode_snapshot(body: bytes) -> Dict[str, Any]:
+    """Compress a snapshot body into every stored encoding (CPU bound)"""
+    encodings = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        encodings["br"] = brotli.compress(body, quality=11)
+    return encodings
+
+def snapshot_etag(digest: str, encoding: str) -> str:
+    """Strong ETag of one encoding of a snapshot; each encoding gets its own"""
+    if encoding == "identity":
+        return f'"{digest}"'
+    return f'"{digest}-{encoding}"'
+
+def negotiate_encoding(accept_encoding: Optional[str], available) -> str:
+    """
+    Pick the stored encoding the client accepts with the highest q-value,
+    or "identity" if it accepts none. Ties go to SNAPSHOT_ENCODINGS order.
+    """
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding] = quality
+    candidates = [
+        encoding for encoding in SNAPSHOT_ENCODINGS
+        if encoding in available and accepted.get(encoding, accepted.get("*", 0.0)) > 0
+    ]
+    if not candidates:
+        return "identity"
+    return max(candidates, key=lambda encoding: accepted.get(encoding, accepted.get("*", 0.0)))
+
+async def store_public_snapshot(lab: Dict[str, Any]) -> bool:
+    """
+    Render and store the snapshot of a lab as published. lab is the assembled
+    lab document at the deployed version. A snapshot of a newer version that
+    is already stored is kept. Returns False if the lab is too large to store.
+    """
+    payload = trusted_payload(Lab, {**lab, "sections": await hydrate_sections(lab.get("sections"))})
+    # Public readers do not see the author's email
+    author = lab.get("author") or {}
+    payload["author"] = {"id": author.get("id"), "name": author.get("name")}
+    body = dumps({"success": True, "data": payload, "error": None})
+    encodings = await asyncio.to_thread(encode_snapshot, body)
+
+    lab_id = lab["id"]
+    version = lab.get("version", 0)
+    if sum(len(data) for data in encodings.values()) > PUBLIC_SNAPSHOT_MAX_BYTES:
+        logger.warning(f"Public snapshot of lab {lab_id} is too large to store; it is not served publicly")
+        await delete_public_snapshots([lab_id])
+        return False
+    try:
+        await get_public_snapshots_collection().replace_one(
+            {"_id": lab_id, "version": {"$lt": version}},
+            {
+                "labId": lab_id,
+                "version": version,
+                "digest": hashlib.sha256(body).hexdigest()[:32],
+                "size": len(body),
+                "encodings": list(encodings),
+                "createdAt": datetime.now().isoformat(),
+                **encodings
+            },
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # A later deployment already stored its snapshot
+        pass
+    return True
+
+async def _find_snapshot(lab_id: str, field: str) -> Optional[Dict[str, Any]]:
+    return await get_public_snapshots_collection().find_one(
+        {"_id": lab_id},
+        {"_id": 0, "version": 1, "digest": 1, "encodings": 1, field: 1}
+    )
+
+async def read_public_snapshot(lab_id: str, accept_encoding: Optional[str]) -> Optional[Tuple[Dict[str, Any], str, bytes]]:
+    """
+    Fetch a lab's snapshot in the best encoding the client accepts, reading
+    only that encoding's bytes. Returns (snapshot, encoding, body) or None.
+    """
+    encoding = negotiate_encoding(accept_encoding, SNAPSHOT_ENCODINGS)
+    snapshot = await _find_snapshot(lab_id, SNAPSHOT_ENCODINGS.get(encoding, "gzip"))
+    if not snapshot:
+        return None
+    if encoding != "identity" and snapshot.get(SNAPSHOT_ENCODINGS[encoding]) is None:
+        # Stored by a process without brotli
+        encoding = negotiate_encoding(accept_encoding, snapshot.get("encodings") or ())
+        snapshot = await _find_snapshot(lab_id, SNAPSHOT_ENCODINGS.get(encoding, "gzip"))
+        if not snapshot:
+            return None
+    if encoding == "identity":
+        return snapshot, encoding, gzip.decompress(snapshot["gzip"])
+    return snapshot, encoding, bytes(snapshot[SNAPSHOT_ENCODINGS[encoding]])
+
+async def delete_public_snapshots(lab_ids):
+    """Stop serving labs publicly"""
+    await get_public_snapshots_collection().delete_many({"_id": {"$in": list(lab_ids)}})
@@ -0,0 +1,226 @@
+"""
+Incremental static-site builds.
+
+Every section and module gets a content hash. A module hash covers the
+stored module, whose simulation fields are already content-addressed blob
+refs; a section hash covers the section's title and position plus its module
+hashes in order. Rendered fragments are cached per lab in ``build_fragments``
+under those hashes, so a build re-renders only the sections and modules whose
+hash changed and reuses the cached HTML for everything else. The hashes and
+a report of what was rebuilt are recorded in a per-lab build manifest in
+``lab_builds``.
+"""
+import hashlib
+import json
+import logging
+import time
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Set, Tuple
+
+from pymongo.errors import BulkWriteError
+
+from database import get_lab_builds_collection, get_build_fragments_collection
+from utils.static_export import TEMPLATES, STYLESHEET, ordered_sections, render_module, render_section
+
+logger = logging.getLogger(__name__)
+
+# Changing a template invalidates every cached fragment
+TEMPLATE_VERSION = hashlib.sha256(
+    (json.dumps(TEMPLATES, sort_keys=True) + STYLESHEET).encode("utf-8")
+).hexdigest()[:16]
+
+def content_hash(value: Any) -> str:
+    canonical = json.dumps(value, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+# Section fields that affect its rendering, apart from its modules
+SECTION_HASH_FIELDS = ("id", "title", "order")
+
+def section_hash(section: Dict[str, Any], module_hashes: List[str]) -> str:
+    fields = {key: section.get(key) for key in SECTION_HASH_FIELDS}
+    return content_hash({"section": fields, "modules": module_hashes})
+
+def fragment_id(lab_id: str, kind: str, digest: str) -> str:
+    return f"{lab_id}:{TEMPLATE_VERSION}:{kind}:{digest}"
+
+class SiteBuild:
+    """
+    A planned build of one lab. Which fragments are cached is looked up when
+    the build is planned, so its report is known before anything is rendered;
+    sections() then renders the section HTML one section at a time and records
+    the build manifest after the last one.
+    """
+
+    def __init__(self, lab: Dict[str, Any], plan: List[Tuple[Dict[str, Any], List[str], str]],
+                 cached_ids: Set[str], started: float):
+        self.lab = lab
+        self.plan = plan
+        self.cached_ids = cached_ids
+        self.started = started
+        lab_id = lab["id"]
+
+        # Module fragments are rendered once, in the first changed section
+        # that uses them, and read back from the cache after that
+        rebuilt_sections = []
+        rebuilt_modules = []
+        planned = set()
+        for section, module_hashes, digest in plan:
+            if fragment_id(lab_id, "section", digest) in cached_ids:
+                continue
+            rebuilt_sections.append(section.get("id"))
+            for module, module_hash in zip(section["modules"], module_hashes):
+                module_id = fragment_id(lab_id, "module", module_hash)
+                if module_id not in cached_ids and module_id not in planned:
+                    planned.add(module_id)
+                    rebuilt_modules.append(module.get("id"))
+
+        module_count = sum(len(module_hashes) for _, module_hashes, _ in plan)
+        self.report = {
+            "rebuiltSections": rebuilt_sections,
+            "rebuiltModules": rebuilt_modules,
+            "reusedSections": len(plan) - len(rebuilt_sections),
+            "reusedModules": module_count - len(rebuilt_modules),
+            "durationMs": round((time.perf_counter() - started) * 1000, 2)
+        }
+
+    async def sections(self) -> AsyncIterator[str]:
+        """Yield the section HTML in display order, rendering changed sections"""
+        lab_id = self.lab["id"]
+        fragments = get_build_fragments_collection()
+        live_ids = set()
+        for section, module_hashes, digest in self.plan:
+            section_id = fragment_id(lab_id, "section", digest)
+            module_ids = [fragment_id(lab_id, "module", module_hash) for module_hash in module_hashes]
+            live_ids.add(section_id)
+            live_ids.update(module_ids)
+
+            html = None
+            if section_id in self.cached_ids:
+                doc = await fragments.find_one({"_id": section_id})
+                html = doc["html"] if doc else None
+            if html is None:
+                html = await self._render_section(section, section_id, module_ids)
+            yield html
+
+        # Drop fragments of content that no longer exists
+        if self.report["rebuiltSections"]:
+            await fragments.delete_many({"labId": lab_id, "_id": {"$nin": list(live_ids)}})
+        await self._record()
+
+    async def _render_section(self, section: Dict[str, Any], section_id: str,
+                              module_ids: List[str]) -> str:
+        """Render a changed section from its cached or newly rendered modules"""
+        lab_id = self.lab["id"]
+        fragments = get_build_fragments_collection()
+        cached = {doc["_id"]: doc["html"] async for doc in fragments.find({"_id": {"$in": module_ids}})}
+
+        new_fragments = {}
+        module_html = []
+        for module, module_id in zip(section["modules"], module_ids):
+            fragment = cached.get(module_id) or new_fragments.get(module_id)
+            if fragment is None:
+                fragment = render_module(module)
+                new_fragments[module_id] = fragment
+            module_html.append(fragment)
+        html = render_section(section, module_html)
+        new_fragments[section_id] = html
+
+        try:
+            await fragments.insert_many(
+                [{"_id": _id, "labId": lab_id, "html": fragment} for _id, fragment in new_fragments.items()],
+                ordered=False
+            )
+        except BulkWriteError:
+            # A concurrent build of the same content stored them first
+            pass
+        return html
+
+    async def _record(self):
+        """Store the build manifest with the final report"""
+        lab_id = self.lab["id"]
+        report = self.report
+        report["durationMs"] = round((time.perf_counter() - self.started) * 1000, 2)
+        await get_lab_builds_collection().replace_one(
+            {"_id": lab_id},
+            {
+                "labId": lab_id,
+                "labVersion": self.lab.get("version", 0),
+                "templateVersion": TEMPLATE_VERSION,
+                "sections": [
+                    {
+                        "id": section.get("id"),
+                        "hash": digest,
+                        "modules": [
+                            {"id": module.get("id"), "hash": module_hash}
+                            for module, module_hash in zip(section["modules"], module_hashes)
+                        ]
+                    }
+                    for section, module_hashes, digest in self.plan
+                ],
+                "report": report,
+                "builtAt": datetime.now().isoformat()
+            },
+            upsert=True
+        )
+        logger.info(
+            f"Built lab {lab_id}: {len(report['rebuiltSections'])} sections and "
+            f"{len(report['rebuiltModules'])} modules rebuilt in {report['durationMs']}ms"
+        )
+
+async def plan_lab_site(lab: Dict[str, Any]) -> SiteBuild:
+    """
+    Hash a lab's sections and modules and look up which fragments are cached.
+    Expects the lab as stored (simulation content not hydrated). Only fragment
+    ids are read here; the cached HTML is fetched one section at a time.
+    """
+    started = time.perf_counter()
+    lab_id = lab["id"]
+    fragments = get_build_fragments_collection()
+
+    plan = []
+    for section in ordered_sections(lab):
+        module_hashes = [content_hash(module) for module in section["modules"]]
+        plan.append((section, module_hashes, section_hash(section, module_hashes)))
+
+    # Module fragments are only needed for sections that changed
+    section_ids = [fragment_id(lab_id, "section", digest) for _, _, digest in plan]
+    cached_ids = {doc["_id"] async for doc in fragments.find({"_id": {"$in": section_ids}}, {"_id": 1})}
+    module_ids = [
+        fragment_id(lab_id, "module", digest)
+        for (_, module_hashes, _), section_id in zip(plan, section_ids)
+        if section_id not in cached_ids
+        for digest in module_hashes
+    ]
+    if module_ids:
+        async for doc in fragments.find({"_id": {"$in": module_ids}}, {"_id": 1}):
+            cached_ids.add(doc["_id"])
+    return SiteBuild(lab, plan, cached_ids, started)
+
+async def build_lab_site(lab: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Render a lab's changed fragments into the cache without keeping the
+    section HTML, and return the build report
+    """
+    build = await plan_lab_site(lab)
+    async for _ in build.sections():
+        pass
+    return build.report
+
+def build_report_headers(report: Dict[str, Any]) -> Dict[str, str]:
+    """Summarize a build report in response headers"""
+    return {
+        "X-Build-Rebuilt-Sections": str(len(report["rebuiltSections"])),
+        "X-Build-Rebuilt-Modules": str(len(report["rebuiltModules"])),
+        "X-Build-Reused-Sections": str(report["reusedSections"]),
+        "X-Build-Reused-Modules": str(report["reusedModules"]),
+        "X-Build-Duration-Ms": str(report["durationMs"])
+    }
+
+async def delete_lab_builds(lab_id: str):
+    """Remove a lab's build manifest and cached fragments"""
+    await delete_labs_builds([lab_id])
+
+async def delete_labs_builds(lab_ids: List[str]):
+    """Remove the build manifests and cached fragments of several labs"""
+    await get_build_fragments_collection().delete_many({"labId": {"$in": lab_ids}})
+    await get_lab_builds_collection().delete_many({"_id": {"$in": lab_ids}})
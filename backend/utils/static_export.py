@@ -0,0 +1,172 @@
+"""
+Static-site export engine.
+
+Renders a lab to a self-contained static site (an index page, a stylesheet
+and one page per simulation) and streams it out as a zip archive. Templates
+are compiled once per process and render one fragment per section and
+module, so builds can reuse fragments whose content has not changed (see
+utils.site_builds). The archive is produced incrementally and never touches
+the disk.
+"""
+import re
+import zipfile
+from typing import Any, AsyncIterable, AsyncIterator, Dict, List
+
+from jinja2 import DictLoader, Environment, select_autoescape
+
+from utils.blob_store import hydrate_module
+
+STYLESHEET = """\
+body { font-family: Arial, sans-serif; max-width: 960px; margin: 0 auto; padding: 2rem; line-height: 1.5; }
+.section { margin-top: 2.5rem; }
+.module { margin: 1.5rem 0; }
+.quiz-question { margin-bottom: 1rem; }
+.quiz-explanation { color: #555; font-style: italic; }
+.simulation-module iframe, .video-module iframe { width: 100%; min-height: 480px; border: 0; }
+figure img { max-width: 100%; }
+"""
+
+TEMPLATES = {
+    "header.html": """\
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="utf-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1">
+    <title>{{ lab.title }}</title>
+    <link rel="stylesheet" href="styles.css">
+</head>
+<body>
+    <h1>{{ lab.title }}</h1>
+    <p>{{ lab.description }}</p>
+""",
+    "section.html": """\
+    <div class="section" id="section-{{ section.id }}">
+        <h2>{{ section.title }}</h2>
+        {% for fragment in module_html %}{{ fragment | safe }}{% endfor %}
+    </div>
+""",
+    "module.html": """\
+        <div class="module {{ module.type }}-module" id="module-{{ module.id }}">
+            <h3>{{ module.title }}</h3>
+            {% if module.type == "text" %}
+            {{ module.content | safe }}
+            {% elif module.type == "quiz" %}
+            {% for question in module.questions %}
+            <div class="quiz-question">
+                <p>{{ loop.index }}. {{ question.text }}</p>
+                <ul>
+                    {% for option in question.options %}<li>{{ option.text }}</li>{% endfor %}
+                </ul>
+                {% if question.explanation %}<p class="quiz-explanation">{{ question.explanation }}</p>{% endif %}
+            </div>
+            {% endfor %}
+            {% elif module.type == "image" %}
+            <figure>
+                <img src="{{ module.url }}" alt="{{ module.altText or '' }}">
+                {% if module.caption %}<figcaption>{{ module.caption }}</figcaption>{% endif %}
+            </figure>
+            {% elif module.type == "video" %}
+            {% if module.provider in ("youtube", "vimeo") %}
+            <iframe src="{{ module.url }}" allowfullscreen></iframe>
+            {% else %}
+            <video src="{{ module.url }}" controls></video>
+            {% endif %}
+            {% if module.caption %}<p>{{ module.caption }}</p>{% endif %}
+            {% elif module.type == "simulation" %}
+            {% if module.description %}<p>{{ module.description }}</p>{% endif %}
+            <iframe src="simulations/{{ module.id }}.html" title="{{ module.title }}" sandbox="allow-scripts"></iframe>
+            {% endif %}
+        </div>
+""",
+    "footer.html": """\
+</body>
+</html>
+"""
+}
+
+# Compiled once per process; Jinja keeps the compiled templates in its cache
+template_env = Environment(
+    loader=DictLoader(TEMPLATES),
+    autoescape=select_autoescape(default=True),
+    auto_reload=False,
+    keep_trailing_newline=True,
+    trim_blocks=True,
+    lstrip_blocks=True
+)
+
+def render_header(lab: Dict[str, Any]) -> str:
+    return template_env.get_template("header.html").render(lab=lab)
+
+def render_module(module: Dict[str, Any]) -> str:
+    return template_env.get_template("module.html").render(module=module)
+
+def render_section(section: Dict[str, Any], module_html: List[str]) -> str:
+    """Render a section around its already rendered module fragments"""
+    return template_env.get_template("section.html").render(section=section, module_html=module_html)
+
+def render_footer(lab: Dict[str, Any]) -> str:
+    return template_env.get_template("footer.html").render(lab=lab)
+
+def ordered_sections(lab: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """The lab's sections, and each section's modules, in display order"""
+    return [
+        {**section, "modules": sorted(section.get("modules") or [], key=lambda module: module.get("order", 0))}
+        for section in sorted(lab.get("sections") or [], key=lambda section: section.get("order", 0))
+    ]
+
+def export_filename(title: str) -> str:
+    """Download filename for a lab export, safe for a Content-Disposition header"""
+    return f"{re.sub(r'[^A-Za-z0-9_-]+', '_', title).strip('_') or 'lab'}_export.zip"
+
+class ZipChunkStream:
+    """
+    Write-only file object that collects the bytes zipfile writes so they can
+    be handed to the response as they are produced. zipfile sees that it
+    cannot seek and writes data descriptors instead of rewinding.
+    """
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+async def stream_static_site(lab: Dict[str, Any], section_html: AsyncIterable[str]) -> AsyncIterator[bytes]:
+    """
+    Yield a lab's static site as zip archive chunks, writing each section
+    fragment into the archive as it is rendered, in display order. Simulation
+    content is loaded from the blob store one module at a time.
+    """
+    stream = ZipChunkStream()
+    with zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("styles.css", STYLESHEET)
+
+        with zf.open("index.html", "w") as index:
+            index.write(render_header(lab).encode("utf-8"))
+            async for html in section_html:
+                index.write(html.encode("utf-8"))
+                chunk = stream.drain()
+                if chunk:
+                    yield chunk
+            index.write(render_footer(lab).encode("utf-8"))
+        yield stream.drain()
+
+        for section in lab.get("sections") or []:
+            for module in section.get("modules") or []:
+                if module.get("type") != "simulation":
+                    continue
+                module = await hydrate_module(module)
+                zf.writestr(f"simulations/{module['id']}.html", module.get("htmlContent") or "")
+                yield stream.drain()
+    # Closing the archive writes the central directory
+    yield stream.drain()
@@ -491,10 +491,14 @@ export const createSection = async (token: string, labId: string, sectionData: a
 };
 
 /**
- * Update lab content including sections and modules
+ * Update lab content including sections and modules.
+ * With autosave, the server acknowledges right away (202) and coalesces
+ * rapid saves of the lab into one write; a failed 412 means an earlier
+ * autosave was lost and the lab should be reloaded.
  */
-export const updateLabContent = async (token: string, labId: string, contentData: any): Promise<ApiResponse<any>> => {
-  const response = await fetchWithAuth(`${API_BASE_URL}/labs/${labId}/update-content`, {
+export const updateLabContent = async (token: string, labId: string, contentData: any, autosave = false): Promise<ApiResponse<any>> => {
+  const query = autosave ? '?autosave=true' : '';
+  const response = await fetchWithAuth(`${API_BASE_URL}/labs/${labId}/update-content${query}`, {
     method: 'POST',
     token,
     body: JSON.stringify(contentData),
@@ -3,7 +3,7 @@
 import React, { useEffect, useState, useRef } from "react";
 import { useParams, useRouter } from "next/navigation";
 import Link from "next/link";
-import { getLab, updateLab, deployLab } from "@/api/apiClient";
+import { getLab, updateLab, updateLabContent, deployLab } from "@/api/apiClient";
 import { 
   Lab, 
   Module, 
@@ -24,6 +24,9 @@ import ExportLabButton from "@/components/ExportLabButton";
 import LabPreview from "@/components/LabPreview";
 import ChatbotComponent from "@/components/ChatbotComponent";
 
+// Section edits are autosaved once typing pauses for this long
+const AUTOSAVE_DELAY_MS = 1000;
+
 export default function EditLabPage() {
   const { theme } = useTheme();
   const { token } = useAuth();
@@ -121,6 +124,25 @@ export default function EditLabPage() {
     }
   }, [sections, originalLab]);
 
+  // Autosave section edits after a pause; the server coalesces these saves
+  // and reports one that could not be written on the next save
+  useEffect(() => {
+    if (!lab || !token || !originalLab) return;
+    if (JSON.stringify(sections) === JSON.stringify(originalLab.sections)) return;
+    
+    const timer = setTimeout(async () => {
+      const response = await updateLabContent(token, lab.id, { sections }, true);
+      if (!response.success) {
+        setSaveFeedback({
+          show: true,
+          message: response.error || "Failed to autosave changes",
+          isError: true
+        });
+      }
+    }, AUTOSAVE_DELAY_MS);
+    return () => clearTimeout(timer);
+  }, [sections]);
+
   // Add a section
   const addSection = () => {
     const newSection = createSection({